@@ -20,6 +20,8 @@ services:
     container_name: "{container_name}"
     environment:
       MARIAN_MODEL_NAME: "{marian_model_name}"
+      MODELS_PROFILE: "{models_profile}"
+      CPU_PROFILE_THREADS: "{cpu_threads}"
     volumes:
       - {base_dir}/server-models:/models
     entrypoint: ['python', '-m', 'uvicorn',
@@ -28,14 +30,17 @@ services:
                  '--port', '8000']
     ports:
       - "8000:8000"
+{gpu_reservation}volumes:
+  server-models:
+"""
+
+GPU_RESERVATION = """\
     deploy:
       resources:
         reservations:
           devices:
             - driver: nvidia
               capabilities: [gpu]
-volumes:
-  server-models:
 """
 
 GH_RELEASES_URL = 'https://api.github.com/repos/{repo}/releases'
@@ -102,8 +107,26 @@ def install_assets(assets, models_dir):
         print('Installing asset: ', renamed)
 
 
+def wait_for_api(timeout=300):
+    url = 'http://127.0.0.1:8000/api/health'
+    print('Waiting for the translation model to load ... ', end='', flush=True)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urlopen(url) as response:
+                if response.status == 200:
+                    print('done', flush=True)
+                    return True
+        except (HTTPError, OSError):
+            pass
+        time.sleep(2)
+    print('timed out', flush=True)
+    return False
+
+
 def test_api():
     url = 'http://127.0.0.1:8000/api/translate'
+    wait_for_api()
     req = Request(url, method='HEAD')
     response = urlopen(req)
     if response.status != 200:
@@ -167,6 +190,10 @@ if __name__ == '__main__':
     ap.add_argument('--run', action='store_true')
     ap.add_argument('--stop', action='store_true')
     ap.add_argument('--status', action='store_true')
+    ap.add_argument('--cpu', action='store_true',
+                    help=('Translate on CPU, with a quantized model, '
+                          'instead of an NVIDIA GPU.'))
+    ap.add_argument('--cpu-threads', type=int, default=os.cpu_count() or 4)
     ns = ap.parse_args()
     base_dir = Path(ns.base_dir)
     dirs = setup_directories(base_dir, ns.model_name)
@@ -181,7 +208,11 @@ if __name__ == '__main__':
             env_vars = dict(version=tag_name,
                             marian_model_name=ns.model_name,
                             container_name=ns.container_name,
-                            base_dir=base_dir)
+                            base_dir=base_dir,
+                            models_profile='cpu' if ns.cpu else 'gpu',
+                            cpu_threads=ns.cpu_threads,
+                            gpu_reservation=('' if ns.cpu
+                                             else GPU_RESERVATION))
             configure_docker_compose(ns.repo, env_vars, compose_path)
     uniopts = [ns.status, ns.stop, ns.run]
     if uniopts.count(True) > 1:
@@ -193,7 +224,6 @@ if __name__ == '__main__':
         stop_marian_nmt(ns.base_dir, ns.container_name)
     elif ns.run:
         run_marian_nmt(base_dir, ns.container_name, ns.model_name)
-        time.sleep(1)
         test_api()
     else:
         if not ns.install:
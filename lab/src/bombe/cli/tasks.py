@@ -40,8 +40,19 @@ def download_data(ctx, url):
               help='Number of processes',
               default=4,
               type=int)
+@click.option('--chunk-size',
+              help='Translations held in memory per process',
+              default=sentences.CHUNK_SIZE,
+              type=int)
+@click.option('--dedup-index/--no-dedup-index',
+              help='Drop translations already exported from other files',
+              default=True)
+@click.option('--rebuild',
+              help='Export every file again, not only new or changed ones',
+              is_flag=True,
+              default=False)
 @click.pass_context
-def export_and_clean(ctx, num_procs):
+def export_and_clean(ctx, num_procs, chunk_size, dedup_index, rebuild):
     ts = training_session(ctx.obj)
     params = ts.settings
     dict_dir = params['hunspell_dir']
@@ -51,12 +62,27 @@ def export_and_clean(ctx, num_procs):
     spelling_dir = params['spelling_dir']
     spell_checkers = {lang: SpellCheck(lang, dict_dir, spelling_dir)
                       for lang in ts.langs}
+    index = sentences.dedup_index(export_dir)
+    # Files exported before there was an index may repeat translations.
+    rebuild = rebuild or not index.path.exists()
+    if not dedup_index:
+        # Files exported without the index may repeat translations.
+        index.delete()
+        index = None
+    elif rebuild:
+        index.clear()
+        index.close()
     clean = partial(sentences.clean,
                     ts.langs,
                     spell_checkers,
                     columns,
-                    export_dir)
+                    export_dir,
+                    chunk_size=chunk_size,
+                    index=index)
     source_paths = list(fs.DirectoryTree(data_dir))
+    if not rebuild and index is not None:
+        source_paths = sentences.outdated(export_dir, source_paths, index)
+        index.close()
     pbar = tqdm(total=len(source_paths), desc='Export and clean data')
     with Pool(processes=num_procs) as pool:
         with pbar:
@@ -0,0 +1,181 @@
+"""A persistent index of the sentence pairs exported across all files."""
+from itertools import islice
+from pathlib import Path
+from typing import (Callable, Generator, Iterable, List, Sequence, Set,
+                    Tuple, TypeVar, Union)
+import hashlib
+import sqlite3
+import unicodedata
+
+
+INDEX_FILENAME = 'dedup.sqlite3'
+
+T = TypeVar('T')
+
+
+def normalize_pair(source: str, target: str) -> str:
+    """The form of a sentence pair that duplicates have in common."""
+    return '\t'.join(unicodedata.normalize('NFC', ' '.join(text.split()))
+                     for text in (source, target))
+
+
+def pair_hash(source: str, target: str) -> int:
+    """A 64-bit hash of a sentence pair, stable across processes."""
+    digest = hashlib.blake2b(normalize_pair(source, target).encode('utf-8'),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+class DedupIndex:
+    """A set of hashes of (source, target) pairs, kept in SQLite at `path`.
+
+    Each hash records the file it was exported from (its owner), and
+    every file it was seen in (its origins). A file is exported again
+    by forgetting it, then passing its pairs through `unique`: its
+    pairs are not dropped as duplicates of themselves, while pairs from
+    new files that are already in the index are.
+
+    Several processes may use the same index; the connection is opened
+    in each process when first used.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS origins ('
+        ' id INTEGER PRIMARY KEY,'
+        ' path TEXT NOT NULL UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS pairs ('
+        ' hash INTEGER PRIMARY KEY,'
+        ' origin INTEGER NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS pairs_origin ON pairs (origin)',
+        'CREATE TABLE IF NOT EXISTS seen ('
+        ' hash INTEGER NOT NULL,'
+        ' origin INTEGER NOT NULL,'
+        ' PRIMARY KEY (hash, origin)) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS seen_origin ON seen (origin)',
+    )
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+        self._conn = None
+
+    # Pickle protocol interface - allow use with multiprocessing.
+    # SQLite connections cannot be pickled.
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path),
+                                         timeout=600,
+                                         isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.schema:
+                self._conn.execute(statement)
+        return self._conn
+
+    def __len__(self):
+        (n,) = self.conn.execute('SELECT COUNT(*) FROM pairs').fetchone()
+        return n
+
+    def _origin_id(self, origin: str) -> int:
+        self.conn.execute('INSERT OR IGNORE INTO origins (path) VALUES (?)',
+                          (origin,))
+        (origin_id,) = self.conn.execute(
+            'SELECT id FROM origins WHERE path = ?', (origin,)).fetchone()
+        return origin_id
+
+    def add_many(self, hashes: Sequence[int], origin: str) -> List[bool]:
+        """Add `hashes` seen in `origin`.
+
+        Returns whether each was new, i.e. not already in the index
+        (nor earlier in `hashes`).
+        """
+        added = []
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            origin_id = self._origin_id(origin)
+            for value in hashes:
+                self.conn.execute('INSERT OR IGNORE INTO seen VALUES (?, ?)',
+                                  (value, origin_id))
+                cursor = self.conn.execute(
+                    'INSERT OR IGNORE INTO pairs VALUES (?, ?)',
+                    (value, origin_id))
+                added.append(cursor.rowcount == 1)
+        return added
+
+    def forget(self, origins: Iterable[str]) -> Set[str]:
+        """Remove the pairs of `origins`, before exporting them again.
+
+        Returns the other origins in which pairs owned by `origins`
+        were seen (and dropped). Their pairs are in no export once
+        `origins` have been forgotten, so they need exporting again
+        too.
+        """
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS forgotten'
+                              ' (id INTEGER PRIMARY KEY)')
+            self.conn.execute('DELETE FROM forgotten')
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO forgotten'
+                ' SELECT id FROM origins WHERE path = ?',
+                ((origin,) for origin in origins))
+            affected = self.conn.execute(
+                'SELECT DISTINCT origins.path FROM pairs'
+                ' JOIN seen ON seen.hash = pairs.hash'
+                ' JOIN origins ON origins.id = seen.origin'
+                ' WHERE pairs.origin IN (SELECT id FROM forgotten)'
+                ' AND seen.origin NOT IN (SELECT id FROM forgotten)'
+            ).fetchall()
+            self.conn.execute('DELETE FROM seen'
+                              ' WHERE origin IN (SELECT id FROM forgotten)')
+            self.conn.execute('DELETE FROM pairs'
+                              ' WHERE origin IN (SELECT id FROM forgotten)')
+        return {path for (path,) in affected}
+
+    def clear(self) -> None:
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('DELETE FROM pairs')
+            self.conn.execute('DELETE FROM seen')
+            self.conn.execute('DELETE FROM origins')
+
+    def unique(self,
+               items: Iterable[T],
+               pair: Callable[[T], Tuple[str, str]],
+               origin: str,
+               chunk_size: int = 10000) -> Generator[T, None, None]:
+        """Yield the `items` whose sentence `pair` is not in the index.
+
+        Every pair is recorded as seen in `origin`, and those of the
+        items yielded as exported from it. Items are checked
+        `chunk_size` at a time.
+        """
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                return
+            hashes = [pair_hash(*pair(item)) for item in chunk]
+            for (item, added) in zip(chunk, self.add_many(hashes, origin)):
+                if added:
+                    yield item
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def delete(self) -> None:
+        """Remove the index from disk."""
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            path = self.path.with_name(self.path.name + suffix)
+            if path.exists():
+                path.unlink()
@@ -11,7 +11,7 @@ import shutil
 import sys
 
 from more_itertools import flatten
-from techiaith.utils.bitext import LanguagePair, normalize
+from techiaith.utils.bitext import LanguagePair, normalize_many
 import jiwer
 import sacrebleu
 import sentencepiece as spm
@@ -30,8 +30,8 @@ def read_config_template() -> Dict:
 
 
 def _enumerated_line_map(fp):
-    return dict((i, normalize(line.strip()))
-                for (i, line) in enumerate(fp, start=1))
+    lines = normalize_many(line.strip() for line in fp)
+    return dict(enumerate(lines, start=1))
 
 
 def write_combined_test_sets(
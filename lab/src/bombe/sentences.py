@@ -1,18 +1,27 @@
 from collections import namedtuple
 from functools import partial
-from itertools import filterfalse
+from itertools import filterfalse, islice
 from pathlib import Path
-from typing import Callable, Dict, Generator, Sequence, Tuple, Union
-import csv
+from typing import (Callable, Dict, Generator, Iterable, Iterator, List,
+                    Optional, Sequence, Tuple, Union)
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from techiaith.utils.bitext import LanguagePair, Sentence, to_bitext
 
+from .dedup import INDEX_FILENAME, DedupIndex
 from .spelling import SpellCheck
 from .utils import fs
 
 
-CLEANED_SUFFIX = '.cleaned.csv'
+CLEANED_SUFFIX = '.cleaned.parquet'
+
+LEGACY_CLEANED_SUFFIX = '.cleaned.csv'
+"""Suffix of files exported as CSV by earlier versions (still loaded)."""
+
+CHUNK_SIZE = 50000
+"""Default number of translations held in memory, and per row group."""
 
 
 Translation = namedtuple('Translation',
@@ -65,43 +74,181 @@ def clean_translations(
             yield tr
 
 
-def _to_csv(translations, columns, export_path):
-    df = pd.DataFrame(translations, columns=columns)
-    df.drop_duplicates(inplace=True)
-    df.to_csv(export_path,
-              columns=columns,
-              index=False,
-              quoting=csv.QUOTE_NONNUMERIC)
+def schema(columns: Sequence[str]) -> pa.Schema:
+    """Arrow schema of exported `Translation` `columns`."""
+    types = dict(id=pa.int64())
+    return pa.schema([(column, types.get(column, pa.string()))
+                      for column in columns])
+
+
+def unique_translations(
+        translations: Iterable[Translation]
+) -> Generator[Translation, None, None]:
+    """Drop repeated translations, remembering only their ids."""
+    seen = set()
+    for tr in translations:
+        if tr.id not in seen:
+            seen.add(tr.id)
+            yield tr
+
+
+def _to_parquet(translations: Iterable[Translation],
+                columns: Sequence[str],
+                export_path: Path,
+                chunk_size: int = CHUNK_SIZE) -> int:
+    """Write `translations` to `export_path`, `chunk_size` at a time.
+
+    Each chunk becomes a row group, so no more than `chunk_size`
+    translations are held in memory. The file is written under a
+    temporary name and renamed once complete.
+
+    Returns the number of translations written.
+    """
+    table_schema = schema(columns)
+    tmp_path = export_path.with_name(export_path.name + '.tmp')
+    translations = iter(translations)
+    n_rows = 0
+    with pq.ParquetWriter(tmp_path, table_schema) as writer:
+        while True:
+            chunk = list(islice(translations, chunk_size))
+            if not chunk:
+                break
+            arrays = [pa.array([getattr(tr, column) for tr in chunk],
+                               type=field.type)
+                      for (column, field) in zip(columns, table_schema)]
+            writer.write_table(pa.Table.from_arrays(arrays,
+                                                    schema=table_schema))
+            n_rows += len(chunk)
+    tmp_path.replace(export_path)
+    return n_rows
+
+
+def export_path_for(export_dir: Path, source_path: Path) -> Path:
+    """The path `clean` exports the translations in `source_path` to."""
+    return export_dir / (source_path.name.split('.')[0] + CLEANED_SUFFIX)
+
+
+def is_exported(export_dir: Path, source_path: Path) -> bool:
+    """Whether `source_path` has been exported since it last changed."""
+    export_path = export_path_for(export_dir, source_path)
+    return (export_path.exists()
+            and export_path.stat().st_mtime >= source_path.stat().st_mtime)
+
+
+def dedup_index(export_dir: Path) -> DedupIndex:
+    """The index of the translations exported to `export_dir`."""
+    return DedupIndex(export_dir / INDEX_FILENAME)
+
+
+def outdated(export_dir: Path,
+             source_paths: Iterable[Path],
+             index: DedupIndex) -> List[Path]:
+    """The `source_paths` to export again with `index`.
+
+    These are the files that are new or have changed since they were
+    exported, and the files with translations that were dropped as
+    repeats of those exported from them. All are forgotten by `index`,
+    ready to be exported again.
+    """
+    source_paths = list(source_paths)
+    changed = [source_path
+               for source_path in source_paths
+               if not is_exported(export_dir, source_path)]
+    affected = index.forget(str(source_path) for source_path in changed)
+    affected = [source_path
+                for source_path in source_paths
+                if str(source_path) in affected]
+    # Files affected are unchanged, so exporting them again keeps the
+    # translations they own in some export.
+    index.forget(str(source_path) for source_path in affected)
+    return changed + affected
 
 
 def clean(langs: LanguagePair,
           spell_checkers: Dict[str, SpellCheck],
           columns: Tuple,
           export_dir: Path,
-          source_path: Path):
-    export_filename = source_path.name.split('.')[0] + CLEANED_SUFFIX
-    export_path = export_dir / export_filename
+          source_path: Path,
+          chunk_size: int = CHUNK_SIZE,
+          index: Optional[DedupIndex] = None) -> int:
+    """Export the clean translations in `source_path` to `export_dir`.
+
+    With an `index`, translations whose source and target were already
+    exported from another file are dropped too, and those exported are
+    added to it. A file exported with it before must be forgotten by
+    it first (see `outdated`).
+
+    Returns the number of translations exported.
+    """
+    export_path = export_path_for(export_dir, source_path)
     translations = clean_translations(source_path,
                                       langs,
                                       spell_checkers)
-    _to_csv(translations, columns, export_path)
+    if index is None:
+        translations = unique_translations(translations)
+    else:
+        translations = index.unique(translations,
+                                    lambda tr: (tr.source, tr.target),
+                                    str(source_path),
+                                    chunk_size=chunk_size)
+    n_rows = _to_parquet(translations,
+                         columns,
+                         export_path,
+                         chunk_size=chunk_size)
     for lang in langs:
         spell_checkers[lang].save(source_path)
+    return n_rows
+
+
+def cleaned_paths(export_dir: Path) -> Iterator[Path]:
+    """Paths of the files exported to `export_dir` by `clean`."""
+    for export_path in sorted(fs.DirectoryTree(export_dir)):
+        if export_path.name.endswith((CLEANED_SUFFIX,
+                                      LEGACY_CLEANED_SUFFIX)):
+            yield export_path
+
+
+CATEGORICAL_COLUMNS = ('classifier', 'langs')
+"""Columns with few distinct values, loaded as categories."""
+
+
+def _read_cleaned(export_path: Path, columns: Sequence[str]) -> pa.Table:
+    if export_path.name.endswith(LEGACY_CLEANED_SUFFIX):
+        return pa.Table.from_pandas(pd.read_csv(export_path,
+                                                usecols=list(columns)),
+                                    schema=schema(columns),
+                                    preserve_index=False)
+    return pq.read_table(export_path, columns=list(columns), memory_map=True)
 
 
 def load(export_dir: Path,
-         columns: Sequence[str]) -> pd.DataFrame:
-    """Load a data frame from a CSV file.
+         columns: Sequence[str],
+         drop_duplicates: Optional[bool] = None) -> pd.DataFrame:
+    """Load the translations exported to `export_dir` in a data frame.
+
+    Translations repeated across files are dropped, unless
+    `drop_duplicates` is false, or it is None (the default) and the
+    files were exported with a dedup index (so have no repeats). The
+    frame is indexed by translation id.
 
-    Any column in `drop_columns` will be attempted to be removed
-    from the data frame before resetting the index and returning it.
+    The files are concatenated as Arrow tables (memory-mapped, for
+    Parquet), so the translations are copied into pandas only once.
     """
-    dfs = []
-    df = pd.DataFrame(columns=columns)
-    for export_path in fs.DirectoryTree(export_dir):
-        if export_path.name.endswith(CLEANED_SUFFIX):
-            dfs.append(pd.read_csv(export_path, index_col='id'))
-    df = pd.concat(dfs)
-    df.drop_duplicates(('source', 'target', 'classifier', 'langs'),
-                       inplace=True)
-    return df
+    export_paths = list(cleaned_paths(export_dir))
+    if drop_duplicates is None:
+        drop_duplicates = (
+            not (export_dir / INDEX_FILENAME).exists()
+            or any(export_path.name.endswith(LEGACY_CLEANED_SUFFIX)
+                   for export_path in export_paths))
+    tables = [_read_cleaned(export_path, columns)
+              for export_path in export_paths]
+    if not tables:
+        return pd.DataFrame(columns=columns).set_index('id')
+    df = pa.concat_tables(tables).to_pandas(
+        categories=[column
+                    for column in CATEGORICAL_COLUMNS
+                    if column in columns])
+    if drop_duplicates:
+        df.drop_duplicates(('source', 'target', 'classifier', 'langs'),
+                           inplace=True)
+    return df.set_index('id')
@@ -0,0 +1,35 @@
+from bombe.dedup import DedupIndex
+
+
+def _export(index, origin, pairs):
+    return list(index.unique(pairs, lambda pair: pair, origin, chunk_size=2))
+
+
+def test_pairs_are_exported_once_across_files(tmp_path):
+    index = DedupIndex(tmp_path / 'dedup.sqlite3')
+    assert _export(index, 'A', [('p', 'q'), ('a', 'b'), ('p ', 'q')]) == [
+        ('p', 'q'), ('a', 'b')]
+    assert _export(index, 'B', [('p', 'q'), ('c', 'd')]) == [('c', 'd')]
+    assert len(index) == 3
+
+
+def test_forgotten_file_keeps_its_pairs_when_exported_again(tmp_path):
+    index = DedupIndex(tmp_path / 'dedup.sqlite3')
+    pairs = [('p', 'q'), ('a', 'b')]
+    _export(index, 'A', pairs)
+    assert index.forget(['A']) == set()
+    assert _export(index, 'A', pairs) == pairs
+
+
+def test_files_that_lose_an_owner_are_exported_again(tmp_path):
+    index = DedupIndex(tmp_path / 'dedup.sqlite3')
+    _export(index, 'A', [('p', 'q'), ('a', 'b')])
+    assert _export(index, 'B', [('p', 'q'), ('c', 'd')]) == [('c', 'd')]
+    # A changes, and no longer has ('p', 'q'): B must be exported again
+    # for it to be in any export.
+    affected = index.forget(['A'])
+    assert affected == {'B'}
+    assert index.forget(affected) == set()
+    exported = (_export(index, 'A', [('a', 'b')])
+                + _export(index, 'B', [('p', 'q'), ('c', 'd')]))
+    assert sorted(exported) == [('a', 'b'), ('c', 'd'), ('p', 'q')]
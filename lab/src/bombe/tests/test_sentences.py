@@ -0,0 +1,50 @@
+import pandas as pd
+import pyarrow.parquet as pq
+
+from bombe.dedup import INDEX_FILENAME
+from bombe.sentences import Translation, _to_parquet, load
+
+
+COLUMNS = Translation._fields
+
+TRANSLATIONS = [Translation(i, 'health', f'source {i}', f'target {i}', 'en-cy')
+                for i in range(5)]
+
+
+def test_translations_are_written_in_row_groups(tmp_path):
+    export_path = tmp_path / 'a.cleaned.parquet'
+    assert _to_parquet(iter(TRANSLATIONS), COLUMNS, export_path,
+                       chunk_size=2) == 5
+    assert list(tmp_path.iterdir()) == [export_path]
+    parquet_file = pq.ParquetFile(export_path)
+    assert parquet_file.num_row_groups == 3
+    assert [Translation(*row) for row in zip(
+        *parquet_file.read().to_pydict().values())] == TRANSLATIONS
+
+
+def test_load_drops_translations_repeated_across_files(tmp_path):
+    _to_parquet(TRANSLATIONS[:3], COLUMNS, tmp_path / 'a.cleaned.parquet')
+    _to_parquet(TRANSLATIONS[2:], COLUMNS, tmp_path / 'b.cleaned.parquet')
+    df = load(tmp_path, COLUMNS)
+    assert list(df.index) == list(range(5))
+    assert list(df.source) == [tr.source for tr in TRANSLATIONS]
+    for column in ('classifier', 'langs'):
+        assert df[column].dtype == 'category'
+
+
+def test_load_keeps_repeats_of_files_exported_with_an_index(tmp_path):
+    _to_parquet(TRANSLATIONS[:3], COLUMNS, tmp_path / 'a.cleaned.parquet')
+    _to_parquet(TRANSLATIONS[2:], COLUMNS, tmp_path / 'b.cleaned.parquet')
+    (tmp_path / INDEX_FILENAME).touch()
+    assert len(load(tmp_path, COLUMNS)) == 6
+
+
+def test_load_reads_files_exported_as_csv(tmp_path):
+    _to_parquet(TRANSLATIONS[:3], COLUMNS, tmp_path / 'a.cleaned.parquet')
+    pd.DataFrame(TRANSLATIONS[2:]).to_csv(tmp_path / 'b.cleaned.csv',
+                                          index=False)
+    (tmp_path / INDEX_FILENAME).touch()
+    df = load(tmp_path, COLUMNS)
+    assert list(df.columns) == ['classifier', 'source', 'target', 'langs']
+    assert list(df.index) == list(range(5))
+    assert list(df.target) == [tr.target for tr in TRANSLATIONS]
@@ -1,8 +1,8 @@
 """Utilities for working with pair of texts in two different languages."""
 from collections import namedtuple
-from functools import partial
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Dict, Generator, List, Optional, Tuple, Union
+from typing import Dict, Generator, Iterable, List, Optional, Tuple, Union
 import csv
 import io
 import logging
@@ -56,19 +56,54 @@ text_xpath = etree.XPath('text()')
 
 
 def remove_control_characters(s, unicat='C'):
+    # Printable strings contain no characters in the "Other" categories.
+    if unicat == 'C' and s.isprintable():
+        return s
     return ''.join(ch for ch in s if unicodedata.category(ch)[0] != unicat)
 
 
+class Normalizer:
+    """Normalizes text in language `lang` (see `normalize`).
+
+    The punctuation substitutions of `sacremoses.MosesPunctNormalizer`
+    are compiled once, when the normalizer is created; use
+    `get_normalizer` to share one normalizer per language.
+    """
+
+    def __init__(self, lang: str = None):
+        self.lang = lang
+        moses = sm.MosesPunctNormalizer(lang=lang)
+        self.substitutions = tuple((re.compile(pattern), substitution)
+                                   for (pattern, substitution)
+                                   in moses.substitutions)
+        self.non_lang_chars = _non_lang_chars.get(lang)
+
+    def __call__(self, text: str) -> str:
+        for (char, replacement) in _replacements:
+            text = text.replace(char, replacement)
+        text = remove_control_characters(text)
+        for (regexp, substitution) in self.substitutions:
+            text = regexp.sub(substitution, text)
+        text = text.strip()
+        if self.non_lang_chars:
+            text = self.non_lang_chars.sub('', text)
+        return text.strip()
+
+
+@lru_cache(maxsize=None)
+def get_normalizer(lang: str = None) -> Normalizer:
+    """Return the shared `Normalizer` for `lang`."""
+    return Normalizer(lang)
+
+
 def normalize(text: str, lang: str = None) -> str:
     """Normalize `text` for a given `lang`."""
-    for (char, replacement) in _replacements:
-        text = text.replace(char, replacement)
-    text = remove_control_characters(text)
-    text = sm.MosesPunctNormalizer(lang=lang).normalize(text)
-    regexp = _non_lang_chars.get(lang)
-    if regexp:
-        text = regexp.sub('', text)
-    return text.strip()
+    return get_normalizer(lang)(text)
+
+
+def normalize_many(texts: Iterable[str], lang: str = None) -> List[str]:
+    """Normalize each of `texts` for a given `lang`."""
+    return list(map(get_normalizer(lang), texts))
 
 
 def lang_detect(text: str) -> str:
@@ -274,6 +309,7 @@ def to_bitext(
 
 __all__ = ('Sentence',
            'normalize',
+           'normalize_many',
            'sentences_from_lang_data',
            'tmxfilel2',
            'tmxunitl2',
@@ -0,0 +1,35 @@
+import unicodedata
+
+import pytest
+import sacremoses as sm
+
+from techiaith.utils import bitext
+
+
+TEXTS = ['Mae’r  meddyg yn “dweud” bod popeth yn iawn…',
+         'Line one\r\nLine two\tand\x00 a tab',
+         ' « Bonjour » ,dit-il ; 5 km ! ',
+         'Dŵr, tŷ, café, naïve, Ελλάδα, 東京',
+         '\u200bZero\u00a0width\u2028space',
+         '',
+         '   ']
+
+
+def previous_normalize(text, lang=None):
+    """`normalize` as it was implemented before `Normalizer`."""
+    for (char, replacement) in bitext._replacements:
+        text = text.replace(char, replacement)
+    text = ''.join(ch for ch in text if unicodedata.category(ch)[0] != 'C')
+    text = sm.MosesPunctNormalizer(lang=lang).normalize(text)
+    regexp = bitext._non_lang_chars.get(lang)
+    if regexp:
+        text = regexp.sub('', text)
+    return text.strip()
+
+
+@pytest.mark.parametrize('lang', [None, 'en', 'cy'])
+def test_normalize_is_unchanged(lang):
+    expected = [previous_normalize(text, lang) for text in TEXTS]
+    assert [bitext.normalize(text, lang) for text in TEXTS] == expected
+    assert bitext.normalize_many(TEXTS, lang) == expected
+    assert bitext.get_normalizer(lang) is bitext.get_normalizer(lang)
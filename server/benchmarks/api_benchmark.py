@@ -0,0 +1,185 @@
+"""Benchmark the translation API end to end against stub marian-servers.
+
+Starts the API with uvicorn, with `stub_marian_server.py` standing in
+for marian-server (see `write_marian_shim`) and a stub model whose
+SentencePiece vocabulary is trained on the workload. Then replays the
+texts of WORKLOAD, a JSON lines file with a `text` on each line (or
+`title` and `body`, as in a backlog of requests), in three modes:
+
+`single`
+    One /api/translate request at a time.
+
+`batch`
+    /api/translate/batch requests of `--batch-size` texts, one at a time.
+
+`concurrent`
+    /api/translate requests from each of `--concurrency` clients.
+
+For each, reports the throughput and the p50/p95/p99 latency of
+requests. Extra API settings can be given as environment variables
+(e.g. MARIAN_WORKERS=2 MARIAN_BATCH_MAX_DELAY=0).
+
+Usage:
+
+    PYTHONPATH=src:../lab/src python benchmarks/api_benchmark.py \\
+        ../requests.jsonl --delay 0.01 --delay-per-line 0.002
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+import argparse
+import json
+import os
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+import time
+
+import requests
+
+from stub_marian_server import write_marian_shim, write_stub_model
+
+
+def read_workload(path, repeat):
+    texts = []
+    with open(path, encoding='utf-8') as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            text = record.get('text')
+            if text is None:
+                text = f'{record.get("title", "")}\n{record.get("body", "")}'
+            texts.append(text.strip())
+    return texts * repeat
+
+
+def start_api(tmp_dir, texts, ns):
+    bin_dir = write_marian_shim(Path(tmp_dir, 'bin'),
+                                delay=ns.delay,
+                                delay_per_line=ns.delay_per_line).parent
+    write_stub_model(Path(tmp_dir, 'models'), texts)
+    env = dict(os.environ)
+    env.update(PATH=f'{bin_dir}{os.pathsep}{env["PATH"]}',
+               MODELS_DIR=str(Path(tmp_dir, 'models')),
+               MARIAN_MODEL_NAME='stub',
+               MARIAN_WS_PORT=str(ns.marian_port),
+               SOURCE_LANGUAGE='en',
+               TARGET_LANGUAGE='cy')
+    env.setdefault('SENTENCE_SPLITTER', 'moses')
+    env.setdefault('TRANSLATION_CACHE_SIZE', '0')
+    env.setdefault('TRANSLATION_CACHE_DB', '')
+    env.setdefault('API_MAX_ACTIVE', '0')
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    cmd = [sys.executable, '-m', 'uvicorn',
+           'bombe.translation.api.views:app',
+           '--port', str(ns.port),
+           '--log-level', 'warning']
+    return sp.Popen(cmd, env=env)
+
+
+def wait_until_ready(base_url, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{base_url}/api/health').status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError('The API did not become ready')
+
+
+def post(session, url, payload):
+    started = time.perf_counter()
+    response = session.post(url, json=payload)
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+def run_single(base_url, texts, ns):
+    with requests.Session() as session:
+        return [post(session, f'{base_url}/api/translate', dict(text=text))
+                for text in texts]
+
+
+def run_batch(base_url, texts, ns):
+    latencies = []
+    with requests.Session() as session:
+        for start in range(0, len(texts), ns.batch_size):
+            items = [dict(id=str(i), text=text)
+                     for (i, text)
+                     in enumerate(texts[start:start + ns.batch_size])]
+            latencies.append(post(session,
+                                  f'{base_url}/api/translate/batch',
+                                  dict(items=items)))
+    return latencies
+
+
+def run_concurrent(base_url, texts, ns, concurrency):
+    shares = [texts[i::concurrency] for i in range(concurrency)]
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = executor.map(run_single,
+                               [base_url] * concurrency,
+                               shares,
+                               [ns] * concurrency)
+        return [latency for latencies in results for latency in latencies]
+
+
+def report(mode, n_texts, elapsed, latencies):
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        (p50, p95, p99) = (cuts[49], cuts[94], cuts[98])
+    else:
+        p50 = p95 = p99 = latencies[0]
+    print(f'{mode:>14} {len(latencies):>8} {elapsed:>8.2f} '
+          f'{len(latencies) / elapsed:>8.1f} {n_texts / elapsed:>8.1f} '
+          f'{p50 * 1000:>8.1f} {p95 * 1000:>8.1f} {p99 * 1000:>8.1f}')
+
+
+def main(ns):
+    texts = read_workload(ns.workload, ns.repeat)
+    base_url = f'http://127.0.0.1:{ns.port}'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        api = start_api(tmp_dir, texts, ns)
+        try:
+            wait_until_ready(base_url)
+            # Warm up the sentence splitter and connections.
+            run_single(base_url, texts[:5], ns)
+            print(f'{"mode":>14} {"requests":>8} {"seconds":>8} '
+                  f'{"req/s":>8} {"texts/s":>8} {"p50 ms":>8} '
+                  f'{"p95 ms":>8} {"p99 ms":>8}')
+            runs = [('single', run_single), ('batch', run_batch)]
+            for concurrency in ns.concurrency:
+                runs.append((f'concurrent/{concurrency}',
+                             partial(run_concurrent,
+                                     concurrency=concurrency)))
+            for (mode, run) in runs:
+                if ns.modes and mode.split('/')[0] not in ns.modes:
+                    continue
+                started = time.perf_counter()
+                latencies = run(base_url, texts, ns)
+                report(mode, len(texts), time.perf_counter() - started,
+                       latencies)
+        finally:
+            api.terminate()
+            api.wait()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('workload')
+    ap.add_argument('--repeat', type=int, default=1,
+                    help='Replay the workload this many times per mode.')
+    ap.add_argument('--modes', nargs='+',
+                    choices=('single', 'batch', 'concurrent'))
+    ap.add_argument('--batch-size', type=int, default=32)
+    ap.add_argument('--concurrency', type=int, nargs='+', default=[4, 16])
+    ap.add_argument('--delay', type=float, default=0.01,
+                    help='Seconds the stub takes per message.')
+    ap.add_argument('--delay-per-line', type=float, default=0.0,
+                    help='Additional seconds the stub takes per line.')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--marian-port', type=int, default=8799)
+    main(ap.parse_args())
@@ -0,0 +1,96 @@
+"""Compare the speed and quality of a model's gpu and cpu serving profiles.
+
+The source side of the test split (CORPUS_PREFIX.<source>) is encoded
+with SentencePiece as `MarianServer` does, translated by marian-decoder
+with the model's decoder config and with its `cpu` profile config
+(generated with the given options if it is missing or out of date),
+decoded, and scored with BLEU against CORPUS_PREFIX.<target>.
+
+Words/sec counts source words. Use `--default-cpu-threads` to decode
+with the default config on CPU too, for a like-for-like comparison on
+hosts without a GPU.
+
+Requires `sacrebleu` (installed in the lab image).
+
+Usage:
+
+    PYTHONPATH=src:../lab/src python benchmarks/cpu_profile.py \\
+        /models/cy-en/en-cy/model.npz.decoder.yml work/corpus.test \\
+        --langs en-cy --cpu-threads 4
+"""
+import argparse
+import shlex
+import subprocess as sp
+import time
+
+import sacrebleu
+import sentencepiece
+
+from bombe.translation.api import profiles
+from bombe.translation.api.controllers import (read_config,
+                                               spm_decode_sentences,
+                                               spm_encode_sentences)
+
+
+def read_lines(path, max_lines):
+    with open(path, encoding='utf-8') as fp:
+        lines = [line.strip() for line in fp]
+    return lines[:max_lines] if max_lines else lines
+
+
+def decode(config_path, encoded, cpu_threads=0):
+    cmd = f'marian-decoder --allow-unk --quiet -c {shlex.quote(config_path)}'
+    if cpu_threads:
+        cmd += f' --cpu-threads {cpu_threads}'
+    started = time.perf_counter()
+    proc = sp.run(shlex.split(cmd),
+                  input='\n'.join(encoded) + '\n',
+                  stdout=sp.PIPE,
+                  check=True,
+                  encoding='utf-8')
+    elapsed = time.perf_counter() - started
+    return (elapsed, proc.stdout.splitlines())
+
+
+def main(ns):
+    (source_lang, target_lang) = ns.langs.split('-')
+    sources = read_lines(f'{ns.corpus_prefix}.{source_lang}', ns.max_lines)
+    references = read_lines(f'{ns.corpus_prefix}.{target_lang}',
+                            ns.max_lines)
+    config = read_config(ns.config_path)
+    spm = sentencepiece.SentencePieceProcessor(config['vocabs'])
+    encoded = spm_encode_sentences(spm, sources)
+    n_words = sum(len(source.split()) for source in sources)
+    if ns.regenerate or profiles.is_stale(ns.config_path):
+        profiles.write_cpu_config(ns.config_path,
+                                  cpu_threads=ns.cpu_threads,
+                                  beam_size=ns.beam_size,
+                                  mini_batch=ns.mini_batch,
+                                  gemm_type=ns.gemm_type,
+                                  shortlist_size=ns.shortlist_size)
+    runs = (('gpu', ns.config_path, ns.default_cpu_threads),
+            ('cpu', str(profiles.cpu_config_path(ns.config_path)), 0))
+    print(f'{"profile":>8} {"seconds":>8} {"words/s":>9} {"BLEU":>6}')
+    for (name, config_path, cpu_threads) in runs:
+        (elapsed, translated) = decode(config_path, encoded, cpu_threads)
+        hypotheses = spm_decode_sentences(spm, translated)
+        bleu = sacrebleu.corpus_bleu(hypotheses, [references])
+        print(f'{name:>8} {elapsed:>8.2f} {n_words / elapsed:>9.0f} '
+              f'{bleu.score:>6.2f}')
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('config_path')
+    ap.add_argument('corpus_prefix')
+    ap.add_argument('--langs', default='en-cy')
+    ap.add_argument('--max-lines', type=int, default=0)
+    ap.add_argument('--default-cpu-threads', type=int, default=0)
+    ap.add_argument('--regenerate', action='store_true',
+                    help='Write the cpu config even if it is up to date.')
+    ap.add_argument('--cpu-threads', type=int, default=4)
+    ap.add_argument('--beam-size', type=int, default=1)
+    ap.add_argument('--mini-batch', type=int, default=32)
+    ap.add_argument('--gemm-type', default='intgemm8')
+    ap.add_argument('--shortlist-size', type=int, default=50)
+    main(ap.parse_args())
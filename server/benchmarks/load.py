@@ -0,0 +1,91 @@
+"""Measure marian-server client throughput as concurrency increases.
+
+Starts `stub_marian_server.py` with a fixed decode delay and issues
+`--requests` translations through `ConnectionPool.asend_recv` at each
+concurrency level. With a non-blocking client, throughput should grow
+roughly linearly with concurrency up to the pool size.
+
+With `--batch-delay`, requests are coalesced by `BatchScheduler` before
+being sent, so throughput keeps growing beyond the pool size.
+
+Usage:
+
+    PYTHONPATH=src python benchmarks/load.py --delay 0.05
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import socket
+import subprocess as sp
+import sys
+import time
+
+from bombe.translation.api.batching import BatchScheduler
+from bombe.translation.api.connections import ConnectionPool
+
+
+STUB_PATH = Path(__file__).parent / 'stub_marian_server.py'
+
+
+def wait_for_port(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex((host, port)) == 0:
+                return
+        time.sleep(0.05)
+    raise TimeoutError(f'Nothing listening on {host}:{port}')
+
+
+async def run_level(translate, concurrency, n_requests, lines):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await translate(lines)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n_requests)))
+    return time.perf_counter() - started
+
+
+async def main(ns):
+    ws_addr = f'ws://127.0.0.1:{ns.port}/translate'
+    pool = ConnectionPool(ws_addr, size=ns.pool_size)
+    lines = ['▁Hello ▁world'] * ns.lines
+
+    async def send(lines):
+        translated = await pool.asend_recv('\n'.join(lines))
+        return translated.splitlines()
+
+    translate = send
+    if ns.batch_delay > 0:
+        translate = BatchScheduler(send, max_delay=ns.batch_delay).translate
+    print(f'{"concurrency":>11} {"seconds":>8} {"req/s":>8}')
+    for concurrency in ns.concurrency:
+        elapsed = await run_level(translate, concurrency, ns.requests, lines)
+        print(f'{concurrency:>11} {elapsed:>8.2f} '
+              f'{ns.requests / elapsed:>8.1f}')
+    pool.close()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--port', type=int, default=8799)
+    ap.add_argument('--delay', type=float, default=0.05)
+    ap.add_argument('--pool-size', type=int, default=4)
+    ap.add_argument('--requests', type=int, default=64)
+    ap.add_argument('--lines', type=int, default=4)
+    ap.add_argument('--batch-delay', type=float, default=0.0)
+    ap.add_argument('--concurrency', type=int, nargs='+',
+                    default=[1, 2, 4, 8, 16])
+    ns = ap.parse_args()
+    stub = sp.Popen([sys.executable, str(STUB_PATH),
+                     '--port', str(ns.port),
+                     '--delay', str(ns.delay)])
+    try:
+        wait_for_port('127.0.0.1', ns.port)
+        asyncio.run(main(ns))
+    finally:
+        stub.terminate()
+        stub.wait()
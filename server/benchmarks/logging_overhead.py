@@ -0,0 +1,113 @@
+"""Measure the cost of logging in the translation hot path.
+
+Sentences are read one per line from CORPUS, joined into documents of
+`--doc-size` sentences and run through `MarianServer.split_sentences`,
+`pre_process` and `post_process` (decoding the encoded source in place
+of a Marian translation), with logging written to `--log-file`:
+
+`print`
+    The previous behaviour: `print()` of every sentence.
+`off`
+    Logging at INFO level (the default); no per-sentence messages.
+`sampled`
+    DEBUG level, with `--sample-rate` of requests logged.
+`all`
+    DEBUG level for every request.
+
+Usage:
+
+    PYTHONPATH=src:../lab/src python benchmarks/logging_overhead.py \\
+        /models/cy-en/en-cy/model.npz.decoder.yml work/corpus.test.en
+"""
+from contextlib import redirect_stdout
+import argparse
+import statistics
+import time
+
+from techiaith.utils.bitext import Sentence
+
+from bombe.translation.api import logs
+from bombe.translation.api.controllers import (MarianServer,
+                                               spm_encode_sentence)
+from bombe.translation.api.segmentation import SentenceSplitters
+
+
+class PrintingServer(MarianServer):
+    """`MarianServer` with the `print()` calls it used to make."""
+
+    def pre_process(self, sentences, lang):
+        for i, sent in enumerate(sentences, start=1):
+            print(f'Sent to translate {i}:', sent)
+            sent = Sentence(sent, lang)
+            yield spm_encode_sentence(self.spm, sent.text)
+
+
+def read_documents(path, doc_size, max_docs):
+    with open(path, encoding='utf-8') as fp:
+        lines = [line.strip() for line in fp if line.strip()]
+    docs = []
+    for start in range(0, len(lines), doc_size):
+        docs.append(' '.join(lines[start:start + doc_size]))
+        if len(docs) == max_docs:
+            break
+    return docs
+
+
+def handle(server, doc, lang, sample_rate, printing):
+    logs.begin_request(sample_rate=sample_rate)
+    sentences = server.split_sentences(doc, lang)
+    encoded = list(server.pre_process(sentences, lang))
+    if printing:
+        print('Before pre-process:', encoded)
+    return list(server.post_process(encoded, lang))
+
+
+def run(server, docs, lang, sample_rate=1.0, printing=False):
+    timings = []
+    for doc in docs:
+        started = time.perf_counter()
+        handle(server, doc, lang, sample_rate, printing)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main(ns):
+    docs = read_documents(ns.corpus, ns.doc_size, ns.max_docs)
+    splitters = SentenceSplitters(ns.splitter)
+    modes = dict(print=(PrintingServer, 'INFO', 1.0),
+                 off=(MarianServer, 'INFO', 1.0),
+                 sampled=(MarianServer, 'DEBUG', ns.sample_rate),
+                 all=(MarianServer, 'DEBUG', 1.0))
+    print(f'{"mode":>8} {"docs/s":>8} {"p50 ms":>8} {"p99 ms":>8}')
+    with open(ns.log_file, 'w') as log_fp:
+        for mode in ns.modes:
+            (server_cls, level, sample_rate) = modes[mode]
+            logs.configure(level, ns.log_format, stream=log_fp)
+            server = server_cls(ns.config_path, 0, splitters=splitters)
+            printing = mode == 'print'
+            with redirect_stdout(log_fp):
+                run(server, docs[:10], ns.lang, sample_rate, printing)
+                timings = run(server, docs, ns.lang, sample_rate, printing)
+            timings.sort()
+            p99 = timings[int(len(timings) * 0.99)]
+            print(f'{mode:>8} {len(docs) / sum(timings):>8.1f} '
+                  f'{statistics.median(timings) * 1000:>8.2f} '
+                  f'{p99 * 1000:>8.2f}')
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('config_path')
+    ap.add_argument('corpus')
+    ap.add_argument('--lang', default='en')
+    ap.add_argument('--splitter', default='moses')
+    ap.add_argument('--doc-size', type=int, default=5)
+    ap.add_argument('--max-docs', type=int, default=2000)
+    ap.add_argument('--sample-rate', type=float, default=0.01)
+    ap.add_argument('--log-format', choices=('text', 'json'),
+                    default='text')
+    ap.add_argument('--log-file', default='logging_overhead.log')
+    ap.add_argument('--modes', nargs='+',
+                    choices=('print', 'off', 'sampled', 'all'),
+                    default=['print', 'off', 'sampled', 'all'])
+    main(ap.parse_args())
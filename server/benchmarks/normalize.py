@@ -0,0 +1,74 @@
+"""Compare the throughput of `normalize` with its previous implementation.
+
+The previous implementation created a `MosesPunctNormalizer` (and
+compiled its substitutions) on every call and removed control
+characters from every string one character at a time. That both
+give the same results is tested in
+lab/src/techiaith/utils/tests/test_bitext.py.
+
+Usage:
+
+    PYTHONPATH=src:../lab/src python benchmarks/normalize.py \\
+        work/corpus.test.en --lang en
+"""
+import argparse
+import time
+import unicodedata
+
+from techiaith.utils import bitext
+import sacremoses as sm
+
+
+def legacy_normalize(text, lang=None):
+    for (char, replacement) in bitext._replacements:
+        text = text.replace(char, replacement)
+    text = ''.join(ch for ch in text if unicodedata.category(ch)[0] != 'C')
+    text = sm.MosesPunctNormalizer(lang=lang).normalize(text)
+    regexp = bitext._non_lang_chars.get(lang)
+    if regexp:
+        text = regexp.sub('', text)
+    return text.strip()
+
+
+def legacy(lines, lang):
+    return [legacy_normalize(line, lang) for line in lines]
+
+
+def per_call(lines, lang):
+    return [bitext.normalize(line, lang) for line in lines]
+
+
+def many(lines, lang):
+    return bitext.normalize_many(lines, lang)
+
+
+implementations = dict(legacy=legacy, normalize=per_call, normalize_many=many)
+
+
+def main(ns):
+    with open(ns.corpus, encoding='utf-8') as fp:
+        lines = [line.rstrip('\n') for line in fp][:ns.max_lines]
+    print(f'{"implementation":>15} {"sents/s":>10} {"speedup":>8}')
+    baseline = None
+    for name in ns.implementations:
+        func = implementations[name]
+        best = float('inf')
+        for _ in range(ns.repeat):
+            started = time.perf_counter()
+            func(lines, ns.lang)
+            best = min(best, time.perf_counter() - started)
+        rate = len(lines) / best
+        baseline = baseline or rate
+        print(f'{name:>15} {rate:>10.0f} {rate / baseline:>7.1f}x')
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('corpus')
+    ap.add_argument('--lang', default=None)
+    ap.add_argument('--max-lines', type=int, default=20000)
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--implementations', nargs='+',
+                    choices=tuple(implementations),
+                    default=list(implementations))
+    main(ap.parse_args())
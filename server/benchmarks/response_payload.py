@@ -0,0 +1,119 @@
+"""Compare the size and serialization time of /api/translate responses.
+
+Sentences are read one per line from CORPUS and grouped into documents
+of `--doc-size` sentences, each "translated" to itself. The response
+for each document is serialized:
+
+`full/pydantic`
+    The seven fields returned with `debug`, validated against
+    `Dict[str, str]` and encoded by FastAPI's `JSONResponse`, as
+    /api/translate used to.
+
+`full/orjson`
+    The five default fields, with `ORJSONResponse`.
+
+`compact/orjson`
+    The translation only (`compact`), with `ORJSONResponse`.
+
+`compact+align`
+    As above, with the offsets of each sentence (`alignment`).
+
+Usage:
+
+    PYTHONPATH=src:../lab/src python benchmarks/response_payload.py \\
+        work/corpus.test.en --doc-size 200
+"""
+from typing import Dict
+import argparse
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import parse_obj_as
+
+from bombe.translation.api.controllers import alignment_offsets
+
+
+def read_documents(path, doc_size, max_docs):
+    with open(path, encoding='utf-8') as fp:
+        lines = [line.strip() for line in fp if line.strip()]
+    docs = []
+    for start in range(0, len(lines), doc_size):
+        docs.append(lines[start:start + doc_size])
+        if len(docs) == max_docs:
+            break
+    return docs
+
+
+def full_response(sentences, debug=False):
+    source_text = ' '.join(sentences)
+    result = dict(translated='  '.join(sentences),
+                  source_text=source_text,
+                  source_sentences='\n'.join(sentences),
+                  source_lang='en',
+                  target_lang='cy')
+    if debug:
+        result.update(before_post_proc='\n'.join(sentences),
+                      raw='\n'.join(sentences))
+    return result
+
+
+def compact_response(sentences, alignment=False):
+    result = dict(translated='  '.join(sentences))
+    if alignment:
+        result.update(alignment=alignment_offsets(' '.join(sentences),
+                                                  sentences,
+                                                  sentences,
+                                                  '  '))
+    return result
+
+
+def pydantic_body(result):
+    validated = parse_obj_as(Dict[str, str], result)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def orjson_body(result):
+    return ORJSONResponse(result).body
+
+
+def timed(func, results, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        bodies = [func(result) for result in results]
+        best = min(best, time.perf_counter() - started)
+    return (best, sum(map(len, bodies)))
+
+
+def main(ns):
+    docs = read_documents(ns.corpus, ns.doc_size, ns.max_docs)
+    modes = (
+        ('full/pydantic', pydantic_body,
+         [full_response(doc, debug=True) for doc in docs]),
+        ('full/orjson', orjson_body,
+         [full_response(doc) for doc in docs]),
+        ('compact/orjson', orjson_body,
+         [compact_response(doc) for doc in docs]),
+        ('compact+align', orjson_body,
+         [compact_response(doc, alignment=True) for doc in docs]),
+    )
+    print(f'{"mode":>14} {"KB/doc":>8} {"size":>6} {"us/doc":>8} '
+          f'{"speedup":>8}')
+    baseline = None
+    for (mode, func, results) in modes:
+        (elapsed, n_bytes) = timed(func, results)
+        if baseline is None:
+            baseline = (elapsed, n_bytes)
+        print(f'{mode:>14} {n_bytes / len(docs) / 1024:>8.1f} '
+              f'{n_bytes / baseline[1]:>6.2f} '
+              f'{elapsed / len(docs) * 1e6:>8.0f} '
+              f'{baseline[0] / elapsed:>7.1f}x')
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('corpus')
+    ap.add_argument('--doc-size', type=int, default=200)
+    ap.add_argument('--max-docs', type=int, default=100)
+    main(ap.parse_args())
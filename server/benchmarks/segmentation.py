@@ -0,0 +1,84 @@
+"""Compare sentence splitter backends for latency and accuracy.
+
+Sentences are read one per line from CORPUS (e.g. work/corpus.test.en),
+joined into documents of `--doc-size` sentences and split again by each
+backend. Accuracy is the precision/recall/F1 of predicted sentence
+boundaries against the original line boundaries.
+
+Usage:
+
+    PYTHONPATH=src python benchmarks/segmentation.py corpus.test.cy \\
+        --lang cy --backends sentencizer moses spacy
+"""
+import argparse
+import time
+
+from techiaith.utils.bitext import normalize
+
+from bombe.translation.api.segmentation import get_splitter, splitters
+
+
+def read_documents(path, doc_size, max_docs):
+    with open(path, encoding='utf-8') as fp:
+        lines = [normalize(line) for line in fp]
+    lines = [line for line in lines if line]
+    docs = []
+    for start in range(0, len(lines), doc_size):
+        docs.append(lines[start:start + doc_size])
+        if len(docs) == max_docs:
+            break
+    return docs
+
+
+def boundaries(doc, sentences):
+    """Return the character offsets at which each of `sentences` ends."""
+    ends = set()
+    pos = 0
+    for sent in sentences:
+        start = doc.find(sent, pos)
+        if start < 0:
+            continue
+        pos = start + len(sent)
+        ends.add(pos)
+    return ends
+
+
+def evaluate(splitter, docs):
+    (tp, n_pred, n_gold) = (0, 0, 0)
+    elapsed = 0.0
+    for gold in docs:
+        doc = ' '.join(gold)
+        started = time.perf_counter()
+        predicted = splitter(doc)
+        elapsed += time.perf_counter() - started
+        gold_ends = boundaries(doc, gold)
+        pred_ends = boundaries(doc, predicted)
+        tp += len(gold_ends & pred_ends)
+        n_pred += len(pred_ends)
+        n_gold += len(gold_ends)
+    precision = tp / n_pred if n_pred else 0.0
+    recall = tp / n_gold if n_gold else 0.0
+    f1 = (2 * precision * recall / (precision + recall)
+          if precision + recall else 0.0)
+    return (elapsed * 1000 / len(docs), precision, recall, f1)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('corpus')
+    ap.add_argument('--lang', default='en')
+    ap.add_argument('--doc-size', type=int, default=10)
+    ap.add_argument('--max-docs', type=int, default=500)
+    ap.add_argument('--backends', nargs='+', default=sorted(splitters))
+    ns = ap.parse_args()
+    docs = read_documents(ns.corpus, ns.doc_size, ns.max_docs)
+    print(f'{len(docs)} documents of up to {ns.doc_size} sentences')
+    print(f'{"backend":<12} {"load s":>7} {"ms/doc":>8} '
+          f'{"prec":>6} {"recall":>6} {"f1":>6}')
+    for name in ns.backends:
+        started = time.perf_counter()
+        splitter = get_splitter(name, ns.lang)
+        load_time = time.perf_counter() - started
+        (ms_per_doc, precision, recall, f1) = evaluate(splitter, docs)
+        print(f'{name:<12} {load_time:>7.2f} {ms_per_doc:>8.2f} '
+              f'{precision:>6.3f} {recall:>6.3f} {f1:>6.3f}')
@@ -0,0 +1,80 @@
+"""Compare per-sentence and batched SentencePiece encoding and decoding.
+
+Sentences are read one per line from CORPUS and grouped into documents
+of `--doc-size` sentences. Each document is encoded (and its lines
+decoded) either one sentence at a time, as `MarianServer` used to, or
+as one batch with each of `--threads`.
+
+Usage:
+
+    PYTHONPATH=src:../lab/src python benchmarks/spm_batching.py \\
+        /models/cy-en/en-cy/vocab.en-cy.spm work/corpus.test.en
+"""
+import argparse
+import time
+
+import sentencepiece
+
+from bombe.translation.api.controllers import (spm_decode_sentences,
+                                               spm_encode_sentence,
+                                               spm_encode_sentences)
+
+
+def read_documents(path, doc_size, max_docs):
+    with open(path, encoding='utf-8') as fp:
+        lines = [line.strip() for line in fp if line.strip()]
+    docs = []
+    for start in range(0, len(lines), doc_size):
+        docs.append(lines[start:start + doc_size])
+        if len(docs) == max_docs:
+            break
+    return docs
+
+
+def per_sentence(spm, docs):
+    encoded = [[spm_encode_sentence(spm, sent) for sent in doc]
+               for doc in docs]
+    decoded = [[spm.decode(sent) for sent in doc] for doc in docs]
+    return (encoded, decoded)
+
+
+def batched(spm, docs, num_threads):
+    encoded = [spm_encode_sentences(spm, doc, num_threads)
+               for doc in docs]
+    decoded = [spm_decode_sentences(spm, doc, num_threads)
+               for doc in docs]
+    return (encoded, decoded)
+
+
+def timed(func, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return (best, result)
+
+
+def main(ns):
+    spm = sentencepiece.SentencePieceProcessor(ns.vocab)
+    docs = read_documents(ns.corpus, ns.doc_size, ns.max_docs)
+    n_sents = sum(map(len, docs))
+    (baseline, expected) = timed(per_sentence, spm, docs)
+    print(f'{"mode":>12} {"sents/s":>10} {"speedup":>8}')
+    print(f'{"per-sentence":>12} {n_sents / baseline:>10.0f} {1:>7.1f}x')
+    for num_threads in ns.threads:
+        (elapsed, result) = timed(batched, spm, docs, num_threads)
+        assert result == expected, 'batched output differs'
+        mode = f'batch/{num_threads or "all"}'
+        print(f'{mode:>12} {n_sents / elapsed:>10.0f} '
+              f'{baseline / elapsed:>7.1f}x')
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('vocab')
+    ap.add_argument('corpus')
+    ap.add_argument('--doc-size', type=int, default=200)
+    ap.add_argument('--max-docs', type=int, default=100)
+    ap.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 0])
+    main(ap.parse_args())
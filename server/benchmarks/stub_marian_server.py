@@ -0,0 +1,98 @@
+"""A stand-in for marian-server used for load testing the API.
+
+Every message received on the WebSocket is echoed back line by line
+(an "identity" translation) after a configurable delay, emulating the
+time Marian would spend decoding. As marian-server does with a
+SentencePiece vocabulary, the pieces of each line are joined back into
+text in the reply.
+
+Options of marian-server that the API passes (`-c`, `--allow-unk`,
+`--cpu-threads`) are accepted and ignored, so that the stub can stand
+in for `marian-server` on the PATH (see `write_marian_shim`).
+
+Usage:
+
+    python stub_marian_server.py --port 8080 --delay 0.05
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import sys
+
+import sentencepiece
+import srsly
+import websockets
+
+
+def detokenize(line):
+    return line.replace(' ', '').replace('\u2581', ' ').strip()
+
+
+def make_handler(delay, delay_per_line):
+
+    async def handler(ws, *args):
+        async for message in ws:
+            lines = message.split('\n')
+            await asyncio.sleep(delay + delay_per_line * len(lines))
+            await ws.send('\n'.join(map(detokenize, lines)))
+
+    return handler
+
+
+async def serve(host, port, delay=0.0, delay_per_line=0.0):
+    handler = make_handler(delay, delay_per_line)
+    async with websockets.serve(handler, host, port, max_size=None):
+        await asyncio.Future()
+
+
+def write_marian_shim(bin_dir, delay=0.0, delay_per_line=0.0):
+    """Write a `marian-server` executable to `bin_dir` that runs the stub.
+
+    Put `bin_dir` first on the PATH of the API for it to start stubs
+    instead of marian-server.
+    """
+    shim_path = Path(bin_dir, 'marian-server')
+    shim_path.parent.mkdir(parents=True, exist_ok=True)
+    shim_path.write_text(f'#!/bin/sh\n'
+                         f'exec {sys.executable} {Path(__file__).resolve()} '
+                         f'--delay {delay} --delay-per-line {delay_per_line} '
+                         f'"$@"\n')
+    os.chmod(shim_path, 0o755)
+    return shim_path
+
+
+def write_stub_model(models_dir, texts, name='stub', langs=('en', 'cy'),
+                     vocab_size=500):
+    """Write a model for the stub to `<models_dir>/<name>/<src>-<trg>/`.
+
+    Only its SentencePiece vocabulary, trained on `texts`, is real.
+    Returns the path of its decoder config.
+    """
+    model_dir = Path(models_dir, name, '-'.join(langs))
+    model_dir.mkdir(parents=True, exist_ok=True)
+    sentencepiece.SentencePieceTrainer.train(
+        sentence_iterator=iter(texts),
+        model_prefix=str(model_dir / 'vocab'),
+        vocab_size=vocab_size,
+        hard_vocab_limit=False,
+        minloglevel=2)
+    vocab_path = str(model_dir / 'vocab.model')
+    config_path = model_dir / 'model.npz.decoder.yml'
+    config_path.write_text(srsly.yaml_dumps(
+        {'models': [str(model_dir / 'model.npz')],
+         'vocabs': [vocab_path, vocab_path],
+         'beam-size': 6}))
+    return config_path
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8080)
+    ap.add_argument('--delay', type=float, default=0.05,
+                    help='Seconds to wait before replying to a message.')
+    ap.add_argument('--delay-per-line', type=float, default=0.0,
+                    help='Additional seconds to wait per line in a message.')
+    (ns, _) = ap.parse_known_args()
+    asyncio.run(serve(ns.host, ns.port, ns.delay, ns.delay_per_line))
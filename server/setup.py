@@ -13,5 +13,6 @@ setup(
     ]},
     include_package_data=True,
     extras_require={
-        'dev': ['gitpython', 'virtualenvwrapper', 'pytest']
+        'dev': ['gitpython', 'virtualenvwrapper', 'pytest', 'websockets',
+                'httpx']
     })
@@ -0,0 +1,133 @@
+"""Admission control for translation requests."""
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Hashable
+import asyncio
+import math
+import time
+
+
+class RequestTooLarge(Exception):
+    """Raised when a text has more sentences than allowed."""
+
+
+class Overloaded(Exception):
+    """Raised when the work queue is full."""
+
+
+class TooManyRequests(Exception):
+    """Raised when a client exceeds its rate limit.
+
+    `retry_after` is the number of seconds until the request would be
+    allowed.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f'Rate limit exceeded, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, in bursts of up
+    to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, n: float = 1) -> float:
+        """Take `n` tokens if available.
+
+        Returns 0 if they were taken, otherwise the seconds to wait
+        until they would be.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """A `TokenBucket` per client.
+
+    Buckets of the least recently seen clients are discarded beyond
+    `max_clients`; a `rate` of 0 disables limiting.
+    """
+
+    def __init__(self, rate: float = 0, burst: int = 20,
+                 max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def check(self, client: Hashable, cost: float = 1) -> None:
+        """Charge `client` `cost` tokens, raising `TooManyRequests`."""
+        if not self.rate:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate,
+                                                         self.burst)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        wait = bucket.take(cost)
+        if wait:
+            raise TooManyRequests(math.ceil(wait))
+
+
+class AdmissionQueue:
+    """Bounds the number of requests being translated at once.
+
+    Up to `max_active` requests are translated concurrently and up to
+    `max_waiting` more wait for a slot; beyond that `admit` raises
+    `Overloaded` straight away. A `max_active` of 0 means no limit.
+    """
+
+    def __init__(self, max_active: int = 32, max_waiting: int = 128):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = None
+
+    @property
+    def full(self) -> bool:
+        """Whether a request would be rejected now."""
+        return (bool(self.max_active)
+                and self.active >= self.max_active
+                and self.waiting >= self.max_waiting)
+
+    def status(self):
+        return dict(active=self.active,
+                    waiting=self.waiting,
+                    max_active=self.max_active,
+                    max_waiting=self.max_waiting)
+
+    @asynccontextmanager
+    async def admit(self):
+        if self.max_active:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_active)
+            if self.full:
+                raise Overloaded('Too many requests waiting to be translated')
+            self.waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            if self.max_active:
+                self._semaphore.release()
@@ -0,0 +1,144 @@
+"""Cross-request micro-batching of sentences sent to marian-server."""
+from typing import Awaitable, Callable, List
+import asyncio
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class BatchError(Exception):
+    """Raised when marian-server returns an unexpected number of lines."""
+
+
+class BatchScheduler:
+    """Coalesce sentences from concurrent requests into a single batch.
+
+    Sentences passed to `translate` are queued for up to `max_delay`
+    seconds, or until the queue holds `max_tokens` SentencePiece
+    tokens, then sent to marian-server in one message via `send`.
+    The translations are handed back to each caller in order.
+
+    A `max_delay` of zero sends each call's sentences on their own.
+
+    With `bucket_width` set, the sentences of each batch are sorted by
+    length and sent as concurrent sub-batches of sentences whose
+    token counts fall in the same `bucket_width`-wide bucket, so that
+    Marian pads short sentences less. `sub_batch_max_tokens` further
+    caps the padded size (sentences × longest sentence) of each
+    sub-batch. Translations are returned in the original order.
+
+    Empty sentences are translated as empty, without being sent.
+    """
+
+    def __init__(self,
+                 send: Callable[[List[str]], Awaitable[List[str]]],
+                 max_delay: float = 0.005,
+                 max_tokens: int = 4096,
+                 bucket_width: int = 0,
+                 sub_batch_max_tokens: int = 0):
+        self.send = send
+        self.max_delay = max_delay
+        self.max_tokens = max_tokens
+        self.bucket_width = bucket_width
+        self.sub_batch_max_tokens = sub_batch_max_tokens
+        self._pending = []
+        self._n_tokens = 0
+        self._timer = None
+        self._dispatching = set()
+
+    @staticmethod
+    def n_tokens(sentences: List[str]) -> int:
+        return sum(len(sent.split()) for sent in sentences)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of sentences waiting to be dispatched."""
+        return sum(len(sents) for (sents, _) in self._pending)
+
+    async def translate(self, sentences: List[str]) -> List[str]:
+        """Translate SentencePiece-encoded `sentences`."""
+        if not sentences:
+            return []
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((sentences, future))
+        self._n_tokens += self.n_tokens(sentences)
+        if self.max_delay <= 0 or self._n_tokens >= self.max_tokens:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._pending
+        self._pending = []
+        self._n_tokens = 0
+        if batch:
+            task = asyncio.ensure_future(self._dispatch(batch))
+            self._dispatching.add(task)
+            task.add_done_callback(self._dispatching.discard)
+
+    def sub_batches(self, lines: List[str]) -> List[List[int]]:
+        """Group the indices of `lines` into sub-batches to send."""
+        if not (self.bucket_width or self.sub_batch_max_tokens):
+            return [list(range(len(lines)))]
+        lengths = [max(len(line.split()), 1) for line in lines]
+        width = self.bucket_width or float('inf')
+        groups = []
+        group = []
+        group_bucket = None
+        for i in sorted(range(len(lines)), key=lengths.__getitem__):
+            bucket = lengths[i] // width
+            padded = (len(group) + 1) * lengths[i]
+            if group and (bucket != group_bucket
+                          or (self.sub_batch_max_tokens
+                              and padded > self.sub_batch_max_tokens)):
+                groups.append(group)
+                group = []
+            group.append(i)
+            group_bucket = bucket
+        if group:
+            groups.append(group)
+        return groups
+
+    async def _send(self, lines: List[str]) -> List[str]:
+        indices = [i for (i, line) in enumerate(lines) if line.strip()]
+        translated = [''] * len(lines)
+        if not indices:
+            return translated
+        received = await self.send([lines[i] for i in indices])
+        if len(received) != len(indices):
+            raise BatchError('Expected one translation per sentence',
+                             len(indices),
+                             len(received))
+        for (i, target) in zip(indices, received):
+            translated[i] = target
+        return translated
+
+    async def _dispatch(self, batch):
+        lines = [sent for (sents, _) in batch for sent in sents]
+        groups = self.sub_batches(lines)
+        log.debug('Dispatching %d sentences from %d requests in %d batches',
+                  len(lines), len(batch), len(groups))
+        try:
+            results = await asyncio.gather(
+                *(self._send([lines[i] for i in group]) for group in groups))
+            translated = [None] * len(lines)
+            for (group, result) in zip(groups, results):
+                for (i, target) in zip(group, result):
+                    translated[i] = target
+        except Exception as err:
+            for (_, future) in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        start = 0
+        for (sents, future) in batch:
+            end = start + len(sents)
+            if not future.done():
+                future.set_result(translated[start:end])
+            start = end
@@ -0,0 +1,233 @@
+"""Sentence-level translation caching."""
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple, Union
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+CacheKey = Tuple[str, str, str, str]
+"""(model, source language, target language, encoded source sentence)."""
+
+
+class SQLiteStore:
+    """A translation store on disk, shared by processes on the same host.
+
+    The database at `path` is opened in WAL mode so that many uvicorn
+    workers (or containers sharing a volume) can read while one writes.
+    Entries older than `ttl` seconds are ignored (0 means never).
+
+    `size` is the number of entries when the store was opened plus
+    those added since by this process (not by others sharing it).
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS translations ('
+        ' model TEXT NOT NULL,'
+        ' source_lang TEXT NOT NULL,'
+        ' target_lang TEXT NOT NULL,'
+        ' source TEXT NOT NULL,'
+        ' target TEXT NOT NULL,'
+        ' created REAL NOT NULL,'
+        ' PRIMARY KEY (model, source_lang, target_lang, source))'
+    )
+
+    def __init__(self, path: Union[Path, str], ttl: float = 0):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path),
+                                     timeout=30,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(self.schema)
+        self.size = len(self)
+
+    def __len__(self):
+        with self._lock:
+            (n,) = self._conn.execute(
+                'SELECT COUNT(*) FROM translations').fetchone()
+        return n
+
+    def get_many(self, keys: Iterable[CacheKey]) -> List[Optional[str]]:
+        min_created = time.time() - self.ttl if self.ttl else 0
+        query = ('SELECT target FROM translations'
+                 ' WHERE model = ? AND source_lang = ? AND target_lang = ?'
+                 ' AND source = ? AND created >= ?')
+        values = []
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(query,
+                                         tuple(key) + (min_created,))
+                row = row.fetchone()
+                values.append(row[0] if row is not None else None)
+        return values
+
+    def set_many(self, items: Iterable[Tuple[CacheKey, str]]) -> None:
+        now = time.time()
+        rows = [tuple(key) + (value, now) for (key, value) in items]
+        if not rows:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                n_added = self._conn.executemany(
+                    'INSERT OR IGNORE INTO translations'
+                    ' VALUES (?, ?, ?, ?, ?, ?)',
+                    rows).rowcount
+                if n_added < len(rows):
+                    self._conn.executemany(
+                        'UPDATE translations SET target = ?, created = ?'
+                        ' WHERE model = ? AND source_lang = ?'
+                        ' AND target_lang = ? AND source = ?',
+                        (row[4:] + row[:4] for row in rows))
+            self.size += n_added
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM translations')
+            self.size = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class TranslationCache:
+    """An in-process LRU cache of translated sentences.
+
+    Holds at most `max_size` entries, each of which expires `ttl`
+    seconds after it was stored (a `ttl` of 0 means never).
+    A `max_size` of 0 disables caching.
+
+    If a `store` (e.g. `SQLiteStore`) is given, it is consulted for
+    entries missing from memory and written to on `set_many`, so
+    translations survive restarts and are shared between workers.
+    `lookup` reads the store in an executor, and writes are made
+    behind, by a thread of their own, so that neither blocks the
+    event loop.
+    """
+
+    def __init__(self,
+                 max_size: int = 10000,
+                 ttl: float = 0,
+                 store: Optional[SQLiteStore] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._writer = None
+        if store is not None:
+            self._writer = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='cache-store')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key: Hashable) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            (value, expires) = entry
+            if expires and expires < time.monotonic():
+                del self._entries[key]
+            else:
+                self._entries.move_to_end(key)
+                return value
+        return None
+
+    def get(self, key: Hashable) -> Optional[str]:
+        return self.get_many([key])[0]
+
+    def _fill(self, keys, values, missing, stored) -> List[Optional[str]]:
+        for (i, value) in zip(missing, stored):
+            if value is not None:
+                values[i] = value
+                self._set(keys[i], value)
+        n_misses = values.count(None)
+        self.hits += len(values) - n_misses
+        self.misses += n_misses
+        return values
+
+    def get_many(self, keys: Iterable[Hashable]) -> List[Optional[str]]:
+        """Look up `keys`, blocking on the store (see `lookup`)."""
+        keys = list(keys)
+        values = [self._get(key) for key in keys]
+        missing = [i for (i, value) in enumerate(values) if value is None]
+        stored = []
+        if self.store is not None and missing:
+            stored = self.store.get_many(keys[i] for i in missing)
+        return self._fill(keys, values, missing, stored)
+
+    async def lookup(self, keys: Iterable[Hashable]) -> List[Optional[str]]:
+        """Look up `keys`, reading the store in an executor."""
+        keys = list(keys)
+        values = [self._get(key) for key in keys]
+        missing = [i for (i, value) in enumerate(values) if value is None]
+        stored = []
+        if self.store is not None and missing:
+            loop = asyncio.get_running_loop()
+            stored = await loop.run_in_executor(
+                None, self.store.get_many, [keys[i] for i in missing])
+        return self._fill(keys, values, missing, stored)
+
+    def _set(self, key: Hashable, value: str) -> None:
+        if self.max_size <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else 0
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def set(self, key: Hashable, value: str) -> None:
+        self.set_many([(key, value)])
+
+    @staticmethod
+    def _log_write_failure(future: Future):
+        if future.exception() is not None:
+            log.warning('Failed to store translations: %r',
+                        future.exception())
+
+    def set_many(self, items: Iterable[Tuple[Hashable, str]]) -> None:
+        """Cache `items`; they are written to the store in the background."""
+        items = list(items)
+        for (key, value) in items:
+            self._set(key, value)
+        if self.store is not None and items:
+            future = self._writer.submit(self.store.set_many, items)
+            future.add_done_callback(self._log_write_failure)
+
+    def flush(self) -> None:
+        """Wait for the writes to the store made so far."""
+        if self._writer is not None:
+            self._writer.submit(lambda: None).result()
+
+    def close(self) -> None:
+        """Finish writing to the store, and close it."""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self.store.close()
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(size=len(self),
+                     max_size=self.max_size,
+                     hits=self.hits,
+                     misses=self.misses)
+        if self.store is not None:
+            stats['store_size'] = self.store.size
+        return stats
@@ -0,0 +1,99 @@
+"""Command line tools for the translation API service."""
+from itertools import islice
+from pathlib import Path
+
+import click
+from techiaith.utils.bitext import LanguagePair, normalize_many
+import sentencepiece
+
+from . import profiles
+from .cache import SQLiteStore
+from .controllers import model_id, read_config, spm_encode_sentences
+
+
+@click.group()
+def cli():
+    pass
+
+
+def _read_pairs(source_path, target_path):
+    with open(source_path, encoding='utf-8') as src_fp:
+        with open(target_path, encoding='utf-8') as trg_fp:
+            for (source, target) in zip(src_fp, trg_fp):
+                (source, target) = (source.strip(), target.strip())
+                if source and target:
+                    yield (source, target)
+
+
+@cli.command()
+@click.argument('config_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('corpus_prefix', type=click.Path())
+@click.option('--langs', default='en-cy', show_default=True)
+@click.option('--db', 'db_path',
+              envvar='TRANSLATION_CACHE_DB',
+              required=True,
+              type=click.Path(dir_okay=False),
+              help='SQLite database (default: $TRANSLATION_CACHE_DB).')
+@click.option('--batch-size', default=1000, show_default=True)
+def warm_cache(config_path, corpus_prefix, langs, db_path, batch_size):
+    """Pre-populate the shared translation cache from a parallel corpus.
+
+    Reads CORPUS_PREFIX.<source> and CORPUS_PREFIX.<target>
+    (e.g. work/corpus.test.en and work/corpus.test.cy) line by line
+    and stores each target line as the translation of its source line
+    for the model configured in CONFIG_PATH.
+    """
+    langs = LanguagePair(*langs.split('-'))
+    config = read_config(config_path)
+    spm = sentencepiece.SentencePieceProcessor(config['vocabs'])
+    model = model_id(config, config_path)
+    store = SQLiteStore(db_path)
+    pairs = _read_pairs(f'{corpus_prefix}.{langs.source}',
+                        f'{corpus_prefix}.{langs.target}')
+    n_stored = 0
+    while True:
+        batch = list(islice(pairs, batch_size))
+        if not batch:
+            break
+        sources = spm_encode_sentences(
+            spm,
+            normalize_many(source for (source, _) in batch))
+        store.set_many(((model, langs.source, langs.target, source), target)
+                       for (source, (_, target)) in zip(sources, batch))
+        n_stored += len(batch)
+    store.close()
+    click.echo(f'Stored {n_stored} translations in {Path(db_path)}')
+
+
+@cli.command()
+@click.argument('config_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--cpu-threads', default=4, show_default=True)
+@click.option('--beam-size', default=1, show_default=True)
+@click.option('--mini-batch', default=32, show_default=True)
+@click.option('--gemm-type', default='intgemm8', show_default=True,
+              help='Type of the packed model written by marian-conv.')
+@click.option('--shortlist', type=click.Path(exists=True, dir_okay=False),
+              help=('Lexical shortlist (default: '
+                    f'{profiles.SHORTLIST_FILENAME} next to CONFIG_PATH, '
+                    'if it exists).'))
+@click.option('--shortlist-size', default=50, show_default=True)
+def cpu_profile(config_path, cpu_threads, beam_size, mini_batch, gemm_type,
+                shortlist, shortlist_size):
+    """Write the CPU serving config for the model configured in CONFIG_PATH.
+
+    The API generates it when a model served with the `cpu` profile is
+    loaded; run this to do so ahead of time. The API generates it again
+    if its CPU_PROFILE_* settings differ from the options given here.
+    """
+    dest_path = profiles.write_cpu_config(config_path,
+                                          cpu_threads=cpu_threads,
+                                          beam_size=beam_size,
+                                          mini_batch=mini_batch,
+                                          gemm_type=gemm_type,
+                                          shortlist=shortlist,
+                                          shortlist_size=shortlist_size)
+    click.echo(f'Path: {dest_path}')
+
+
+if __name__ == '__main__':
+    cli()
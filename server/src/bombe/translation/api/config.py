@@ -1,5 +1,179 @@
+from functools import lru_cache
+from typing import Dict, List
 import os
 
+from pydantic import BaseSettings
+
+
+class Settings(BaseSettings):
+    # Directory containing models as <name>/<source>-<target>/.
+    models_dir: str = '/models'
+
+    # Unload least recently used models when those loaded exceed this
+    # many megabytes (estimated from their size on disk); 0 for no limit.
+    models_memory_budget_mb: int = 0
+
+    # Most models loaded at once; 0 for no limit.
+    models_max_loaded: int = 4
+
+    # Reload a loaded model when its decoder config is modified, checking
+    # every this many seconds; 0 to disable.
+    models_watch_interval: float = 0
+
+    # Seconds to let in-flight requests finish on a replaced model
+    # before its marian-server is stopped.
+    models_drain_timeout: float = 60.0
+
+    # Level of messages logged by the API (DEBUG includes the text of
+    # each sentence translated).
+    log_level: str = 'INFO'
+
+    # Log as plain `text` or one JSON object per line (`json`).
+    log_format: str = 'text'
+
+    # Fraction of requests for which DEBUG messages are logged.
+    log_sample_rate: float = 1.0
+
+    # Serving profile of models: gpu, or cpu to decode with a quantized
+    # model and lexical shortlist on CPU.
+    models_profile: str = 'gpu'
+
+    # Per model profiles, as JSON e.g: {"iechyd-a-gofal/en-cy": "cpu"}.
+    models_profiles: Dict[str, str] = {}
+
+    # Decoding options of generated cpu profile configs.
+    cpu_profile_threads: int = 4
+    cpu_profile_beam_size: int = 1
+    cpu_profile_mini_batch: int = 32
+    cpu_profile_gemm_type: str = 'intgemm8'
+    cpu_profile_shortlist_size: int = 50
+
+    # Bearer token required by the admin endpoints, which are disabled
+    # when empty.
+    api_admin_token: str = ''
+
+    # Number of marian-server processes, listening on consecutive ports
+    # starting at MARIAN_WS_PORT.
+    marian_workers: int = 1
+
+    # CPU threads per marian-server process; 0 decodes on the GPU.
+    marian_cpu_threads: int = 0
+
+    # Pin each marian-server process to its own set of CPU cores.
+    marian_pin_cpus: bool = False
+
+    # Seconds to wait for marian-server to load its model.
+    marian_startup_timeout: float = 300.0
+
+    # Number of times the example request is translated by each
+    # marian-server before it is sent real requests.
+    marian_warmup_batches: int = 1
+
+    # Maximum number of open WebSocket connections to each marian-server.
+    marian_ws_pool_size: int = 4
+
+    # Seconds to wait for a free connection before giving up.
+    marian_ws_pool_timeout: float = 30.0
+
+    # Seconds to hold sentences back so that they can be batched with
+    # those of concurrent requests; 0 disables cross-request batching.
+    marian_batch_max_delay: float = 0.005
+
+    # Send a batch as soon as it holds this many SentencePiece tokens.
+    marian_batch_max_tokens: int = 4096
+
+    # Sort each batch by sentence length and send sentences whose
+    # SentencePiece token counts fall in the same bucket of this width
+    # as separate sub-batches, to reduce padding; 0 to send batches
+    # whole, in document order.
+    marian_bucket_width: int = 0
+
+    # Cap on sentences × longest sentence (in tokens) in a sub-batch;
+    # 0 for no cap.
+    marian_sub_batch_max_tokens: int = 0
+
+    # Number of translated sentences to keep in memory; 0 disables.
+    translation_cache_size: int = 10000
+
+    # Seconds before a cached translation expires; 0 means never.
+    translation_cache_ttl: float = 0
+
+    # Path of an SQLite database shared by all workers on a host in
+    # which translations are persisted; empty for memory only.
+    translation_cache_db: str = ''
+
+    # Threads SentencePiece uses to encode and decode each batch of
+    # sentences; 0 for one per CPU.
+    spm_threads: int = 0
+
+    # Sentence splitter backend: spacy, sentencizer or moses.
+    sentence_splitter: str = 'spacy'
+
+    # Per source language backends, as JSON e.g: {"cy": "moses"}.
+    sentence_splitters: Dict[str, str] = {}
+
+    # Maximum characters in the text of a translation request.
+    api_max_chars: int = 100000
+
+    # Maximum sentences in a text to translate; 0 for no limit.
+    api_max_sentences: int = 2000
+
+    # Requests translated concurrently; 0 for no limit.
+    api_max_active: int = 32
+
+    # Requests waiting to be translated before new ones are rejected
+    # with 503.
+    api_max_waiting: int = 128
+
+    # Requests per second allowed per client (by X-API-Key header, if it
+    # is one of API_KEYS, or address); 0 to disable rate limiting.
+    api_rate_limit: float = 0
+
+    # Keys that identify clients for rate limiting, as JSON
+    # e.g: ["3b8f..."]. Other keys are ignored.
+    api_keys: List[str] = []
+
+    # Requests a client may make in a burst above the rate limit.
+    api_rate_burst: int = 20
+
+    # Limits on the number of items and total characters accepted by
+    # /api/translate/batch.
+    api_batch_max_items: int = 1000
+    api_batch_max_chars: int = 500000
+
+    # Sentences translated ahead of the client by /api/translate/stream.
+    api_stream_window: int = 8
+
+    # Directory in which document translation jobs and their database
+    # are kept; empty disables /api/jobs.
+    jobs_dir: str = ''
+
+    # Jobs translated concurrently in the background.
+    jobs_workers: int = 1
+
+    # Segments of a document sent to Marian at a time.
+    jobs_batch_size: int = 500
+
+    # Largest document accepted, in megabytes.
+    jobs_max_file_mb: int = 100
+
+    # Attempts to translate a job (e.g. while marian-server restarts)
+    # before it is marked as failed, and seconds between them.
+    jobs_max_attempts: int = 5
+    jobs_retry_delay: float = 10.0
+
+    # Return only the translation from /api/translate, unless a request
+    # sets `compact` to false.
+    api_compact_responses: bool = False
+
+    # Return debug fields (`before_post_proc`, `raw`) for every request.
+    api_debug: bool = False
+
+
+@lru_cache()
+def get_settings():
+    return Settings()
+
 
 def get_allowed_origins():
     origins = os.getenv('API_ALLOW_CORS_ORIGINS', '').split(',')
@@ -0,0 +1,190 @@
+"""Pooled WebSocket connections to marian-server."""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import logging
+import queue
+import threading
+
+import websocket
+
+
+log = logging.getLogger(__name__)
+
+
+connection_errors = (websocket.WebSocketException,
+                     ConnectionError,
+                     OSError)
+"""Errors that indicate a connection to marian-server is no longer usable."""
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available within the wait time."""
+
+
+class ConnectionPool:
+    """A bounded pool of long-lived WebSocket connections to `ws_addr`.
+
+    At most `size` connections are open at any one time; callers wait
+    up to `wait_timeout` seconds for one to become free.
+
+    Connections are opened lazily, pinged before being handed out and
+    re-established when marian-server has gone away (e.g. restarted).
+
+    `asend_recv` runs the blocking WebSocket I/O on a dedicated thread
+    per connection so that the event loop is free while Marian decodes.
+    Its callers wait for a free connection on the event loop, so that
+    they time out after `wait_timeout` rather than queueing for a
+    thread.
+    """
+
+    def __init__(self,
+                 ws_addr: str,
+                 size: int = 4,
+                 wait_timeout: float = 30.0,
+                 connect_timeout: float = 10.0):
+        self.ws_addr = ws_addr
+        self.size = size
+        self.wait_timeout = wait_timeout
+        self.connect_timeout = connect_timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(size)
+        self._executor = ThreadPoolExecutor(max_workers=size,
+                                            thread_name_prefix='marian-ws')
+        self._waiting = None
+        self._closed = False
+
+    def _connect(self):
+        ws = websocket.create_connection(self.ws_addr,
+                                         timeout=self.connect_timeout)
+        # Decoding a long document can take a while; only the
+        # handshake is subject to `connect_timeout`.
+        ws.settimeout(None)
+        return ws
+
+    @staticmethod
+    def _close(ws):
+        try:
+            ws.close()
+            # `close` does nothing once marian-server has closed the
+            # connection; the socket still needs closing.
+            ws.shutdown()
+        except connection_errors:
+            pass
+
+    @staticmethod
+    def is_healthy(ws) -> bool:
+        if not ws.connected:
+            return False
+        try:
+            ws.ping()
+        except connection_errors:
+            return False
+        return True
+
+    def acquire(self):
+        """Return a healthy connection, opening a new one if needed."""
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise PoolTimeout('No marian-server connection available',
+                              self.ws_addr,
+                              self.wait_timeout)
+        try:
+            ws = self._idle.get_nowait()
+        except queue.Empty:
+            ws = None
+        try:
+            if ws is not None and not self.is_healthy(ws):
+                self._close(ws)
+                ws = None
+            if ws is None:
+                ws = self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+        return ws
+
+    def release(self, ws):
+        """Return `ws` to the pool for re-use."""
+        self._idle.put_nowait(ws)
+        self._slots.release()
+        # Connections in use when the pool was closed are closed as
+        # they are returned.
+        if self._closed:
+            self._close_idle()
+
+    def discard(self, ws):
+        """Close `ws` and free its slot in the pool."""
+        self._close(ws)
+        self._slots.release()
+
+    @staticmethod
+    def _exchange(ws, message: str) -> str:
+        ws.send(message)
+        (opcode, data) = ws.recv_data()
+        if opcode == websocket.ABNF.OPCODE_CLOSE:
+            # `recv` would return an empty reply.
+            raise websocket.WebSocketConnectionClosedException(
+                'marian-server closed the connection')
+        return data.decode('utf-8') if isinstance(data, bytes) else data
+
+    @contextmanager
+    def connection(self):
+        ws = self.acquire()
+        try:
+            yield ws
+        except BaseException:
+            self.discard(ws)
+            raise
+        else:
+            self.release(ws)
+
+    def send_recv(self, message: str) -> str:
+        """Send `message` to marian-server and return its reply.
+
+        A connection found to be stale (e.g. marian-server restarted
+        since it was last used) is replaced and the message re-sent once.
+        """
+        try:
+            with self.connection() as ws:
+                return self._exchange(ws, message)
+        except ConnectionRefusedError:
+            raise
+        except connection_errors as err:
+            log.warning('Reconnecting to %s: %r', self.ws_addr, err)
+        with self.connection() as ws:
+            return self._exchange(ws, message)
+
+    async def asend_recv(self, message: str) -> str:
+        """Awaitable version of `send_recv`."""
+        if self._waiting is None:
+            self._waiting = asyncio.Semaphore(self.size)
+        try:
+            await asyncio.wait_for(self._waiting.acquire(), self.wait_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout('No marian-server connection available',
+                              self.ws_addr,
+                              self.wait_timeout) from None
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor,
+                                              self.send_recv,
+                                              message)
+        finally:
+            self._waiting.release()
+
+    def _close_idle(self):
+        while True:
+            try:
+                ws = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(ws)
+
+    def close(self):
+        """Close all connections, and stop the pool's threads.
+
+        Connections in use are closed once released.
+        """
+        self._closed = True
+        self._executor.shutdown(wait=False)
+        self._close_idle()
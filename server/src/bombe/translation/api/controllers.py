@@ -1,88 +1,384 @@
-from contextlib import closing
+from collections import deque
 from pathlib import Path
-import shlex
-import subprocess
-import time
+from typing import Optional
+import asyncio
+import logging
 
-from techiaith.utils.bitext import Sentence, normalize
+from techiaith.utils.bitext import normalize_many
 import sentencepiece
-import spacy
 import srsly
-import websocket
 
+from . import logs, metrics
+from .admission import RequestTooLarge
+from .batching import BatchScheduler
+from .cache import TranslationCache
+from .segmentation import SentenceSplitters
+from .workers import WorkerGroup
 
-class MarianServer:
 
-    marain_server_cmd = ('marian-server '
-                         '--allow-unk '
-                         '-c {config_path} '
-                         '--port {ws_port}')
+log = logging.getLogger(__name__)
+
+
+def read_config(config_path):
+    """Read a Marian decoder config, flattening single-item lists."""
+    with open(config_path) as fp:
+        config = srsly.yaml_loads(fp.read())
+    return {k: v[0] if isinstance(v, list) else v
+            for (k, v) in config.items()}
+
+
+def spm_encode_sentence(spm, text):
+    """Return `text` encoded as SentencePiece pieces, as sent to Marian."""
+    text = text.strip().rstrip('.')
+    return ' '.join(spm.encode(text, out_type=str))
+
+
+def spm_encode_sentences(spm, texts, num_threads=0):
+    """Encode each of `texts` as `spm_encode_sentence` does, in one call.
+
+    SentencePiece encodes the batch on `num_threads` threads
+    (0 for its default, one per CPU).
+    """
+    texts = [text.strip().rstrip('.') for text in texts]
+    pieces = spm.encode(texts, out_type=str, num_threads=num_threads or -1)
+    return [' '.join(sent_pieces) for sent_pieces in pieces]
+
+
+def spm_decode_sentences(spm, sentences, num_threads=0):
+    """Decode each of the translated `sentences` in one call."""
+    if not sentences:
+        # SentencePiece decodes an empty batch as an empty string.
+        return []
+    return spm.decode([[sent] for sent in sentences],
+                      num_threads=num_threads or -1)
+
+
+def reply_lines(reply, n_lines):
+    """Split the reply of marian-server into the translated lines.
+
+    Unlike `splitlines`, an empty translation is kept even when it is
+    the last line. A trailing newline after `n_lines` is ignored.
+    """
+    lines = reply.split('\n')
+    if len(lines) == n_lines + 1 and lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def alignment_offsets(source_text, source_sentences, target_sentences,
+                      out_sep):
+    """Character offsets of each sentence and its translation.
+
+    Returns `[source_start, source_end, target_start, target_end]` for
+    each pair of sentences, where the target offsets index the joined
+    translation. The source offsets are `None` for a sentence not found
+    verbatim in `source_text` (e.g. changed by normalization).
+    """
+    offsets = []
+    src_pos = 0
+    trg_pos = 0
+    for (source, target) in zip(source_sentences, target_sentences):
+        start = source_text.find(source, src_pos)
+        if start < 0:
+            source_span = [None, None]
+        else:
+            src_pos = start + len(source)
+            source_span = [start, src_pos]
+        offsets.append(source_span + [trg_pos, trg_pos + len(target)])
+        trg_pos += len(target) + len(out_sep)
+    return offsets
+
+
+def model_id(config, config_path):
+    """Identify the model a decoder `config` uses (for cache keys).
+
+    The modification time of the model file is included, so that
+    translations by a model are not served once it has been replaced.
+    """
+    model = config.get('models', str(config_path))
+    try:
+        mtime = Path(model).stat().st_mtime
+    except OSError:
+        return model
+    return f'{model}@{mtime:.0f}'
+
+
+class MarianServer:
 
-    def __init__(self, config_path: Path, ws_port: str):
+    def __init__(self,
+                 config_path: Path,
+                 ws_port: str,
+                 n_workers: int = 1,
+                 cpu_threads: int = 0,
+                 pin_cpus: bool = False,
+                 pool_size: int = 4,
+                 pool_wait_timeout: float = 30.0,
+                 startup_timeout: float = 300.0,
+                 warmup_batches: int = 1,
+                 batch_max_delay: float = 0.005,
+                 batch_max_tokens: int = 4096,
+                 bucket_width: int = 0,
+                 sub_batch_max_tokens: int = 0,
+                 spm_threads: int = 0,
+                 max_sentences: int = 0,
+                 cache: Optional[TranslationCache] = None,
+                 splitters: Optional[SentenceSplitters] = None):
         self.config_path = config_path
         self.config = self.read_config(config_path)
+        self._model_id = model_id(self.config, config_path)
         self.ws_port = ws_port
-        self.marian_ws_addr = f'ws://127.0.0.1:{ws_port}/translate'
-        print('VOCAB:', self.vocab)
+        # CPU decoder configs (see `profiles`) set their own thread count.
+        cpu_threads = cpu_threads or int(self.config.get('cpu-threads', 0))
+        self.workers = WorkerGroup(config_path,
+                                   ws_port,
+                                   n_workers=n_workers,
+                                   cpu_threads=cpu_threads,
+                                   pin_cpus=pin_cpus,
+                                   pool_size=pool_size,
+                                   pool_wait_timeout=pool_wait_timeout,
+                                   startup_timeout=startup_timeout)
+        self.warmup_batches = warmup_batches
+        self.warmup_text = None
+        self.warmup_lang = None
+        self.batcher = BatchScheduler(
+            self.send_to_marian,
+            max_delay=batch_max_delay,
+            max_tokens=batch_max_tokens,
+            bucket_width=bucket_width,
+            sub_batch_max_tokens=sub_batch_max_tokens)
+        self.cache = cache if cache is not None else TranslationCache()
+        log.info('Loading SentencePiece model %s', self.vocab)
         self.spm = sentencepiece.SentencePieceProcessor(self.vocab)
-        self.nlp = spacy.load('en_core_web_sm', disable=['tagger'])
-        self.nlp.add_pipe('sentencizer')
-        self.proc = None
+        self.spm_threads = spm_threads
+        self.max_sentences = max_sentences
+        self.splitters = splitters or SentenceSplitters()
 
     @property
     def vocab(self):
         return self.config['vocabs']
 
     def read_config(self, config_path):
-        with open(config_path) as fp:
-            config = srsly.yaml_loads(fp.read())
-        return {k: v[0] if isinstance(v, list) else v
-                for (k, v) in config.items()}
-
-    def pre_process(self, text, lang):
-        spm_encode = self.spm.encode
-        doc = self.doc = self.nlp(normalize(text))
-        for i, sent in enumerate(doc.sents, start=1):
-            print(f'Sent to translate {i}:', sent.text)
-            sent = Sentence(sent.text, lang)
-            text = sent.text.strip().rstrip('.')
-            yield ' '.join(spm_encode(text, out_type=str))
+        return read_config(config_path)
+
+    def split_sentences(self, text, lang):
+        """Split `text` into sentences.
+
+        Raises `RequestTooLarge` if there are more than `max_sentences`.
+        """
+        metrics.TEXT_CHARACTERS.observe(len(text))
+        with metrics.timed('normalize'):
+            # Line breaks are kept as sentence boundaries.
+            text = '\n'.join(normalize_many(text.splitlines()))
+        with metrics.timed('segment'):
+            sentences = self.splitters[lang](text)
+        if self.max_sentences and len(sentences) > self.max_sentences:
+            raise RequestTooLarge(f'At most {self.max_sentences} sentences '
+                                  f'allowed per text')
+        metrics.SENTENCES.inc(len(sentences))
+        return sentences
+
+    def pre_process(self, sentences, lang):
+        """Encode `sentences` with SentencePiece, as a batch."""
+        sentences = list(sentences)
+        if logs.detail_enabled(log):
+            for (i, sent) in enumerate(sentences, start=1):
+                log.debug('Sentence %d to translate: %s', i, sent)
+        if not sentences:
+            return []
+        with metrics.timed('spm_encode'):
+            return spm_encode_sentences(self.spm,
+                                        sentences,
+                                        num_threads=self.spm_threads)
 
     def post_process(self, translated_sentences, lang):
-        for sent in map(self.spm.decode, translated_sentences):
-            yield sent
-
-    async def translate(self, source_text, source_lang, target_lang):
-        out_sep = '\n' if source_text.find('\n') >= 0 else '  '
-        source_sentences = list(self.pre_process(source_text, source_lang))
-        raw = translated = None
-        print('Using WS:', self.marian_ws_addr)
-        with closing(websocket.create_connection(self.marian_ws_addr)) as ws:
-            ws.send('\n'.join(source_sentences))
-            translated = ws.recv().splitlines()
-            print('Before pre-process:', translated)
-            ws.send('\n'.join(source_text.split('\n')))
-            translated_raw = ws.recv().splitlines()
-        target_sentences = list(self.post_process(translated, target_lang))
-        return dict(translated=out_sep.join(target_sentences),
-                    source_text=source_text,
-                    source_sentences='\n'.join(map(str, self.doc.sents)),
-                    before_post_proc='\n' .join(translated),
-                    raw='\n'.join(translated_raw),
-                    source_lang=source_lang,
-                    target_lang=target_lang)
-
-    async def start(self):
-        cmd = self.marain_server_cmd.format(config_path=self.config_path,
-                                            ws_port=self.ws_port)
-        self.proc = subprocess.Popen(shlex.split(cmd))
+        """Decode `translated_sentences` with SentencePiece, as a batch."""
+        translated_sentences = list(translated_sentences)
+        if not translated_sentences:
+            return []
+        with metrics.timed('spm_decode'):
+            return spm_decode_sentences(self.spm,
+                                        translated_sentences,
+                                        num_threads=self.spm_threads)
+
+    async def send_to_marian(self, lines):
+        message = '\n'.join(lines)
+        with metrics.timed('marian'):
+            translated = await self.workers.send_recv(message)
+        metrics.TOKENS.labels('source').inc(len(message.split()))
+        metrics.TOKENS.labels('target').inc(len(translated.split()))
+        return reply_lines(translated, len(lines))
+
+    @property
+    def model_id(self):
+        return self._model_id
+
+    async def translate_sentences(self, source_sentences, source_lang,
+                                  target_lang):
+        """Translate SentencePiece-encoded `source_sentences`.
+
+        Sentences found in the cache are not sent to Marian.
+        """
+        keys = [(self.model_id, source_lang, target_lang, sent)
+                for sent in source_sentences]
+        translated = await self.cache.lookup(keys)
+        misses = [i for (i, trans) in enumerate(translated) if trans is None]
+        if misses:
+            fresh = await self.batcher.translate(
+                [source_sentences[i] for i in misses])
+            for (i, trans) in zip(misses, fresh):
+                translated[i] = trans
+            self.cache.set_many((keys[i], translated[i]) for i in misses)
+        return translated
+
+    @staticmethod
+    def output_separator(source_text):
+        return '\n' if source_text.find('\n') >= 0 else '  '
+
+    async def translate_many(self, source_texts, source_lang, target_lang):
+        """Translate each of `source_texts` with a single call to Marian.
+
+        Returns, for each text, either its translation or the exception
+        that prevented it from being translated.
+        """
+        prepared = []
+        for source_text in source_texts:
+            try:
+                prepared.append(self.split_sentences(source_text,
+                                                     source_lang))
+            except Exception as err:
+                prepared.append(err)
+        try:
+            source_sentences = self.pre_process(
+                [sent
+                 for item in prepared
+                 if not isinstance(item, Exception)
+                 for sent in item],
+                source_lang)
+            translated = await self.translate_sentences(source_sentences,
+                                                        source_lang,
+                                                        target_lang)
+            target_sentences = self.post_process(translated, target_lang)
+        except Exception as err:
+            return [item if isinstance(item, Exception) else err
+                    for item in prepared]
+        results = []
+        start = 0
+        for (source_text, item) in zip(source_texts, prepared):
+            if isinstance(item, Exception):
+                results.append(item)
+                continue
+            end = start + len(item)
+            out_sep = self.output_separator(source_text)
+            results.append(out_sep.join(target_sentences[start:end]))
+            start = end
+        return results
+
+    async def translate_stream(self, source_text, source_lang, target_lang,
+                               window=8, sentences=None):
+        """Yield the translation of each sentence of `source_text` in turn.
+
+        Up to `window` sentences are translated ahead of the one being
+        yielded; no more are started until the consumer catches up.
+        A summary record follows the last sentence.
+
+        `sentences` are those of `source_text`, if already split (see
+        `split_sentences`).
+        """
+        if sentences is None:
+            sentences = self.split_sentences(source_text, source_lang)
+        encoded = self.pre_process(sentences, source_lang)
+        pending = deque()
+        target_sentences = []
+
+        def next_record():
+            (index, sent, task) = pending.popleft()
+            (translated,) = task.result()
+            (target,) = self.post_process([translated], target_lang)
+            target_sentences.append(target)
+            return dict(index=index, source=sent, translated=target)
+
+        try:
+            for (index, (sent, enc)) in enumerate(zip(sentences, encoded)):
+                task = asyncio.ensure_future(
+                    self.translate_sentences([enc], source_lang, target_lang))
+                pending.append((index, sent, task))
+                if len(pending) >= window:
+                    await pending[0][-1]
+                    yield next_record()
+            while pending:
+                await pending[0][-1]
+                yield next_record()
+        finally:
+            for (_, _, task) in pending:
+                task.cancel()
+        out_sep = self.output_separator(source_text)
+        yield dict(done=True,
+                   translated=out_sep.join(target_sentences),
+                   n_sentences=len(target_sentences),
+                   source_lang=source_lang,
+                   target_lang=target_lang)
+
+    async def translate(self, source_text, source_lang, target_lang,
+                        debug=False, compact=False, alignment=False):
+        """Translate `source_text` from `source_lang` to `target_lang`.
+
+        With `compact`, only the translation (`translated`) is
+        returned, rather than also the source text, its sentences and
+        the languages. With `alignment`, the offsets of each sentence
+        and its translation are returned (see `alignment_offsets`).
+
+        When `debug` is true, the output of Marian before
+        post-processing (`before_post_proc`) and a second translation
+        of the unprocessed source text (`raw`) are also returned; the
+        latter costs an extra decode.
+        """
+        out_sep = self.output_separator(source_text)
+        sentences = self.split_sentences(source_text, source_lang)
+        source_sentences = self.pre_process(sentences, source_lang)
+        translated = await self.translate_sentences(source_sentences,
+                                                    source_lang,
+                                                    target_lang)
+        if logs.detail_enabled(log):
+            log.debug('Translated before post-processing: %s', translated)
+        target_sentences = self.post_process(translated, target_lang)
+        result = dict(translated=out_sep.join(target_sentences))
+        if not compact:
+            result.update(source_text=source_text,
+                          source_sentences='\n'.join(sentences),
+                          source_lang=source_lang,
+                          target_lang=target_lang)
+        if alignment:
+            result.update(alignment=alignment_offsets(source_text,
+                                                      sentences,
+                                                      target_sentences,
+                                                      out_sep))
+        if debug:
+            translated_raw = await self.workers.send_recv(
+                '\n'.join(source_text.split('\n')))
+            result.update(before_post_proc='\n'.join(translated),
+                          raw='\n'.join(translated_raw.splitlines()))
+        return result
+
+    async def start(self, warmup_text=None, warmup_lang=None):
+        """Start marian-server.
+
+        Workers accept requests once they have loaded their model and
+        translated `warmup_text` (in `warmup_lang`) `warmup_batches`
+        times, so that the first real request does not bear the cost.
+        """
+        self.warmup_text = warmup_text
+        self.warmup_lang = warmup_lang
+        probe = spm_encode_sentence(self.spm, 'Hello')
+        warmup = []
+        if warmup_text:
+            sentences = self.split_sentences(warmup_text, warmup_lang)
+            message = '\n'.join(self.pre_process(sentences, warmup_lang))
+            warmup = [message] * self.warmup_batches
+        await self.workers.start(probe, warmup)
 
     async def restart(self):
-        self.shutdown()
-        time.sleep(1)
-        self.start()
+        await self.shutdown()
+        await self.start(self.warmup_text, self.warmup_lang)
 
     async def shutdown(self):
-        if self.proc is not None:
-            self.proc.terminate()
-            self.proc.wait()
+        await self.workers.shutdown()
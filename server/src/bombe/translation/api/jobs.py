@@ -0,0 +1,478 @@
+"""Offline translation of whole documents as resumable jobs."""
+from functools import partial
+from pathlib import Path
+from typing import (Awaitable, Callable, Dict, Iterator, List, Optional,
+                    Sequence, Tuple, Union)
+from urllib.parse import quote
+import asyncio
+import csv
+import io
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+
+from techiaith.utils.bitext import LanguagePair, to_bitext
+
+from .admission import RequestTooLarge
+
+
+log = logging.getLogger(__name__)
+
+
+BITEXT_FORMATS = ('tmx', 'csv', 'tsv')
+"""Formats read with `to_bitext`; their result is a TSV file."""
+
+FORMATS = ('txt',) + BITEXT_FORMATS
+"""Extensions of the files that can be translated."""
+
+FINISHED = ('done', 'failed')
+"""Statuses of jobs that will not progress further."""
+
+
+class UnsupportedFormat(Exception):
+    """Raised when a file to translate has an unknown extension."""
+
+
+class JobNotFound(Exception):
+    """Raised when no job has the ID given."""
+
+
+def read_segments(path: Path,
+                  langs: LanguagePair) -> List[Tuple[str, Optional[str]]]:
+    """Read the segments to translate from the file at `path`.
+
+    Plain text is translated line by line. For TMX, CSV and TSV files,
+    the source side of each pair of sentences read by `to_bitext` is
+    translated, and the target side is kept as a reference.
+
+    Returns a list of `(source, reference)` pairs.
+    """
+    fmt = path.suffix[1:].lower()
+    if fmt in BITEXT_FORMATS:
+        return [(source.text, target.text)
+                for (source, target) in to_bitext(path, langs)]
+    if fmt == 'txt':
+        with open(path, encoding='utf-8') as fp:
+            return [(line.rstrip('\n'), None) for line in fp]
+    raise UnsupportedFormat(f'Cannot translate .{fmt} files; '
+                            f'expected one of {", ".join(FORMATS)}')
+
+
+def content_disposition(filename: str) -> str:
+    """The Content-Disposition header to download a file as `filename`.
+
+    Non-ASCII names are given as `filename*` (RFC 5987), with an ASCII
+    `filename` for older clients.
+    """
+    filename = ''.join(c for c in filename if c.isprintable())
+    fallback = unicodedata.normalize('NFKD', filename)
+    fallback = fallback.encode('ascii', 'ignore').decode('ascii')
+    fallback = fallback.replace('"', '').replace('\\', '')
+    if not fallback or fallback.startswith('.'):
+        fallback = 'document' + fallback
+    return (f'attachment; filename="{fallback}"; '
+            f"filename*=UTF-8''{quote(filename, safe='')}")
+
+
+class JobStore:
+    """Jobs and the segments of their documents, in SQLite.
+
+    Every translated batch of segments is committed, so a job that is
+    interrupted (e.g. by a restart) resumes from its first untranslated
+    segment.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        ' id TEXT PRIMARY KEY,'
+        ' status TEXT NOT NULL,'
+        ' filename TEXT NOT NULL,'
+        ' format TEXT NOT NULL,'
+        ' model TEXT NOT NULL,'
+        ' source_lang TEXT NOT NULL,'
+        ' target_lang TEXT NOT NULL,'
+        ' n_segments INTEGER,'
+        ' n_done INTEGER NOT NULL DEFAULT 0,'
+        ' n_errors INTEGER NOT NULL DEFAULT 0,'
+        ' attempts INTEGER NOT NULL DEFAULT 0,'
+        ' error TEXT,'
+        ' created REAL NOT NULL,'
+        ' updated REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS segments ('
+        ' job_id TEXT NOT NULL,'
+        ' idx INTEGER NOT NULL,'
+        ' source TEXT NOT NULL,'
+        ' reference TEXT,'
+        ' target TEXT,'
+        ' error TEXT,'
+        ' PRIMARY KEY (job_id, idx))',
+    )
+
+    columns = ('id', 'status', 'filename', 'format', 'model',
+               'source_lang', 'target_lang', 'n_segments', 'n_done',
+               'n_errors', 'attempts', 'error', 'created', 'updated')
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path),
+                                     timeout=30,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.schema:
+            self._conn.execute(statement)
+
+    def _row_to_job(self, row) -> Optional[Dict]:
+        return dict(zip(self.columns, row)) if row is not None else None
+
+    def create(self, filename: str, fmt: str, model: str,
+               source_lang: str, target_lang: str) -> Dict:
+        now = time.time()
+        job = dict(id=uuid.uuid4().hex,
+                   status='uploading',
+                   filename=filename,
+                   format=fmt,
+                   model=model,
+                   source_lang=source_lang,
+                   target_lang=target_lang,
+                   n_segments=None,
+                   n_done=0,
+                   n_errors=0,
+                   attempts=0,
+                   error=None,
+                   created=now,
+                   updated=now)
+        with self._lock:
+            self._conn.execute(
+                f'INSERT INTO jobs VALUES ({", ".join("?" * len(job))})',
+                tuple(job[column] for column in self.columns))
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {", ".join(self.columns)} FROM jobs WHERE id = ?',
+                (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def update(self, job_id: str, **fields) -> None:
+        fields['updated'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f'UPDATE jobs SET {assignments} WHERE id = ?',
+                tuple(fields.values()) + (job_id,))
+
+    def claim_next(self) -> Optional[Dict]:
+        """Mark the oldest queued job as running and return it."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN IMMEDIATE')
+                row = self._conn.execute(
+                    f'SELECT {", ".join(self.columns)} FROM jobs'
+                    ' WHERE status = ? ORDER BY created LIMIT 1',
+                    ('queued',)).fetchone()
+                if row is None:
+                    return None
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1,'
+                    ' updated = ? WHERE id = ?',
+                    ('running', time.time(), row[0]))
+        job = self._row_to_job(row)
+        job.update(status='running', attempts=job['attempts'] + 1)
+        return job
+
+    def requeue_running(self) -> int:
+        """Queue again the jobs left running when the API stopped."""
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET status = ?, updated = ? WHERE status = ?',
+                ('queued', time.time(), 'running'))
+        return cursor.rowcount
+
+    def add_segments(self, job_id: str,
+                     segments: Sequence[Tuple[str, Optional[str]]]) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.execute('DELETE FROM segments WHERE job_id = ?',
+                                   (job_id,))
+                self._conn.executemany(
+                    'INSERT INTO segments (job_id, idx, source, reference)'
+                    ' VALUES (?, ?, ?, ?)',
+                    ((job_id, idx, source, reference)
+                     for (idx, (source, reference)) in enumerate(segments)))
+                self._conn.execute(
+                    'UPDATE jobs SET n_segments = ?, updated = ?'
+                    ' WHERE id = ?',
+                    (len(segments), time.time(), job_id))
+
+    def pending_segments(self, job_id: str,
+                         limit: int) -> List[Tuple[int, str]]:
+        """Return up to `limit` of the untranslated segments of a job."""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT idx, source FROM segments'
+                ' WHERE job_id = ? AND target IS NULL'
+                ' ORDER BY idx LIMIT ?',
+                (job_id, limit)).fetchall()
+
+    def save_translations(
+            self,
+            job_id: str,
+            rows: Sequence[Tuple[int, str, Optional[str]]]) -> None:
+        """Store `(index, target, error)` of translated segments."""
+        n_errors = sum(error is not None for (_, _, error) in rows)
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.executemany(
+                    'UPDATE segments SET target = ?, error = ?'
+                    ' WHERE job_id = ? AND idx = ?',
+                    ((target, error, job_id, idx)
+                     for (idx, target, error) in rows))
+                self._conn.execute(
+                    'UPDATE jobs SET n_done = n_done + ?,'
+                    ' n_errors = n_errors + ?, updated = ? WHERE id = ?',
+                    (len(rows), n_errors, time.time(), job_id))
+
+    def segments(self, job_id: str) -> List[Tuple[str, str, str]]:
+        """Return the `(source, reference, target)` of each segment."""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT source, reference, target FROM segments'
+                ' WHERE job_id = ? ORDER BY idx',
+                (job_id,)).fetchall()
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.execute('DELETE FROM segments WHERE job_id = ?',
+                                   (job_id,))
+                self._conn.execute('DELETE FROM jobs WHERE id = ?',
+                                   (job_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+Translate = Callable[[Dict, List[str]],
+                     Awaitable[List[Union[str, Exception]]]]
+"""Translates texts for a job, returning a translation or error for each."""
+
+
+class JobManager:
+    """Translates the documents of queued jobs in the background.
+
+    Documents are kept under `jobs_dir`, alongside the `JobStore`.
+    `n_workers` jobs are translated at once, each `batch_size`
+    segments at a time with `translate` (so that Marian is sent large
+    batches). When a whole batch fails, the job is queued again after
+    `retry_delay` seconds, and fails after `max_attempts` attempts.
+
+    The workers use the store from an executor, so as not to block the
+    event loop.
+    """
+
+    def __init__(self,
+                 jobs_dir: Union[Path, str],
+                 translate: Translate,
+                 n_workers: int = 1,
+                 batch_size: int = 500,
+                 max_attempts: int = 5,
+                 retry_delay: float = 10.0,
+                 poll_interval: float = 1.0):
+        self.jobs_dir = Path(jobs_dir)
+        self.store = JobStore(self.jobs_dir / 'jobs.sqlite3')
+        self.translate = translate
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._submitted = None
+        self._workers = []
+
+    def document_path(self, job: Dict) -> Path:
+        return self.jobs_dir / job['id'] / f'document.{job["format"]}'
+
+    def create(self, filename: str, model: str,
+               source_lang: str, target_lang: str) -> Dict:
+        """Create a job to translate `filename`.
+
+        The document must be written to `document_path(job)` before
+        the job is handed to `submit`.
+        """
+        fmt = Path(filename).suffix[1:].lower()
+        if fmt not in FORMATS:
+            raise UnsupportedFormat(f'Cannot translate .{fmt} files; '
+                                    f'expected one of {", ".join(FORMATS)}')
+        job = self.store.create(filename, fmt, model,
+                                source_lang, target_lang)
+        self.document_path(job).parent.mkdir(parents=True, exist_ok=True)
+        return job
+
+    async def _in_executor(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None,
+                                          partial(func, *args, **kwargs))
+
+    async def submit(self, job: Dict) -> None:
+        """Queue `job` (as returned by `create`) for translation."""
+        await self._in_executor(self.store.update, job['id'], status='queued')
+        if self._submitted is not None:
+            self._submitted.set()
+
+    def get(self, job_id: str) -> Dict:
+        job = self.store.get(job_id)
+        if job is None:
+            raise JobNotFound(f'No job {job_id}')
+        return job
+
+    async def poll(self, job_id: str) -> Optional[Dict]:
+        """The job with ID `job_id`, or None if it has been deleted."""
+        return await self._in_executor(self.store.get, job_id)
+
+    def delete(self, job_id: str) -> None:
+        """Delete a job; it stops after the batch being translated."""
+        self.get(job_id)
+        self.store.delete(job_id)
+        shutil.rmtree(self.jobs_dir / job_id, ignore_errors=True)
+
+    def result_filename(self, job: Dict) -> str:
+        stem = Path(job['filename']).stem or 'document'
+        ext = 'tsv' if job['format'] in BITEXT_FORMATS else 'txt'
+        return f'{stem}.{job["target_lang"]}.{ext}'
+
+    def iter_result(self, job: Dict) -> Iterator[str]:
+        """Yield the translated document of a finished job in chunks.
+
+        Plain text is returned line for line; other formats as TSV
+        with the source, reference and translated text of each segment.
+        """
+        segments = self.store.segments(job['id'])
+        if job['format'] not in BITEXT_FORMATS:
+            for (_, _, target) in segments:
+                yield (target or '') + '\n'
+            return
+        buf = io.StringIO()
+        writer = csv.writer(buf, dialect='excel-tab', lineterminator='\n')
+        writer.writerow((job['source_lang'], job['target_lang'], 'translated'))
+        for (source, reference, target) in segments:
+            writer.writerow((source, reference or '', target or ''))
+            if buf.tell() >= 65536:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    async def _read(self, job: Dict) -> None:
+        langs = LanguagePair(job['source_lang'], job['target_lang'])
+        loop = asyncio.get_running_loop()
+        segments = await loop.run_in_executor(None,
+                                              read_segments,
+                                              self.document_path(job),
+                                              langs)
+        await self._in_executor(self.store.add_segments, job['id'], segments)
+        log.info('Job %s has %d segments to translate',
+                 job['id'], len(segments))
+
+    async def run(self, job: Dict) -> None:
+        """Translate the remaining segments of `job`."""
+        if job['n_segments'] is None:
+            try:
+                await self._read(job)
+            except Exception as err:
+                log.warning('Job %s failed to read %s: %r',
+                            job['id'], job['filename'], err)
+                await self._in_executor(self.store.update,
+                                        job['id'],
+                                        status='failed',
+                                        error=repr(err))
+                return
+        while await self.poll(job['id']) is not None:
+            batch = await self._in_executor(self.store.pending_segments,
+                                            job['id'],
+                                            self.batch_size)
+            if not batch:
+                await self._in_executor(self.store.update,
+                                        job['id'],
+                                        status='done')
+                log.info('Job %s is done', job['id'])
+                return
+            texts = [source for (_, source) in batch if source.strip()]
+            results = iter(await self.translate(job, texts) if texts else [])
+            failures = []
+            rows = []
+            for (idx, source) in batch:
+                result = next(results) if source.strip() else source
+                if isinstance(result, Exception):
+                    failures.append(result)
+                    rows.append((idx, '', repr(result)))
+                else:
+                    rows.append((idx, result, None))
+            if (texts
+                    and len(failures) == len(texts)
+                    and not isinstance(failures[0], RequestTooLarge)
+                    and all(err is failures[0] for err in failures)):
+                # The whole batch failed: Marian is likely unavailable.
+                raise failures[0]
+            await self._in_executor(self.store.save_translations,
+                                    job['id'],
+                                    rows)
+
+    async def _work(self):
+        while True:
+            job = await self._in_executor(self.store.claim_next)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._submitted.wait(),
+                                           self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._submitted.clear()
+                continue
+            log.info('Translating job %s (attempt %d)',
+                     job['id'], job['attempts'])
+            try:
+                await self.run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                log.warning('Job %s interrupted: %r', job['id'], err)
+                if job['attempts'] >= self.max_attempts:
+                    await self._in_executor(self.store.update,
+                                            job['id'],
+                                            status='failed',
+                                            error=repr(err))
+                else:
+                    await asyncio.sleep(self.retry_delay)
+                    await self._in_executor(self.store.update,
+                                            job['id'],
+                                            status='queued')
+
+    def start(self):
+        """Start the workers, resuming jobs interrupted by a restart."""
+        n_resumed = self.store.requeue_running()
+        if n_resumed:
+            log.info('Resuming %d interrupted jobs', n_resumed)
+        self._submitted = asyncio.Event()
+        self._workers = [asyncio.ensure_future(self._work())
+                         for _ in range(self.n_workers)]
+
+    async def shutdown(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self._in_executor(self.store.requeue_running)
+        await self._in_executor(self.store.close)
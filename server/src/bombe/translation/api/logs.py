@@ -0,0 +1,92 @@
+"""Structured logging with per-request IDs and sampling.
+
+Every record logged under the `bombe` logger carries the ID of the
+request being handled (`request_id`). Detailed logging of the text
+being translated is only emitted at DEBUG level, and then only for a
+sampled fraction of requests (see `detail_enabled`), so that it costs
+next to nothing by default.
+"""
+from contextvars import ContextVar
+from typing import Optional
+import logging
+import random
+import time
+import uuid
+
+import srsly
+
+
+request_id: ContextVar[str] = ContextVar('request_id', default='-')
+
+_sampled: ContextVar[bool] = ContextVar('sampled', default=True)
+
+# Attributes of every `logging.LogRecord`, which are not "extra" fields.
+_record_attrs = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None)))
+
+
+def begin_request(rid: Optional[str] = None,
+                  sample_rate: float = 1.0) -> str:
+    """Set the ID of the current request, and whether it is sampled."""
+    rid = rid or uuid.uuid4().hex
+    request_id.set(rid)
+    _sampled.set(sample_rate >= 1 or random.random() < sample_rate)
+    return rid
+
+
+def detail_enabled(logger: logging.Logger) -> bool:
+    """Whether to log the details of the current request to `logger`.
+
+    Check this before formatting per-sentence messages.
+    """
+    return logger.isEnabledFor(logging.DEBUG) and _sampled.get()
+
+
+class RequestContextFilter(logging.Filter):
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line.
+
+    Fields passed with `extra` are included alongside the message.
+    """
+
+    def format(self, record):
+        entry = dict(time=time.strftime('%Y-%m-%dT%H:%M:%S',
+                                        time.gmtime(record.created)),
+                     level=record.levelname,
+                     logger=record.name,
+                     request_id=getattr(record, 'request_id', '-'),
+                     message=record.getMessage())
+        for (key, value) in vars(record).items():
+            if key not in _record_attrs and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return srsly.json_dumps(entry)
+
+
+text_format = ('%(asctime)s %(levelname)s %(name)s '
+               '[%(request_id)s] %(message)s')
+
+
+def configure(level: str = 'INFO', fmt: str = 'text', stream=None):
+    """Log records from `bombe` loggers to `stream` (default: stderr).
+
+    `fmt` is either `text` or `json`.
+    """
+    handler = logging.StreamHandler(stream)
+    handler.addFilter(RequestContextFilter())
+    if fmt == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(text_format))
+    logger = logging.getLogger('bombe')
+    for old_handler in list(logger.handlers):
+        logger.removeHandler(old_handler)
+    logger.addHandler(handler)
+    logger.setLevel(level.upper())
+    logger.propagate = False
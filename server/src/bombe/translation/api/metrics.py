@@ -0,0 +1,85 @@
+"""Prometheus metrics exported at `/metrics`."""
+from contextlib import contextmanager
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+STAGES = ('normalize',
+          'segment',
+          'spm_encode',
+          'marian',
+          'spm_decode')
+"""Steps in translating a text, timed by `STAGE_SECONDS`."""
+
+STAGE_SECONDS = Histogram(
+    'bombe_translation_stage_seconds',
+    'Time spent in each stage of translation, per text or batch.',
+    ['stage'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+             1, 2.5, 5, 10, 30))
+
+# Export every stage from the start, before its first observation.
+for stage in STAGES:
+    STAGE_SECONDS.labels(stage)
+
+REQUEST_SECONDS = Histogram(
+    'bombe_translation_request_seconds',
+    'Time taken to respond to API requests (to the first byte for '
+    'streamed responses).',
+    ['endpoint'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+
+REQUEST_ERRORS = Counter(
+    'bombe_translation_request_errors',
+    'API requests responded to with an error status.',
+    ['endpoint', 'status'])
+
+TEXT_CHARACTERS = Histogram(
+    'bombe_translation_text_characters',
+    'Characters per text submitted for translation.',
+    buckets=(10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000))
+
+SENTENCES = Counter(
+    'bombe_translation_sentences',
+    'Sentences submitted for translation.')
+
+TOKENS = Counter(
+    'bombe_translation_tokens',
+    'SentencePiece tokens sent to and received from marian-server.',
+    ['side'])
+
+ITEM_ERRORS = Counter(
+    'bombe_translation_item_errors',
+    'Texts in batch requests that could not be translated.')
+
+QUEUE_DEPTH = Gauge(
+    'bombe_translation_queue_depth',
+    'Sentences waiting to be batched for marian-server.')
+
+ACTIVE_REQUESTS = Gauge(
+    'bombe_translation_active_requests',
+    'Requests being translated.')
+
+WAITING_REQUESTS = Gauge(
+    'bombe_translation_waiting_requests',
+    'Requests waiting for a translation slot.')
+
+REJECTED_REQUESTS = Counter(
+    'bombe_translation_rejected_requests',
+    'Requests rejected by admission control.',
+    ['reason'])
+
+MARIAN_IN_FLIGHT = Gauge(
+    'bombe_translation_marian_in_flight',
+    'Messages sent to marian-server awaiting a reply.')
+
+
+@contextmanager
+def timed(stage: str):
+    """Observe the time taken by the enclosed block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
@@ -1,12 +1,97 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
 
 class TranslationRequest(BaseModel):
     text: str = Field(example='I have a headache.')
-    source_language: Optional[str] = Field(default='en', example='en')
-    target_language: Optional[str] = Field(default='cy', example='cy')
+    source_language: Optional[str] = Field(
+        default=None,
+        example='en',
+        description='Language to translate from (default: SOURCE_LANGUAGE).')
+    target_language: Optional[str] = Field(
+        default=None,
+        example='cy',
+        description='Language to translate to (default: TARGET_LANGUAGE).')
+    model: Optional[str] = Field(
+        default=None,
+        description='Name of the model to use (default: MARIAN_MODEL_NAME).')
+    compact: Optional[bool] = Field(
+        default=None,
+        description=('Return only the translation, without the source '
+                     'text, its sentences and the languages '
+                     '(default: API_COMPACT_RESPONSES).'))
+    alignment: Optional[bool] = Field(
+        default=False,
+        description=('Include the [source start, source end, target start, '
+                     'target end] character offsets of each sentence.'))
+    debug: Optional[bool] = Field(
+        default=False,
+        description=('Include the pre-post-processing and raw Marian '
+                     'translations in the response (decodes twice).'))
+
+
+class TranslationResponse(BaseModel):
+    translated: str = Field(example='Mae gen i gur pen.')
+    source_text: Optional[str] = Field(example='I have a headache.')
+    source_sentences: Optional[str] = Field(example='I have a headache.')
+    source_lang: Optional[str] = Field(example='en')
+    target_lang: Optional[str] = Field(example='cy')
+    alignment: Optional[List[List[Optional[int]]]] = Field(
+        example=[[0, 18, 0, 18]])
+    before_post_proc: Optional[str]
+    raw: Optional[str]
+
+
+class BatchItem(BaseModel):
+    id: str = Field(example='1')
+    text: str = Field(example='I have a headache.')
+
+
+class BatchTranslationRequest(BaseModel):
+    items: List[BatchItem]
+    source_language: Optional[str] = Field(
+        default=None,
+        example='en',
+        description='Language to translate from (default: SOURCE_LANGUAGE).')
+    target_language: Optional[str] = Field(
+        default=None,
+        example='cy',
+        description='Language to translate to (default: TARGET_LANGUAGE).')
+    model: Optional[str] = Field(
+        default=None,
+        description='Name of the model to use (default: MARIAN_MODEL_NAME).')
+
+
+class BatchTranslatedItem(BaseModel):
+    id: str = Field(example='1')
+    translated: Optional[str] = Field(example='Mae gen i gur pen.')
+    error: Optional[str] = Field(
+        description='Why the item could not be translated, if it failed.')
+
+
+class BatchTranslationResponse(BaseModel):
+    items: List[BatchTranslatedItem]
+    source_language: str
+    target_language: str
+
+
+class Job(BaseModel):
+    id: str = Field(example='3f2c9a0e6b1d4b7e8c5a2d9f0e1b3c4a')
+    status: str = Field(
+        example='running',
+        description='uploading, queued, running, done or failed.')
+    filename: str = Field(example='manual.tmx')
+    model: str
+    source_language: str = Field(example='en')
+    target_language: str = Field(example='cy')
+    n_segments: Optional[int] = Field(
+        description='Segments in the document, once it has been read.')
+    n_done: int = Field(description='Segments translated so far.')
+    n_errors: int = Field(description='Segments that failed to translate.')
+    error: Optional[str] = Field(description='Why the job failed.')
+    created: float
+    updated: float
 
 
 class Translated(BaseModel):
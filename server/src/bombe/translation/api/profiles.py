@@ -0,0 +1,136 @@
+"""Decoder configurations for serving a model on GPU or CPU.
+
+The `gpu` profile serves a model with the decoder config it was
+published with (`model.npz.decoder.yml`).
+
+The `cpu` profile serves it with `model.cpu.decoder.yml`, generated
+next to it by `write_cpu_config`: the model is converted by
+`marian-conv` to an 8-bit integer (intgemm) packed binary, decoded with
+a small beam on a fixed number of CPU threads, and with a lexical
+shortlist if one (`lex.s2t`) has been published with the model. The
+options it was generated with are recorded in its first line, so that
+it is generated again when they change.
+"""
+from pathlib import Path
+from typing import Dict, Optional
+import logging
+import shlex
+import subprocess
+
+import srsly
+
+
+log = logging.getLogger(__name__)
+
+
+PROFILES = ('gpu', 'cpu')
+
+CPU_CONFIG_FILENAME = 'model.cpu.decoder.yml'
+
+SHORTLIST_FILENAME = 'lex.s2t'
+
+OPTIONS_HEADER = '# Generated by write_cpu_config with options: '
+
+
+def cpu_config_path(config_path: Path) -> Path:
+    return Path(config_path).with_name(CPU_CONFIG_FILENAME)
+
+
+def cpu_options(config_path: Path,
+                cpu_threads: int = 4,
+                beam_size: int = 1,
+                mini_batch: int = 32,
+                gemm_type: str = 'intgemm8',
+                shortlist_size: int = 50,
+                shortlist: Optional[Path] = None) -> Dict:
+    """The options of `write_cpu_config`, as recorded in the config."""
+    shortlist = Path(shortlist or
+                     Path(config_path).with_name(SHORTLIST_FILENAME))
+    return dict(cpu_threads=cpu_threads,
+                beam_size=beam_size,
+                mini_batch=mini_batch,
+                gemm_type=gemm_type,
+                shortlist_size=shortlist_size,
+                shortlist=str(shortlist) if shortlist.is_file() else None)
+
+
+def options_header(options: Dict) -> str:
+    return OPTIONS_HEADER + srsly.json_dumps(options, sort_keys=True)
+
+
+def is_stale(config_path: Path, **options) -> bool:
+    """Whether the CPU config of a model is missing, out of date, or
+    was written with other `options` (see `write_cpu_config`)."""
+    cpu_path = cpu_config_path(config_path)
+    if (not cpu_path.is_file()
+            or cpu_path.stat().st_mtime < Path(config_path).stat().st_mtime):
+        return True
+    with open(cpu_path) as fp:
+        header = fp.readline().rstrip('\n')
+    return header != options_header(cpu_options(config_path, **options))
+
+
+def convert_model(model_path: Path, dest_path: Path,
+                  gemm_type: str = 'intgemm8') -> Path:
+    """Convert a model to a binary packed for `gemm_type` with marian-conv."""
+    cmd = (f'marian-conv --from {shlex.quote(str(model_path))} '
+           f'--to {shlex.quote(str(dest_path))} '
+           f'--gemm-type {gemm_type}')
+    log.info('Converting %s for CPU decoding: %s', model_path, cmd)
+    subprocess.run(shlex.split(cmd), check=True)
+    return dest_path
+
+
+def write_cpu_config(config_path: Path,
+                     cpu_threads: int = 4,
+                     beam_size: int = 1,
+                     mini_batch: int = 32,
+                     gemm_type: str = 'intgemm8',
+                     shortlist_size: int = 50,
+                     shortlist: Optional[Path] = None) -> Path:
+    """Write the `cpu` profile decoder config for the model at `config_path`.
+
+    Settings not specific to decoding on CPU are copied from the
+    model's decoder config. The lexical shortlist, if any, keeps the
+    `shortlist_size` most probable translations of each source word.
+    Returns the path of the new config.
+    """
+    config_path = Path(config_path)
+    options = cpu_options(config_path,
+                          cpu_threads=cpu_threads,
+                          beam_size=beam_size,
+                          mini_batch=mini_batch,
+                          gemm_type=gemm_type,
+                          shortlist_size=shortlist_size,
+                          shortlist=shortlist)
+    with open(config_path) as fp:
+        config: Dict = srsly.yaml_loads(fp.read())
+    models = config['models']
+    model_path = Path(models[0] if isinstance(models, list) else models)
+    packed_path = config_path.with_name(f'{model_path.stem}.{gemm_type}.bin')
+    convert_model(model_path, packed_path, gemm_type=gemm_type)
+    config.pop('devices', None)
+    config.update({'models': [str(packed_path)],
+                   'cpu-threads': cpu_threads,
+                   'beam-size': beam_size,
+                   'mini-batch': mini_batch,
+                   'maxi-batch': 100,
+                   'maxi-batch-sort': 'src',
+                   'workspace': 256,
+                   'skip-cost': True})
+    if options['shortlist'] is not None:
+        config['shortlist'] = [options['shortlist'],
+                               shortlist_size,
+                               shortlist_size,
+                               0]
+    else:
+        config.pop('shortlist', None)
+        log.warning('No lexical shortlist at %s, decoding on CPU with '
+                    'the full vocabulary',
+                    shortlist or config_path.with_name(SHORTLIST_FILENAME))
+    dest_path = cpu_config_path(config_path)
+    with open(dest_path, 'w') as fp:
+        fp.write(options_header(options) + '\n')
+        fp.write(srsly.yaml_dumps(config))
+    log.info('Wrote CPU decoder config %s', dest_path)
+    return dest_path
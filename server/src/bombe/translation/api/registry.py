@@ -0,0 +1,339 @@
+"""Serving many Marian models from one API process."""
+from collections import OrderedDict, namedtuple
+from contextlib import asynccontextmanager
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+
+from . import profiles
+from .controllers import MarianServer, read_config
+
+
+log = logging.getLogger(__name__)
+
+
+ModelKey = namedtuple('ModelKey', ('name', 'source', 'target'))
+"""Identifies a model by name and translation direction."""
+
+
+class UnknownModel(Exception):
+    """Raised when no model exists for a name and language pair."""
+
+
+class TooManyModels(Exception):
+    """Raised when a model cannot be loaded as too many are in use."""
+
+
+class ModelRegistry:
+    """Models under `models_dir`, loaded on first use.
+
+    Models are expected at `<models_dir>/<name>/<source>-<target>/`.
+    Each loaded model gets its own `MarianServer` (and marian-server
+    workers, on ports allocated from `base_port` upwards in steps of
+    `ports_per_model`).
+
+    Only the `available` models can be loaded. When loading a model
+    would take the number of loaded models over `max_loaded`, or their
+    combined size over `memory_budget` bytes, the least recently used
+    models that are not serving a request are unloaded first (0 means
+    no limit). `TooManyModels` is raised if that leaves more than
+    `max_loaded` models.
+
+    A loaded model can be replaced without downtime with `reload`
+    (or automatically with `watch`, when its decoder config changes):
+    the new model is started and warmed up alongside the old one,
+    requests are then routed to it, and the old server is shut down
+    once its in-flight requests have completed (or after
+    `drain_timeout` seconds).
+
+    Each model is served with the decoder config of its profile (see
+    `profiles`): the one named for it in `model_profiles` (by
+    `<name>/<source>-<target>` or `<name>`), or `default_profile`.
+    The config of the `cpu` profile is (re)generated with
+    `cpu_options` when the model is loaded, if it is missing, older
+    than the model's decoder config or written with other options.
+    """
+
+    config_filename = 'model.npz.decoder.yml'
+
+    def __init__(self,
+                 models_dir: Path,
+                 create_server: Callable[[Path, int], MarianServer],
+                 base_port: int,
+                 ports_per_model: int = 1,
+                 memory_budget: int = 0,
+                 max_loaded: int = 0,
+                 warmup_text: Optional[str] = None,
+                 drain_timeout: float = 60.0,
+                 default_profile: str = 'gpu',
+                 model_profiles: Optional[Dict[str, str]] = None,
+                 cpu_options: Optional[Dict[str, Any]] = None):
+        self.models_dir = Path(models_dir)
+        self.create_server = create_server
+        self.base_port = int(base_port)
+        self.ports_per_model = ports_per_model
+        self.memory_budget = memory_budget
+        self.max_loaded = max_loaded
+        self.warmup_text = warmup_text
+        self.drain_timeout = drain_timeout
+        self.default_profile = default_profile
+        self.model_profiles = dict(model_profiles or {})
+        self.cpu_options = dict(cpu_options or {})
+        for profile in [default_profile, *self.model_profiles.values()]:
+            if profile not in profiles.PROFILES:
+                raise ValueError(f'Unknown serving profile: {profile}')
+        self._servers = OrderedDict()
+        self._sizes = {}
+        self._mtimes = {}
+        self._slots = {}
+        self._active = {}
+        self._loading = {}
+        self._reloading = {}
+        self._draining = {}
+        self._watcher = None
+
+    def config_path(self, key: ModelKey) -> Path:
+        return Path(self.models_dir,
+                    key.name,
+                    f'{key.source}-{key.target}',
+                    self.config_filename)
+
+    def profile(self, key: ModelKey) -> str:
+        """Name of the profile `key` is served with."""
+        profile = self.model_profiles.get(
+            f'{key.name}/{key.source}-{key.target}',
+            self.model_profiles.get(key.name))
+        return profile or self.default_profile
+
+    async def serving_config_path(self, key: ModelKey) -> Path:
+        """Path of the decoder config to serve `key` with."""
+        config_path = self.config_path(key)
+        if self.profile(key) != 'cpu':
+            return config_path
+        if profiles.is_stale(config_path, **self.cpu_options):
+            write_config = partial(profiles.write_cpu_config,
+                                   config_path,
+                                   **self.cpu_options)
+            await asyncio.get_running_loop().run_in_executor(None,
+                                                             write_config)
+        return profiles.cpu_config_path(config_path)
+
+    def is_available(self, key: ModelKey) -> bool:
+        return key in self._servers or key in self.available()
+
+    def available(self) -> List[ModelKey]:
+        keys = []
+        pattern = f'*/*-*/{self.config_filename}'
+        for config_path in sorted(self.models_dir.glob(pattern)):
+            (name, langs) = config_path.parent.parts[-2:]
+            keys.append(ModelKey(name, *langs.split('-', 1)))
+        return keys
+
+    @property
+    def loaded(self) -> Dict[ModelKey, MarianServer]:
+        return dict(self._servers)
+
+    @staticmethod
+    def model_size(config_path: Path) -> int:
+        """Estimate the memory a model needs from its size on disk."""
+        config = read_config(config_path)
+        paths = [Path(config.get('models', '')), Path(config['vocabs'])]
+        if not paths[0].is_file():
+            paths = list(config_path.parent.glob('*.npz'))
+        return sum(path.stat().st_size for path in paths if path.is_file())
+
+    def _allocate_port(self) -> Tuple[int, int]:
+        used = set(self._slots.values())
+        slot = next(i for i in range(len(used) + 1) if i not in used)
+        return (slot, self.base_port + slot * self.ports_per_model)
+
+    async def _stop(self, server: MarianServer):
+        self._slots.pop(server, None)
+        self._active.pop(server, None)
+        await server.shutdown()
+
+    async def _unload(self, key: ModelKey):
+        server = self._servers.pop(key)
+        self._sizes.pop(key, None)
+        self._mtimes.pop(key, None)
+        log.info('Unloading model %s', key)
+        await self._stop(server)
+
+    async def _make_room(self, size: int, keep: Optional[ModelKey] = None):
+        if not self.memory_budget:
+            return
+        for (key, server) in list(self._servers.items()):
+            if sum(self._sizes.values()) + size <= self.memory_budget:
+                return
+            if key != keep and not self._active.get(server):
+                await self._unload(key)
+        if sum(self._sizes.values()) + size > self.memory_budget:
+            log.warning('Loaded models exceed the memory budget')
+
+    async def _limit_loaded(self):
+        """Unload models until there is room to load those loading."""
+        if not self.max_loaded:
+            return
+        for (key, server) in list(self._servers.items()):
+            if len(self._servers) + len(self._loading) <= self.max_loaded:
+                return
+            if not self._active.get(server):
+                await self._unload(key)
+        if len(self._servers) + len(self._loading) > self.max_loaded:
+            raise TooManyModels(f'At most {self.max_loaded} models can be '
+                                'loaded at once, and all are in use')
+
+    async def _start(self, key: ModelKey) -> MarianServer:
+        """Start a server for `key` and wait until it is ready."""
+        config_path = self.config_path(key)
+        if not config_path.is_file():
+            raise UnknownModel(f'No model {key.name} for '
+                               f'{key.source}-{key.target}',
+                               str(config_path))
+        mtime = config_path.stat().st_mtime
+        size = self.model_size(config_path)
+        await self._make_room(size, keep=key)
+        serving_config_path = await self.serving_config_path(key)
+        (slot, port) = self._allocate_port()
+        server = self.create_server(serving_config_path, port)
+        self._slots[server] = slot
+        try:
+            await server.start(self.warmup_text, key.source)
+            await server.workers.wait_until_ready()
+        except BaseException:
+            await self._stop(server)
+            raise
+        self._sizes[key] = size
+        self._mtimes[key] = mtime
+        return server
+
+    async def _load(self, key: ModelKey) -> MarianServer:
+        log.info('Loading model %s', key)
+        await self._limit_loaded()
+        server = await self._start(key)
+        self._servers[key] = server
+        return server
+
+    async def _drain(self, server: MarianServer):
+        """Stop `server` once it has no requests in flight."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+        while self._active.get(server) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        if self._active.get(server):
+            log.warning('Stopping %s with %d requests in flight',
+                        server.config_path,
+                        self._active[server])
+        await self._stop(server)
+
+    async def _swap(self, key: ModelKey) -> MarianServer:
+        log.info('Reloading model %s', key)
+        server = await self._start(key)
+        old_server = self._servers.get(key)
+        self._servers[key] = server
+        log.info('Switched model %s to the new server', key)
+        if old_server is not None:
+            task = asyncio.ensure_future(self._drain(old_server))
+            self._draining[task] = old_server
+            task.add_done_callback(self._draining.pop)
+        return server
+
+    def _check_available(self, key: ModelKey):
+        if not self.is_available(key):
+            raise UnknownModel(f'No model {key.name} for '
+                               f'{key.source}-{key.target}')
+
+    async def get(self, key: ModelKey) -> MarianServer:
+        """Return the server for `key`, loading the model if need be."""
+        server = self._servers.get(key)
+        if server is not None:
+            self._servers.move_to_end(key)
+            return server
+        task = self._loading.get(key)
+        if task is None:
+            self._check_available(key)
+            task = asyncio.ensure_future(self._load(key))
+            self._loading[key] = task
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def reload(self, key: ModelKey) -> MarianServer:
+        """Replace the server for `key` with one running the model on disk.
+
+        Requests continue to be served by the current server until the
+        new one is ready, which is then returned; the old server is
+        stopped in the background once drained. Models that are not
+        loaded are just loaded.
+        """
+        if key not in self._servers:
+            return await self.get(key)
+        self._check_available(key)
+        task = self._reloading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._swap(key))
+            self._reloading[key] = task
+            task.add_done_callback(lambda _: self._reloading.pop(key, None))
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _log_reload_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error('Reloading model failed: %r', task.exception())
+
+    async def watch(self, interval: float = 10.0):
+        """Reload loaded models whose decoder config has been modified."""
+        while True:
+            await asyncio.sleep(interval)
+            for (key, mtime) in list(self._mtimes.items()):
+                try:
+                    modified = self.config_path(key).stat().st_mtime != mtime
+                except OSError:
+                    continue
+                if modified and key not in self._reloading:
+                    task = asyncio.ensure_future(self.reload(key))
+                    task.add_done_callback(self._log_reload_failure)
+
+    def start_watching(self, interval: float = 10.0):
+        self._watcher = asyncio.ensure_future(self.watch(interval))
+
+    @asynccontextmanager
+    async def use(self, key: ModelKey):
+        """Use the server for `key`, protecting it from being unloaded."""
+        server = await self.get(key)
+        self._active[server] = self._active.get(server, 0) + 1
+        try:
+            yield server
+        finally:
+            n_active = self._active.get(server, 0) - 1
+            if n_active > 0:
+                self._active[server] = n_active
+            else:
+                self._active.pop(server, None)
+
+    def status(self):
+        loaded = {f'{key.name}/{key.source}-{key.target}': dict(
+                      profile=self.profile(key),
+                      ready=server.workers.ready,
+                      live=server.workers.live,
+                      workers=server.workers.status())
+                  for (key, server) in self._servers.items()}
+        loading = [f'{key.name}/{key.source}-{key.target}'
+                   for key in self._loading]
+        reloading = [f'{key.name}/{key.source}-{key.target}'
+                     for key in self._reloading]
+        return dict(loaded=loaded, loading=loading, reloading=reloading)
+
+    async def shutdown(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        tasks = list(self._loading.values()) + list(self._reloading.values())
+        for task in tasks:
+            task.cancel()
+        for (task, server) in list(self._draining.items()):
+            task.cancel()
+            await self._stop(server)
+        for key in list(self._servers):
+            await self._unload(key)
@@ -0,0 +1,150 @@
+"""Sentence splitting backends for text submitted for translation.
+
+Available backends:
+
+`spacy`
+    The `en_core_web_sm` dependency parser (slowest, the original
+    behaviour of the API).
+
+`sentencizer`
+    spaCy's rule-based sentencizer on a blank pipeline for the
+    language; no statistical model is loaded.
+
+`moses`
+    A port of the rules in Moses' `split-sentences.perl`, using the
+    non-breaking prefixes shipped with sacremoses.
+
+All backends split each line of the text separately, so that no
+sentence spans a line break.
+"""
+from typing import Callable, Dict, List
+import re
+
+from sacremoses.corpus import NonbreakingPrefixes
+import spacy
+
+
+SentenceSplitter = Callable[[str], List[str]]
+
+
+def lines(text: str) -> List[str]:
+    """The lines of `text` that are not blank."""
+    return [line for line in text.splitlines() if line.strip()]
+
+
+class SpacySplitter:
+
+    # Components of `en_core_web_sm` that do not affect sentence boundaries.
+    exclude = ('tagger', 'attribute_ruler', 'lemmatizer', 'ner')
+
+    # Pipelines by model name, shared by the splitters of all languages.
+    _pipelines = {}
+
+    def __init__(self, lang: str, model: str = 'en_core_web_sm'):
+        self.nlp = self._pipelines.get(model)
+        if self.nlp is None:
+            self.nlp = spacy.load(model, exclude=list(self.exclude))
+            self.nlp.add_pipe('sentencizer')
+            self._pipelines[model] = self.nlp
+
+    def __call__(self, text: str) -> List[str]:
+        return [sent.text
+                for doc in self.nlp.pipe(lines(text))
+                for sent in doc.sents]
+
+
+class SentencizerSplitter(SpacySplitter):
+
+    def __init__(self, lang: str):
+        try:
+            self.nlp = spacy.blank(lang)
+        except ImportError:
+            self.nlp = spacy.blank('xx')
+        self.nlp.add_pipe('sentencizer')
+
+
+class MosesSplitter:
+
+    _ends_with_period = re.compile(r'^([\w.\-]*)([\'")\]%»”’]*)(\.+)$')
+    _ends_with_other = re.compile(r'[?!]+[\'")\]»”’]*$')
+    _acronym = re.compile(r'\.[^\W\d_]+\.+$')
+    _sentence_start = re.compile(r'^[\'"(\[¿¡«“‘]*[^\W_]')
+
+    def __init__(self, lang: str):
+        self.prefixes = {}
+        if lang in NonbreakingPrefixes().available_langs:
+            for line in NonbreakingPrefixes().words(lang):
+                (prefix, _, kind) = line.partition(' ')
+                self.prefixes[prefix] = 2 if 'NUMERIC_ONLY' in kind else 1
+
+    def _starts_sentence(self, word: str) -> bool:
+        match = self._sentence_start.match(word)
+        return match is not None and (match.group()[-1].isupper()
+                                      or match.group()[-1].isdigit())
+
+    def _is_boundary(self, word: str, next_word: str) -> bool:
+        if not self._starts_sentence(next_word):
+            return False
+        if self._ends_with_other.search(word):
+            return True
+        match = self._ends_with_period.match(word)
+        if match is None:
+            return False
+        (prefix, closing_punct, _) = match.groups()
+        kind = self.prefixes.get(prefix) if not closing_punct else None
+        if kind == 1:
+            return False
+        if self._acronym.search(word):
+            return False
+        if kind == 2 and next_word[0].isdigit():
+            return False
+        return True
+
+    def __call__(self, text: str) -> List[str]:
+        sentences = []
+        for line in lines(text):
+            words = line.split()
+            current = []
+            for (i, word) in enumerate(words):
+                current.append(word)
+                next_word = words[i + 1] if i + 1 < len(words) else None
+                if next_word is None or self._is_boundary(word, next_word):
+                    sentences.append(' '.join(current))
+                    current = []
+        return sentences
+
+
+splitters = dict(spacy=SpacySplitter,
+                 sentencizer=SentencizerSplitter,
+                 moses=MosesSplitter)
+"""Sentence splitter backends by name."""
+
+
+def get_splitter(name: str, lang: str) -> SentenceSplitter:
+    """Create a sentence splitter using backend `name` for `lang`."""
+    try:
+        splitter_cls = splitters[name]
+    except KeyError:
+        raise ValueError(f'Unknown sentence splitter: {name}',
+                         tuple(splitters))
+    return splitter_cls(lang)
+
+
+class SentenceSplitters:
+    """Sentence splitters per language, created on first use.
+
+    `backends` maps a language code to a backend name; languages not
+    listed use `default`.
+    """
+
+    def __init__(self, default: str = 'spacy', backends: Dict = None):
+        self.default = default
+        self.backends = dict(backends or {})
+        self._splitters = {}
+
+    def __getitem__(self, lang: str) -> SentenceSplitter:
+        splitter = self._splitters.get(lang)
+        if splitter is None:
+            name = self.backends.get(lang, self.default)
+            splitter = self._splitters[lang] = get_splitter(name, lang)
+        return splitter
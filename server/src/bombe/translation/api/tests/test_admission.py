@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from bombe.translation.api.admission import (AdmissionQueue,
+                                             Overloaded,
+                                             RateLimiter,
+                                             TooManyRequests)
+
+
+def test_rate_limiter_allows_bursts_per_client():
+    limiter = RateLimiter(rate=1, burst=2)
+    limiter.check('a')
+    limiter.check('a')
+    with pytest.raises(TooManyRequests) as exc_info:
+        limiter.check('a')
+    assert exc_info.value.retry_after == 1
+    limiter.check('b')
+
+
+def test_admission_queue_rejects_when_full():
+    queue = AdmissionQueue(max_active=1, max_waiting=1)
+    release = asyncio.Event()
+
+    async def work():
+        async with queue.admit():
+            await release.wait()
+
+    async def main():
+        first = asyncio.ensure_future(work())
+        second = asyncio.ensure_future(work())
+        await asyncio.sleep(0.01)
+        assert (queue.active, queue.waiting) == (1, 1)
+        with pytest.raises(Overloaded):
+            async with queue.admit():
+                pass
+        release.set()
+        await asyncio.gather(first, second)
+        assert (queue.active, queue.waiting) == (0, 0)
+
+    asyncio.run(main())
@@ -1,25 +1,280 @@
+"""Tests of the API, translating with stub marian-server processes.
+
+The stub (benchmarks/stub_marian_server.py) returns its input, so the
+translation of a text is the text after normalization and
+SentencePiece encoding and decoding.
+"""
+from pathlib import Path
+import asyncio
+import importlib
+import json
+import uuid
+import os
+import socket
+import sys
+import time
+
 from starlette.testclient import TestClient
-from bombe.translation.api import app
+import pytest
+
+
+BENCHMARKS_DIR = Path(__file__).parents[5] / 'benchmarks'
+
+TEXTS = ['I have a headache.',
+         'The doctor said I was fine, but ensure to rest.',
+         'Please take two tablets every four hours.']
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    sys.path.insert(0, str(BENCHMARKS_DIR))
+    try:
+        import stub_marian_server as stub
+    finally:
+        sys.path.remove(str(BENCHMARKS_DIR))
+    tmp_path = tmp_path_factory.mktemp('api')
+    bin_dir = stub.write_marian_shim(tmp_path / 'bin').parent
+    stub.write_stub_model(tmp_path / 'models', TEXTS * 50)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+        mp.setenv('MODELS_DIR', str(tmp_path / 'models'))
+        mp.setenv('MARIAN_MODEL_NAME', 'stub')
+        mp.setenv('MARIAN_WS_PORT', str(_free_port()))
+        mp.setenv('SOURCE_LANGUAGE', 'en')
+        mp.setenv('TARGET_LANGUAGE', 'cy')
+        mp.setenv('SENTENCE_SPLITTER', 'moses')
+        mp.setenv('TRANSLATION_CACHE_DB', '')
+        mp.setenv('JOBS_DIR', str(tmp_path / 'jobs'))
+        from bombe.translation.api import config
+        config.get_settings.cache_clear()
+        views = importlib.import_module('bombe.translation.api.views')
+        with TestClient(views.app) as test_client:
+            deadline = time.monotonic() + 30
+            while test_client.get('/api/health').status_code != 200:
+                assert time.monotonic() < deadline, 'stub never ready'
+                time.sleep(0.1)
+            yield test_client
+        config.get_settings.cache_clear()
+
+
+def test_docs(client):
+    response = client.get('/api/docs')
+    assert response.status_code == 200
+
+
+def test_translate(client):
+    request_data = dict(text=' '.join(TEXTS[:2]),
+                        source_language='en',
+                        target_language='cy')
+    response = client.post('/api/translate', json=request_data)
+    assert response.status_code == 200
+    translated = response.json()
+    assert translated['translated'] == (
+        'I have a headache  '
+        'The doctor said I was fine, but ensure to rest')
+    assert translated['source_sentences'] == '\n'.join(TEXTS[:2])
+    assert (translated['source_lang'], translated['target_lang']) == (
+        'en', 'cy')
+    assert 'raw' not in translated
+
+
+def test_translate_batch(client):
+    items = [dict(id=str(i), text=text) for (i, text) in enumerate(TEXTS)]
+    response = client.post('/api/translate/batch', json=dict(items=items))
+    assert response.status_code == 200
+    assert [item['translated'] for item in response.json()['items']] == [
+        text.rstrip('.') for text in TEXTS]
+
+
+def test_batch_item_errors_are_not_exposed(client):
+    from bombe.translation.api import views
+    from bombe.translation.api.admission import RequestTooLarge
+    from bombe.translation.api.batching import BatchError
+    from bombe.translation.api.workers import NoWorkerAvailable
+    assert views.item_error(RequestTooLarge('At most 2 sentences')) == (
+        'At most 2 sentences')
+    for err in (NoWorkerAvailable('worker 8080 exited'),
+                BatchError('Expected one translation per sentence', 3, 2),
+                ValueError('ws://127.0.0.1:8080')):
+        message = views.item_error(err)
+        assert '8080' not in message and '3' not in message
+
+
+def test_unknown_model(client):
+    response = client.post('/api/translate',
+                           json=dict(text=TEXTS[0], model='missing'))
+    assert response.status_code == 404
+
+
+def test_rate_limit_ignores_unknown_api_keys(client, monkeypatch):
+    from bombe.translation.api import admission, views
+    monkeypatch.setattr(views, 'rate_limiter',
+                        admission.RateLimiter(rate=0.001, burst=1))
+    monkeypatch.setattr(views, 'api_keys', frozenset({'known'}))
 
+    def post(api_key):
+        return client.post('/api/translate',
+                           json=dict(text=TEXTS[0]),
+                           headers={'X-API-Key': api_key})
 
-def test_docs_redirect():
-    client = TestClient(app)
-    response = client.get("/")
-    assert response.history[0].status_code == 302
+    assert post(uuid.uuid4().hex).status_code == 200
+    assert post(uuid.uuid4().hex).status_code == 429
+    assert post('known').status_code == 200
+    assert post('known').status_code == 429
+
+
+def test_translation_job(client):
+    document = '\n'.join(TEXTS) + '\n'
+    response = client.post('/api/jobs',
+                           files=dict(file=('dŵr.txt', document)))
+    assert response.status_code == 202
+    job_id = response.json()['id']
+    deadline = time.monotonic() + 30
+    while client.get(f'/api/jobs/{job_id}').json()['status'] != 'done':
+        assert time.monotonic() < deadline, 'job never finished'
+        time.sleep(0.1)
+    response = client.get(f'/api/jobs/{job_id}/result')
     assert response.status_code == 200
-    assert response.url == "http://testserver/docs"
+    assert response.text == ''.join(text.rstrip('.') + '\n'
+                                    for text in TEXTS)
+    assert response.headers['Content-Disposition'] == (
+        'attachment; filename="dwr.cy.txt"; '
+        "filename*=UTF-8''d%C5%B5r.cy.txt")
 
 
-def test_api():
-    client = TestClient(app)
+def test_translate_compact_with_alignment(client):
+    text = ' '.join(TEXTS[:2])
+    response = client.post('/api/translate',
+                           json=dict(text=text, compact=True, alignment=True))
+    assert response.status_code == 200
+    translated = response.json()
+    assert set(translated) == {'translated', 'alignment'}
+    for (src_start, src_end, trg_start, trg_end) in translated['alignment']:
+        assert (text[src_start:src_end].rstrip('.')
+                == translated['translated'][trg_start:trg_end])
 
-    text = """The doctor said I was fine, but ensure to rest."""
 
-    request_data = dict(text=text, language='en')
-    response = client.post("/translate", json=request_data)
+def test_stream_with_too_many_sentences_is_rejected(client, monkeypatch):
+    from bombe.translation.api import views
+    for marian_server in views.registry._servers.values():
+        monkeypatch.setattr(marian_server, 'max_sentences', 2)
+    response = client.post('/api/translate/stream',
+                           json=dict(text=' '.join(TEXTS)))
+    assert response.status_code == 413
+
+
+def _stream(client, text):
+    response = client.post('/api/translate/stream', json=dict(text=text))
     assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_stream_yields_sentences_in_order_within_window(client, monkeypatch):
+    from bombe.translation.api import views
+    in_flight = most_in_flight = n_calls = 0
+
+    def counted(translate_sentences):
+        async def translate(sentences, *args):
+            nonlocal in_flight, most_in_flight, n_calls
+            n_calls += 1
+            in_flight += 1
+            most_in_flight = max(most_in_flight, in_flight)
+            try:
+                # Every other sentence is translated sooner than the
+                # one before it.
+                await asyncio.sleep(0.02 * (n_calls % 2))
+                return await translate_sentences(sentences, *args)
+            finally:
+                in_flight -= 1
+        return translate
+
+    monkeypatch.setattr(views.settings, 'api_stream_window', 2)
+    for marian_server in views.registry._servers.values():
+        monkeypatch.setattr(marian_server, 'translate_sentences',
+                            counted(marian_server.translate_sentences))
+    records = _stream(client, ' '.join(TEXTS * 2))
+    assert [record['index'] for record in records[:-1]] == list(range(6))
+    assert [record['source'] for record in records[:-1]] == TEXTS * 2
+    assert [record['translated'] for record in records[:-1]] == [
+        text.rstrip('.') for text in TEXTS * 2]
+    assert records[-1]['done'] and records[-1]['n_sentences'] == 6
+    assert most_in_flight == 2
+
+
+def test_stream_ends_with_an_error_record(client, monkeypatch):
+    from bombe.translation.api import views
+    from bombe.translation.api.batching import BatchError
+
+    def failing(translate_sentences):
+        n_calls = 0
 
+        async def translate(sentences, *args):
+            nonlocal n_calls
+            n_calls += 1
+            if n_calls == 2:
+                raise BatchError('Expected one translation per sentence',
+                                 3, 2)
+            return await translate_sentences(sentences, *args)
+        return translate
+
+    monkeypatch.setattr(views.settings, 'api_stream_window', 1)
+    for marian_server in views.registry._servers.values():
+        monkeypatch.setattr(marian_server, 'translate_sentences',
+                            failing(marian_server.translate_sentences))
+    records = _stream(client, ' '.join(TEXTS))
+    assert records == [
+        dict(index=0, source=TEXTS[0], translated=TEXTS[0].rstrip('.')),
+        dict(error='Translation failed, please try again.')]
+
+
+def test_line_breaks_end_sentences(client):
+    response = client.post('/api/translate',
+                           json=dict(text='Side effects\nTake two tablets'))
+    assert response.status_code == 200
     translated = response.json()
-    assert translated['text'] == ("Dweddodd y doctor fod fi'n iawn, "
-                                  'ond i sicrahau i ymlacio.')
-    assert translated['language'] == 'cy'
+    assert translated['source_sentences'] == 'Side effects\nTake two tablets'
+    assert translated['translated'] == 'Side effects\nTake two tablets'
+
+
+def test_failed_upload_deletes_the_job(client, monkeypatch):
+    from bombe.translation.api import views
+    created = []
+
+    def create(*args):
+        job = create_job(*args)
+        created.append(job)
+        return job
+
+    def document_path(job):
+        # Not writable, as a full disk would be.
+        return views.jobs.jobs_dir
+
+    create_job = views.jobs.create
+    monkeypatch.setattr(views.jobs, 'create', create)
+    monkeypatch.setattr(views.settings, 'jobs_max_file_mb', 0)
+    response = client.post('/api/jobs',
+                           files=dict(file=('too-large.txt', TEXTS[0])))
+    assert response.status_code == 413
+    monkeypatch.setattr(views.settings, 'jobs_max_file_mb', 1)
+    monkeypatch.setattr(views.jobs, 'document_path', document_path)
+    with pytest.raises(OSError):
+        client.post('/api/jobs', files=dict(file=('dŵr.txt', TEXTS[0])))
+    assert len(created) == 2
+    for job in created:
+        assert client.get(f'/api/jobs/{job["id"]}').status_code == 404
+        assert not (views.jobs.jobs_dir / job['id']).exists()
+
+
+def test_models(client):
+    response = client.get('/api/models')
+    assert response.status_code == 200
+    models = response.json()
+    assert models['available'] == [
+        dict(name='stub', source='en', target='cy')]
+    assert list(models['loaded']) == ['stub/en-cy']
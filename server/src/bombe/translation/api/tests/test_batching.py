@@ -0,0 +1,109 @@
+import asyncio
+
+from bombe.translation.api.batching import BatchError, BatchScheduler
+from bombe.translation.api.controllers import reply_lines
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_requests_share_one_batch():
+    sent = []
+
+    async def send(lines):
+        sent.append(lines)
+        return [line.upper() for line in lines]
+
+    async def main():
+        batcher = BatchScheduler(send, max_delay=0.01)
+        return await asyncio.gather(batcher.translate(['a', 'b']),
+                                    batcher.translate(['c']),
+                                    batcher.translate(['d', 'e', 'f']))
+
+    results = _run(main())
+    assert results == [['A', 'B'], ['C'], ['D', 'E', 'F']]
+    assert sent == [['a', 'b', 'c', 'd', 'e', 'f']]
+
+
+def test_token_budget_flushes_early():
+    sent = []
+
+    async def send(lines):
+        sent.append(lines)
+        return lines
+
+    async def main():
+        batcher = BatchScheduler(send, max_delay=0.05, max_tokens=3)
+        return await asyncio.gather(batcher.translate(['▁a ▁b']),
+                                    batcher.translate(['▁c ▁d']),
+                                    batcher.translate(['▁e']))
+
+    results = _run(asyncio.wait_for(main(), timeout=5))
+    assert results == [['▁a ▁b'], ['▁c ▁d'], ['▁e']]
+    assert sent == [['▁a ▁b', '▁c ▁d'], ['▁e']]
+
+
+def test_line_count_mismatch_fails_every_caller():
+
+    async def send(lines):
+        return lines[:-1]
+
+    async def main():
+        batcher = BatchScheduler(send, max_delay=0.01)
+        return await asyncio.gather(batcher.translate(['a']),
+                                    batcher.translate(['b']),
+                                    return_exceptions=True)
+
+    results = _run(main())
+    assert all(isinstance(result, BatchError) for result in results)
+
+
+def test_empty_sentences_are_not_sent():
+    sent = []
+
+    async def send(lines):
+        sent.append(lines)
+        return [line.upper() for line in lines]
+
+    async def main():
+        batcher = BatchScheduler(send, max_delay=0.01)
+        return await asyncio.gather(batcher.translate(['b']),
+                                    batcher.translate(['a', '']),
+                                    batcher.translate(['']))
+
+    results = _run(main())
+    assert results == [['B'], ['A', ''], ['']]
+    assert sent == [['b', 'a']]
+
+
+def test_reply_keeps_a_last_empty_translation():
+    assert reply_lines('A\n', 2) == ['A', '']
+    assert reply_lines('A\nB\n', 2) == ['A', 'B']
+    assert reply_lines('', 1) == ['']
+
+
+def test_length_buckets_restore_order():
+    sent = []
+
+    async def send(lines):
+        sent.append(lines)
+        return [line.upper() for line in lines]
+
+    async def main():
+        batcher = BatchScheduler(send, max_delay=0.01, bucket_width=4)
+        return await asyncio.gather(
+            batcher.translate(['▁a ▁b ▁c ▁d ▁e', '▁f']),
+            batcher.translate(['▁g ▁h', '▁i ▁j ▁k ▁l ▁m ▁n']))
+
+    results = _run(main())
+    assert results == [['▁A ▁B ▁C ▁D ▁E', '▁F'],
+                       ['▁G ▁H', '▁I ▁J ▁K ▁L ▁M ▁N']]
+    assert sorted(sent) == [['▁a ▁b ▁c ▁d ▁e', '▁i ▁j ▁k ▁l ▁m ▁n'],
+                            ['▁f', '▁g ▁h']]
+
+
+def test_sub_batch_token_cap():
+    batcher = BatchScheduler(None, sub_batch_max_tokens=4)
+    lines = ['▁a ▁b', '▁c', '▁d ▁e', '▁f ▁g ▁h']
+    assert batcher.sub_batches(lines) == [[1, 0], [2], [3]]
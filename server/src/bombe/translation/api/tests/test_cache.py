@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+from bombe.translation.api.cache import SQLiteStore, TranslationCache
+
+
+def test_lru_eviction_and_counters():
+    cache = TranslationCache(max_size=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A'
+    cache.set('c', 'C')
+    assert cache.get_many(['a', 'b', 'c']) == ['A', None, 'C']
+    assert cache.stats() == dict(size=2, max_size=2, hits=3, misses=1)
+
+
+def test_entries_expire_after_ttl():
+    cache = TranslationCache(ttl=0.01)
+    cache.set('a', 'A')
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_store_is_read_and_written_off_the_event_loop(tmp_path):
+    key = ('model', 'en', 'cy', 'hello')
+    cache = TranslationCache(store=SQLiteStore(tmp_path / 'cache.sqlite3'))
+    cache.set_many([(key, 'helo'), (key[:3] + ('bye',), 'hwyl')])
+    cache.flush()
+    cache.set(key, 'shwmae')
+    cache.close()
+    assert cache.stats()['store_size'] == 2
+    cache = TranslationCache(store=SQLiteStore(tmp_path / 'cache.sqlite3'))
+    assert asyncio.run(cache.lookup([key, key[:3] + ('hi',)])) == [
+        'shwmae', None]
+    assert cache.stats() == dict(size=1, max_size=10000, hits=1, misses=1,
+                                 store_size=2)
+    cache.close()
@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+import asyncio
+import threading
+import time
+
+import pytest
+import websockets
+
+from bombe.translation.api.connections import (ConnectionPool, PoolTimeout,
+                                               connection_errors)
+
+
+@contextmanager
+def ws_server(handler):
+    """Serve `handler` on a free port, in a thread; yields the address."""
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    stop = None
+    address = None
+
+    async def serve():
+        nonlocal stop, address
+        stop = asyncio.Event()
+        async with websockets.serve(handler, '127.0.0.1', 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            address = f'ws://127.0.0.1:{port}/translate'
+            started.set()
+            await stop.wait()
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(serve(),))
+    thread.start()
+    started.wait(5)
+    try:
+        yield address
+    finally:
+        loop.call_soon_threadsafe(stop.set)
+        thread.join(5)
+        loop.close()
+
+
+def test_waiting_for_a_connection_times_out():
+
+    async def slow_echo(ws, *args):
+        async for message in ws:
+            await asyncio.sleep(0.5)
+            await ws.send(message)
+
+    with ws_server(slow_echo) as address:
+        pool = ConnectionPool(address, size=1, wait_timeout=0.1)
+
+        async def main():
+            return await asyncio.gather(
+                *(pool.asend_recv(str(i)) for i in range(3)),
+                return_exceptions=True)
+
+        started = time.monotonic()
+        try:
+            results = asyncio.run(main())
+        finally:
+            pool.close()
+        elapsed = time.monotonic() - started
+    assert results[0] == '0'
+    assert all(isinstance(result, PoolTimeout) for result in results[1:])
+    assert elapsed < 1
+
+
+
+def test_connection_released_after_close_is_closed():
+
+    async def echo(ws, *args):
+        async for message in ws:
+            await ws.send(message)
+
+    with ws_server(echo) as address:
+        pool = ConnectionPool(address, size=2)
+        with pool.connection() as in_use:
+            with pool.connection() as idle:
+                pass
+            pool.close()
+            assert in_use.connected
+        assert not idle.connected
+        assert not in_use.connected
+        assert pool._idle.empty()
+
+
+def test_closed_connection_is_replaced_and_message_sent_once_more():
+    received = []
+
+    async def drop_second_message(ws, *args):
+        n_connection = len(received)
+        received.append([])
+        async for message in ws:
+            received[n_connection].append(message)
+            if n_connection == 0 and len(received[0]) == 2:
+                await ws.close()
+                return
+            await ws.send(message.upper())
+
+    with ws_server(drop_second_message) as address:
+        pool = ConnectionPool(address, size=1)
+        try:
+            assert pool.send_recv('a') == 'A'
+            assert pool.send_recv('b') == 'B'
+        finally:
+            pool.close()
+    assert received == [['a', 'b'], ['b']]
+
+
+def test_message_is_retried_only_once():
+    received = []
+
+    async def drop_every_message(ws, *args):
+        async for message in ws:
+            received.append(message)
+            await ws.close()
+
+    with ws_server(drop_every_message) as address:
+        pool = ConnectionPool(address, size=1)
+        try:
+            with pytest.raises(connection_errors):
+                pool.send_recv('a')
+        finally:
+            pool.close()
+    assert received == ['a', 'a']
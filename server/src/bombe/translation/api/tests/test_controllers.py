@@ -0,0 +1,37 @@
+import sentencepiece
+
+from bombe.translation.api.controllers import (spm_decode_sentences,
+                                               spm_encode_sentence,
+                                               spm_encode_sentences)
+
+
+TEXTS = ['I have a headache.',
+         '',
+         '  The doctor said I was fine, but ensure to rest...  ',
+         'Dŵr, plîs.',
+         '.']
+
+
+def _spm(tmp_path):
+    sentencepiece.SentencePieceTrainer.train(
+        sentence_iterator=iter(TEXTS * 20),
+        model_prefix=str(tmp_path / 'vocab'),
+        vocab_size=60,
+        hard_vocab_limit=False,
+        minloglevel=2)
+    return sentencepiece.SentencePieceProcessor(str(tmp_path / 'vocab.model'))
+
+
+def test_batched_spm_matches_each_sentence(tmp_path):
+    spm = _spm(tmp_path)
+    encoded = [spm_encode_sentence(spm, text) for text in TEXTS]
+    assert spm_encode_sentences(spm, TEXTS) == encoded
+    assert spm_encode_sentences(spm, TEXTS, num_threads=2) == encoded
+    assert encoded[1] == encoded[4] == ''
+    # Translations were decoded one at a time with `spm.decode`.
+    translated = encoded + ['Mae gen i gur pen', '▁Dŵr', '']
+    decoded = [spm.decode(sent) for sent in translated]
+    assert spm_decode_sentences(spm, translated) == decoded
+    assert spm_decode_sentences(spm, translated, num_threads=2) == decoded
+    assert spm_encode_sentences(spm, []) == []
+    assert spm_decode_sentences(spm, []) == []
@@ -0,0 +1,120 @@
+import asyncio
+
+from bombe.translation.api.jobs import JobManager
+
+
+async def _submit(manager, text):
+    job = manager.create('doc.txt', 'test', 'en', 'cy')
+    manager.document_path(job).write_text(text, encoding='utf-8')
+    await manager.submit(job)
+    return job
+
+
+async def _wait_until_finished(manager, job):
+    while manager.get(job['id'])['status'] not in ('done', 'failed'):
+        await asyncio.sleep(0.01)
+    return manager.get(job['id'])
+
+
+def test_job_translates_document_in_batches(tmp_path):
+    batches = []
+
+    async def translate(job, texts):
+        batches.append(texts)
+        return [text.upper() for text in texts]
+
+    async def main():
+        manager = JobManager(tmp_path, translate, batch_size=2,
+                             poll_interval=0.01)
+        manager.start()
+        job = await _submit(manager, 'one\ntwo\n\nthree\n')
+        job = await _wait_until_finished(manager, job)
+        result = ''.join(manager.iter_result(job))
+        await manager.shutdown()
+        return (job, result)
+
+    (job, result) = asyncio.run(main())
+    assert (job['status'], job['n_segments'], job['n_done']) == ('done', 4, 4)
+    assert result == 'ONE\nTWO\n\nTHREE\n'
+    assert batches == [['one', 'two'], ['three']]
+
+
+def test_job_with_a_batch_of_blank_lines_is_done(tmp_path):
+
+    async def translate(job, texts):
+        return texts
+
+    async def main():
+        manager = JobManager(tmp_path, translate, batch_size=2,
+                             max_attempts=1, poll_interval=0.01)
+        manager.start()
+        job = await _submit(manager, 'hello\nworld\n\n\n')
+        job = await _wait_until_finished(manager, job)
+        result = ''.join(manager.iter_result(job))
+        await manager.shutdown()
+        return (job, result)
+
+    (job, result) = asyncio.run(main())
+    assert (job['status'], job['n_done']) == ('done', 4)
+    assert result == 'hello\nworld\n\n\n'
+
+
+def test_interrupted_job_resumes_after_restart(tmp_path):
+    seen = []
+
+    async def translate(job, texts):
+        seen.extend(texts)
+        if texts == ['c']:
+            raise asyncio.CancelledError()
+        return texts
+
+    async def fail_midway():
+        manager = JobManager(tmp_path, translate, batch_size=2,
+                             poll_interval=0.01)
+        job = await _submit(manager, 'a\nb\nc\n')
+        try:
+            await manager.run(manager.store.claim_next())
+        except asyncio.CancelledError:
+            pass
+        manager.store.close()
+        return job
+
+    job = asyncio.run(fail_midway())
+    seen.clear()
+
+    async def resume(job, texts):
+        seen.extend(texts)
+        return texts
+
+    async def main():
+        manager = JobManager(tmp_path, resume, poll_interval=0.01)
+        manager.start()
+        job_ = await _wait_until_finished(manager, job)
+        result = ''.join(manager.iter_result(job_))
+        await manager.shutdown()
+        return result
+
+    assert asyncio.run(main()) == 'a\nb\nc\n'
+    assert seen == ['c']
+
+
+def test_failed_batches_are_retried(tmp_path):
+    attempts = []
+
+    async def translate(job, texts):
+        attempts.append(texts)
+        err = ConnectionError('marian-server is down')
+        return [err] * len(texts)
+
+    async def main():
+        manager = JobManager(tmp_path, translate, max_attempts=2,
+                             retry_delay=0.01, poll_interval=0.01)
+        manager.start()
+        job = await _wait_until_finished(manager,
+                                         await _submit(manager, 'a\n'))
+        await manager.shutdown()
+        return job
+
+    job = asyncio.run(main())
+    assert job['status'] == 'failed'
+    assert len(attempts) == 2
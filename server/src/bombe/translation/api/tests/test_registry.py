@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+import srsly
+
+from bombe.translation.api import profiles
+from bombe.translation.api.registry import (ModelKey,
+                                            ModelRegistry,
+                                            TooManyModels,
+                                            UnknownModel)
+
+
+class FakeWorkers:
+    ready = True
+    live = True
+
+    def status(self):
+        return []
+
+    async def wait_until_ready(self):
+        pass
+
+
+class FakeServer:
+
+    def __init__(self, config_path, ws_port):
+        self.config_path = config_path
+        self.ws_port = ws_port
+        self.workers = FakeWorkers()
+        self.stopped = False
+
+    async def start(self, warmup_text=None, warmup_lang=None):
+        pass
+
+    async def shutdown(self):
+        self.stopped = True
+
+
+def _registry(tmp_path, directions=('en-cy',), **kwargs):
+    for direction in directions:
+        model_dir = tmp_path / 'test' / direction
+        model_dir.mkdir(parents=True)
+        (model_dir / 'model.npz.decoder.yml').write_text('vocabs: [v.spm]\n')
+    return ModelRegistry(tmp_path, FakeServer, 9000, **kwargs)
+
+
+def test_reload_drains_in_flight_requests(tmp_path):
+    key = ModelKey('test', 'en', 'cy')
+    registry = _registry(tmp_path)
+
+    async def main():
+        async with registry.use(key) as old_server:
+            new_server = await registry.reload(key)
+            assert new_server is not old_server
+            assert new_server.ws_port != old_server.ws_port
+            assert (await registry.get(key)) is new_server
+            assert not old_server.stopped
+        await asyncio.sleep(0.2)
+        return (old_server, new_server)
+
+    (old_server, new_server) = asyncio.run(main())
+    assert old_server.stopped
+    assert not new_server.stopped
+
+
+def test_reload_stops_old_server_after_drain_timeout(tmp_path):
+    key = ModelKey('test', 'en', 'cy')
+    registry = _registry(tmp_path, drain_timeout=0.1)
+
+    async def main():
+        async with registry.use(key) as old_server:
+            await registry.reload(key)
+            await asyncio.sleep(0.3)
+            assert old_server.stopped
+        # Ports of stopped servers are reused.
+        new_server = await registry.reload(key)
+        assert new_server.ws_port == old_server.ws_port
+
+    asyncio.run(main())
+
+
+def test_cpu_profile_config_is_generated_on_load(tmp_path, monkeypatch):
+    key = ModelKey('test', 'en', 'cy')
+    converted = []
+
+    def convert_model(model_path, dest_path, gemm_type='intgemm8'):
+        converted.append((model_path.name, dest_path.name, gemm_type))
+        return dest_path
+
+    monkeypatch.setattr(profiles, 'convert_model', convert_model)
+    registry = _registry(tmp_path,
+                         model_profiles={'test/en-cy': 'cpu'},
+                         cpu_options=dict(cpu_threads=2))
+    config_path = registry.config_path(key)
+    config_path.write_text('models: [model.npz]\nvocabs: [v.spm]\n'
+                           'devices: [0]\nbeam-size: 6\n')
+    server = asyncio.run(registry.get(key))
+    assert server.config_path == profiles.cpu_config_path(config_path)
+    config = srsly.read_yaml(server.config_path)
+    assert converted == [('model.npz', 'model.intgemm8.bin', 'intgemm8')]
+    assert config['models'] == [str(tmp_path / 'test' / 'en-cy' /
+                                    'model.intgemm8.bin')]
+    assert (config['cpu-threads'], config['beam-size']) == (2, 1)
+    assert 'devices' not in config and 'shortlist' not in config
+    assert registry.status()['loaded']['test/en-cy']['profile'] == 'cpu'
+
+
+def test_only_available_models_are_loaded(tmp_path):
+    registry = _registry(tmp_path / 'models')
+    outside = tmp_path / 'outside' / 'en-cy'
+    outside.mkdir(parents=True)
+    (outside / 'model.npz.decoder.yml').write_text('vocabs: [v.spm]\n')
+    for key in (ModelKey('../outside', 'en', 'cy'),
+                ModelKey('test', 'en', 'cy/../../../outside/en-cy'),
+                ModelKey('test', 'cy', 'en')):
+        with pytest.raises(UnknownModel):
+            asyncio.run(registry.get(key))
+    assert registry.loaded == {}
+
+
+def test_least_recently_used_model_is_unloaded(tmp_path):
+    en_cy = ModelKey('test', 'en', 'cy')
+    cy_en = ModelKey('test', 'cy', 'en')
+    registry = _registry(tmp_path, ('en-cy', 'cy-en'), max_loaded=1)
+
+    async def main():
+        en_cy_server = await registry.get(en_cy)
+        await registry.get(cy_en)
+        assert en_cy_server.stopped
+        assert list(registry.loaded) == [cy_en]
+        async with registry.use(cy_en):
+            with pytest.raises(TooManyModels):
+                await registry.get(en_cy)
+        assert list(registry.loaded) == [cy_en]
+
+    asyncio.run(main())
+
+
+def test_cpu_profile_config_is_generated_again_with_other_options(
+        tmp_path, monkeypatch):
+    converted = []
+
+    def convert_model(model_path, dest_path, gemm_type='intgemm8'):
+        converted.append(gemm_type)
+        return dest_path
+
+    monkeypatch.setattr(profiles, 'convert_model', convert_model)
+    config_path = tmp_path / 'model.npz.decoder.yml'
+    config_path.write_text('models: [model.npz]\nvocabs: [v.spm]\n')
+    profiles.write_cpu_config(config_path, cpu_threads=2)
+    assert not profiles.is_stale(config_path, cpu_threads=2)
+    assert profiles.is_stale(config_path, cpu_threads=4)
+    assert profiles.is_stale(config_path,
+                             cpu_threads=2,
+                             gemm_type='intgemm16')
+    (tmp_path / profiles.SHORTLIST_FILENAME).touch()
+    assert profiles.is_stale(config_path, cpu_threads=2)
+    profiles.write_cpu_config(config_path, cpu_threads=2)
+    assert not profiles.is_stale(config_path, cpu_threads=2)
+    assert srsly.read_yaml(profiles.cpu_config_path(config_path))[
+        'shortlist'] == [str(tmp_path / profiles.SHORTLIST_FILENAME),
+                         50, 50, 0]
+    assert converted == ['intgemm8', 'intgemm8']
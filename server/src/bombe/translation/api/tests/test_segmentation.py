@@ -0,0 +1,49 @@
+import spacy
+
+from bombe.translation.api import segmentation
+from bombe.translation.api.segmentation import (MosesSplitter,
+                                                SentenceSplitters,
+                                                SentencizerSplitter,
+                                                SpacySplitter)
+
+
+def test_moses_keeps_abbreviations_in_sentences():
+    split = MosesSplitter('en')
+    assert split('Dr. Jones saw me at 9 a.m. today. I am fine.') == [
+        'Dr. Jones saw me at 9 a.m. today.',
+        'I am fine.']
+    assert split('See No. 5 for details. Then call.') == [
+        'See No. 5 for details.',
+        'Then call.']
+
+
+def test_moses_splits_at_line_breaks():
+    split = MosesSplitter('en')
+    assert split('Side effects\nTake two tablets. Rest\n\n  \nCall us') == [
+        'Side effects',
+        'Take two tablets.',
+        'Rest',
+        'Call us']
+
+
+def test_spacy_pipeline_is_loaded_once_per_model(monkeypatch):
+    loaded = []
+
+    def load(model, exclude=()):
+        loaded.append(model)
+        return spacy.blank('en')
+
+    monkeypatch.setattr(segmentation.spacy, 'load', load)
+    monkeypatch.setattr(SpacySplitter, '_pipelines', {})
+    (en, cy) = (SpacySplitter('en'), SpacySplitter('cy'))
+    assert en.nlp is cy.nlp
+    assert loaded == ['en_core_web_sm']
+    assert cy('Heading\nTake two tablets. Rest.') == [
+        'Heading', 'Take two tablets.', 'Rest.']
+
+
+def test_languages_not_listed_use_the_default_backend():
+    splitters = SentenceSplitters('sentencizer', {'cy': 'moses'})
+    assert isinstance(splitters['cy'], MosesSplitter)
+    assert isinstance(splitters['en'], SentencizerSplitter)
+    assert splitters['en'] is splitters['en']
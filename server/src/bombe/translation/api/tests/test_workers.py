@@ -0,0 +1,69 @@
+import asyncio
+import sys
+import time
+
+from bombe.translation.api.workers import MarianWorker, WorkerGroup
+
+
+class StubbornWorker(MarianWorker):
+    """Runs a process that ignores SIGTERM in place of marian-server."""
+
+    marian_server_cmd = (
+        f'{sys.executable} -c "import signal, time; '
+        f'signal.signal(signal.SIGTERM, signal.SIG_IGN); '
+        f'time.sleep(60)" {{config_path}} {{ws_port}}')
+
+
+def test_stop_kills_worker_without_blocking_the_event_loop(tmp_path):
+    worker = StubbornWorker(tmp_path / 'model.yml', 9999)
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        worker.start()
+        await asyncio.sleep(0.5)
+        ticker = asyncio.ensure_future(tick())
+        await worker.stop(timeout=0.3)
+        ticker.cancel()
+
+    asyncio.run(main())
+    assert not worker.is_alive()
+    assert worker.proc.returncode == -9
+    assert len(ticks) > 10
+
+
+
+class MissingWorker(MarianWorker):
+    """A worker whose marian-server exits, and cannot be started again."""
+
+    marian_server_cmd = f'{sys.executable} -c "" {{config_path}} {{ws_port}}'
+
+    n_starts = 0
+
+    def start(self):
+        self.n_starts += 1
+        if self.proc is not None:
+            raise FileNotFoundError('marian-server')
+        super().start()
+
+
+def test_supervisor_keeps_going_when_a_restart_fails(tmp_path):
+    group = WorkerGroup(tmp_path / 'model.yml', 9999)
+    group.workers = [MissingWorker(tmp_path / 'model.yml', 9999 + i)
+                     for i in range(2)]
+
+    async def main():
+        for worker in group.workers:
+            worker.start()
+            worker.proc.wait()
+        supervisor = asyncio.ensure_future(group.supervise(interval=0.01))
+        await asyncio.sleep(0.1)
+        assert not supervisor.done()
+        supervisor.cancel()
+
+    asyncio.run(main())
+    assert all(worker.n_starts > 2 for worker in group.workers)
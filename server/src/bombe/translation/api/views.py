@@ -3,22 +3,66 @@
 
 import os
 import importlib.resources as ir
-from pathlib import Path
-from typing import Dict
+from functools import partial
+from typing import Dict, Optional
+import asyncio
+import logging
+import secrets
+import time
 
 from dotenv import load_dotenv, find_dotenv
-from fastapi import FastAPI
+from fastapi import (Depends,
+                     FastAPI,
+                     File,
+                     Form,
+                     Header,
+                     HTTPException,
+                     Request,
+                     UploadFile)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (JSONResponse,
+                               ORJSONResponse,
+                               Response,
+                               StreamingResponse)
+import orjson
+import prometheus_client
 import srsly
 
-from . import data, config, controllers
-from .models import TranslationRequest
+from . import data, config, controllers, logs, metrics
+from .admission import (AdmissionQueue,
+                        Overloaded,
+                        RateLimiter,
+                        RequestTooLarge,
+                        TooManyRequests)
+from .batching import BatchError
+from .cache import SQLiteStore, TranslationCache
+from .connections import PoolTimeout
+from .jobs import (FINISHED,
+                   JobManager,
+                   JobNotFound,
+                   UnsupportedFormat,
+                   content_disposition)
+from .registry import ModelKey, ModelRegistry, TooManyModels, UnknownModel
+from .segmentation import SentenceSplitters
+from .workers import NoWorkerAvailable
+from .models import (BatchTranslationRequest,
+                     BatchTranslationResponse,
+                     Job,
+                     TranslationRequest,
+                     TranslationResponse)
 
 
+log = logging.getLogger(__name__)
+
 load_dotenv(find_dotenv())
 
 _allow_origins = config.get_allowed_origins()
 
+settings = config.get_settings()
+
+logs.configure(settings.log_level, settings.log_format)
+
 with ir.path(data, 'example_translation_request.json') as ex_path:
     with open(ex_path) as fp:
         example_translation_request = srsly.json_loads(fp.read())
@@ -29,14 +73,161 @@ target_lang = os.getenv('TARGET_LANGUAGE')
 
 model_name = os.getenv('MARIAN_MODEL_NAME')
 
-config_path = Path('/models',
-                   model_name,
-                   f'{source_lang}-{target_lang}',
-                   'model.npz.decoder.yml')
-
 ws_port = os.getenv('MARIAN_WS_PORT')
 
-marian_server = controllers.MarianServer(config_path, ws_port)
+default_model = ModelKey(model_name, source_lang, target_lang)
+
+_cache_store = None
+if settings.translation_cache_db:
+    _cache_store = SQLiteStore(settings.translation_cache_db,
+                               ttl=settings.translation_cache_ttl)
+
+translation_cache = TranslationCache(max_size=settings.translation_cache_size,
+                                     ttl=settings.translation_cache_ttl,
+                                     store=_cache_store)
+
+sentence_splitters = SentenceSplitters(settings.sentence_splitter,
+                                       settings.sentence_splitters)
+
+create_server = partial(
+    controllers.MarianServer,
+    n_workers=settings.marian_workers,
+    cpu_threads=settings.marian_cpu_threads,
+    pin_cpus=settings.marian_pin_cpus,
+    pool_size=settings.marian_ws_pool_size,
+    pool_wait_timeout=settings.marian_ws_pool_timeout,
+    startup_timeout=settings.marian_startup_timeout,
+    warmup_batches=settings.marian_warmup_batches,
+    batch_max_delay=settings.marian_batch_max_delay,
+    batch_max_tokens=settings.marian_batch_max_tokens,
+    bucket_width=settings.marian_bucket_width,
+    sub_batch_max_tokens=settings.marian_sub_batch_max_tokens,
+    spm_threads=settings.spm_threads,
+    max_sentences=settings.api_max_sentences,
+    cache=translation_cache,
+    splitters=sentence_splitters)
+
+registry = ModelRegistry(
+    settings.models_dir,
+    create_server,
+    ws_port,
+    ports_per_model=settings.marian_workers,
+    memory_budget=settings.models_memory_budget_mb * pow(1024, 2),
+    max_loaded=settings.models_max_loaded,
+    warmup_text=example_translation_request['translation']['text'],
+    drain_timeout=settings.models_drain_timeout,
+    default_profile=settings.models_profile,
+    model_profiles=settings.models_profiles,
+    cpu_options=dict(cpu_threads=settings.cpu_profile_threads,
+                     beam_size=settings.cpu_profile_beam_size,
+                     mini_batch=settings.cpu_profile_mini_batch,
+                     gemm_type=settings.cpu_profile_gemm_type,
+                     shortlist_size=settings.cpu_profile_shortlist_size))
+
+
+admission = AdmissionQueue(max_active=settings.api_max_active,
+                           max_waiting=settings.api_max_waiting)
+
+rate_limiter = RateLimiter(rate=settings.api_rate_limit,
+                           burst=settings.api_rate_burst)
+
+api_keys = frozenset(settings.api_keys)
+
+
+async def translate_job_texts(job, texts):
+    key = ModelKey(job['model'], job['source_lang'], job['target_lang'])
+    async with registry.use(key) as marian_server:
+        return await marian_server.translate_many(texts,
+                                                  key.source,
+                                                  key.target)
+
+
+jobs = None
+if settings.jobs_dir:
+    jobs = JobManager(settings.jobs_dir,
+                      translate_job_texts,
+                      n_workers=settings.jobs_workers,
+                      batch_size=settings.jobs_batch_size,
+                      max_attempts=settings.jobs_max_attempts,
+                      retry_delay=settings.jobs_retry_delay)
+
+
+def model_key(model: Optional[str],
+              src_lang: Optional[str],
+              trg_lang: Optional[str]) -> ModelKey:
+    return ModelKey(model or model_name,
+                    src_lang or source_lang,
+                    trg_lang or target_lang)
+
+
+async def rate_limit(request: Request):
+    """Charge the client making `request` against its rate limit.
+
+    Clients are identified by their X-API-Key if it is one of API_KEYS,
+    otherwise by their address.
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key in api_keys:
+        client = ('key', api_key)
+    else:
+        client = ('address', request.client.host if request.client else '-')
+    rate_limiter.check(client)
+
+
+def check_text_size(text: str):
+    if len(text) > settings.api_max_chars:
+        metrics.REJECTED_REQUESTS.labels('too_large').inc()
+        raise HTTPException(
+            status_code=413,
+            detail=f'At most {settings.api_max_chars} characters allowed')
+
+
+def item_error(err: Exception) -> str:
+    """Why an item of a batch (or a stream) was not translated, as told
+    to the client."""
+    if isinstance(err, RequestTooLarge):
+        return err.args[0]
+    if isinstance(err, (NoWorkerAvailable, PoolTimeout)):
+        return 'Translation is unavailable, please try again shortly.'
+    if isinstance(err, BatchError):
+        return 'Translation failed, please try again.'
+    return 'Translation failed.'
+
+
+def ndjson_line(record) -> bytes:
+    return orjson.dumps(record) + b'\n'
+
+
+def require_jobs():
+    if jobs is None:
+        raise HTTPException(status_code=404,
+                            detail='Document translation is disabled')
+
+
+def job_status(job):
+    return dict(id=job['id'],
+                status=job['status'],
+                filename=job['filename'],
+                model=job['model'],
+                source_language=job['source_lang'],
+                target_language=job['target_lang'],
+                n_segments=job['n_segments'],
+                n_done=job['n_done'],
+                n_errors=job['n_errors'],
+                error=job['error'],
+                created=job['created'],
+                updated=job['updated'])
+
+
+def require_admin(authorization: str = Header(default='')):
+    token = settings.api_admin_token
+    if not token:
+        raise HTTPException(status_code=403,
+                            detail='Admin endpoints are disabled')
+    if not secrets.compare_digest(authorization, f'Bearer {token}'):
+        raise HTTPException(status_code=401,
+                            detail='Invalid admin token',
+                            headers={'WWW-Authenticate': 'Bearer'})
 
 
 app = FastAPI(
@@ -54,25 +245,395 @@ app.add_middleware(
     allow_headers=['*'])
 
 
+metrics.QUEUE_DEPTH.set_function(
+    lambda: sum(server.batcher.queue_depth
+                for server in registry.loaded.values()))
+
+metrics.ACTIVE_REQUESTS.set_function(lambda: admission.active)
+
+metrics.WAITING_REQUESTS.set_function(lambda: admission.waiting)
+
+metrics.MARIAN_IN_FLIGHT.set_function(
+    lambda: sum(worker.in_flight
+                for server in registry.loaded.values()
+                for worker in server.workers.workers))
+
+
+@app.middleware('http')
+async def request_context(request: Request, call_next):
+    rid = logs.begin_request(request.headers.get('X-Request-ID'),
+                             sample_rate=settings.log_sample_rate)
+    response = await call_next(request)
+    response.headers['X-Request-ID'] = rid
+    return response
+
+
+@app.middleware('http')
+async def observe_requests(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get('route')
+        endpoint = getattr(route, 'path', 'unmatched')
+        metrics.REQUEST_SECONDS.labels(endpoint).observe(
+            time.perf_counter() - start)
+        if status >= 400:
+            metrics.REQUEST_ERRORS.labels(endpoint, status).inc()
+
+
+@app.exception_handler(NoWorkerAvailable)
+@app.exception_handler(PoolTimeout)
+async def marian_unavailable(request: Request, exc: Exception):
+    return JSONResponse(status_code=503,
+                        headers={'Retry-After': '5'},
+                        content=dict(detail='Translation is unavailable, '
+                                     'please try again shortly.'))
+
+
+@app.exception_handler(TooManyModels)
+async def too_many_models(request: Request, exc: TooManyModels):
+    return JSONResponse(status_code=503,
+                        headers={'Retry-After': '5'},
+                        content=dict(detail=exc.args[0]))
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+    metrics.REJECTED_REQUESTS.labels('overloaded').inc()
+    return JSONResponse(status_code=503,
+                        headers={'Retry-After': '1'},
+                        content=dict(detail=exc.args[0]))
+
+
+@app.exception_handler(TooManyRequests)
+async def too_many_requests(request: Request, exc: TooManyRequests):
+    metrics.REJECTED_REQUESTS.labels('rate_limited').inc()
+    return JSONResponse(status_code=429,
+                        headers={'Retry-After': str(exc.retry_after)},
+                        content=dict(detail=exc.args[0]))
+
+
+@app.exception_handler(RequestTooLarge)
+async def request_too_large(request: Request, exc: RequestTooLarge):
+    metrics.REJECTED_REQUESTS.labels('too_large').inc()
+    return JSONResponse(status_code=413, content=dict(detail=exc.args[0]))
+
+
+@app.exception_handler(JobNotFound)
+@app.exception_handler(UnknownModel)
+async def not_found(request: Request, exc: Exception):
+    return JSONResponse(status_code=404, content=dict(detail=exc.args[0]))
+
+
+@app.exception_handler(UnsupportedFormat)
+async def unsupported_format(request: Request, exc: UnsupportedFormat):
+    return JSONResponse(status_code=415, content=dict(detail=exc.args[0]))
+
+
 @app.on_event('startup')
 async def startup():
-    await marian_server.start()
+    # Load the default model in the background; /api/health reports
+    # when it is ready.
+    asyncio.ensure_future(registry.get(default_model))
+    if settings.models_watch_interval:
+        registry.start_watching(settings.models_watch_interval)
+    if jobs is not None:
+        jobs.start()
 
 
 @app.on_event('shutdown')
 async def shutdown():
-    await marian_server.shutdown()
+    if jobs is not None:
+        await jobs.shutdown()
+    await registry.shutdown()
+    await asyncio.get_running_loop().run_in_executor(None,
+                                                     translation_cache.close)
 
 
 @app.head('/api/translate', response_model=Dict[str, str])
 @app.get('/api/info', response_model=Dict[str, str])
 def info():
-    return marian_server.config
+    return controllers.read_config(registry.config_path(default_model))
+
+
+@app.get('/api/models')
+async def models():
+    """Models available to translate with, and those currently loaded."""
+    # The registry is read on the event loop, where it is changed; only
+    # the models directory is listed in a thread.
+    available = await run_in_threadpool(registry.available)
+    return dict(available=[key._asdict() for key in available],
+                **registry.status())
 
 
-@app.post('/api/translate', response_model=Dict[str, str])
+@app.post('/api/models/{name}/{direction}/reload',
+          dependencies=[Depends(require_admin)])
+async def reload_model(name: str, direction: str):
+    """Switch to the model currently on disk without dropping requests.
+
+    `direction` is `<source>-<target>`. Responds once the new model is
+    serving requests; the old one is stopped when its in-flight
+    requests have completed.
+    """
+    (src_lang, _, trg_lang) = direction.partition('-')
+    key = ModelKey(name, src_lang, trg_lang)
+    server = await registry.reload(key)
+    return dict(model=key._asdict(), model_id=server.model_id)
+
+
+@app.get('/api/health')
+async def health():
+    """Liveness and readiness of marian-server.
+
+    Responds with status 200 once at least one model has a
+    marian-server worker ready to translate, 503 before then.
+    """
+    status = registry.status()
+    loaded = status['loaded'].values()
+    ready = any(model['ready'] for model in loaded)
+    content = dict(status='ready' if ready else 'starting',
+                   live=any(model['live'] for model in loaded),
+                   ready=ready,
+                   models=status['loaded'],
+                   loading=status['loading'],
+                   queue=admission.status())
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+
+@app.get('/api/cache', response_model=Dict[str, int])
+def cache_stats():
+    """Sentence translation cache size and hit/miss counters."""
+    return translation_cache.stats()
+
+
+@app.get('/metrics', include_in_schema=False)
+def metrics_export():
+    return Response(prometheus_client.generate_latest(),
+                    media_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+@app.post('/api/translate',
+          response_model=TranslationResponse,
+          response_model_exclude_unset=True,
+          response_class=ORJSONResponse,
+          dependencies=[Depends(rate_limit)])
 async def translate(item: TranslationRequest):
-    """Translate sentences from source language to target language."""
-    src_lang = item.source_language or os.getenv('SOURCE_LANGUAGE')
-    trg_lang = item.target_language or os.getenv('TARGET_LANGUAGE')
-    return await marian_server.translate(item.text, src_lang, trg_lang)
+    """Translate sentences from source language to target language.
+
+    Set `compact` for a response with just the translation, and
+    `alignment` for the offsets of each sentence.
+    """
+    check_text_size(item.text)
+    key = model_key(item.model, item.source_language, item.target_language)
+    debug = item.debug or settings.api_debug
+    compact = item.compact
+    if compact is None:
+        compact = settings.api_compact_responses
+    async with admission.admit(), registry.use(key) as marian_server:
+        result = await marian_server.translate(item.text,
+                                               key.source,
+                                               key.target,
+                                               debug=debug,
+                                               compact=compact,
+                                               alignment=item.alignment)
+    # Returned as is, skipping validation against the response model.
+    return ORJSONResponse(result)
+
+
+@app.post('/api/translate/batch',
+          response_model=BatchTranslationResponse,
+          response_class=ORJSONResponse,
+          dependencies=[Depends(rate_limit)])
+async def translate_batch(batch: BatchTranslationRequest):
+    """Translate many texts in one request.
+
+    Items are returned in the order given, each with either its
+    translation or an error.
+    """
+    max_items = settings.api_batch_max_items
+    max_chars = settings.api_batch_max_chars
+    if len(batch.items) > max_items:
+        raise HTTPException(status_code=413,
+                            detail=f'At most {max_items} items allowed')
+    if sum(len(item.text) for item in batch.items) > max_chars:
+        raise HTTPException(status_code=413,
+                            detail=f'At most {max_chars} characters allowed')
+    key = model_key(batch.model,
+                    batch.source_language,
+                    batch.target_language)
+    async with admission.admit(), registry.use(key) as marian_server:
+        results = await marian_server.translate_many(
+            [item.text for item in batch.items],
+            key.source,
+            key.target)
+    items = []
+    for (item, result) in zip(batch.items, results):
+        if isinstance(result, Exception):
+            metrics.ITEM_ERRORS.inc()
+            log.warning('Failed to translate batch item %s: %r',
+                        item.id, result)
+            items.append(dict(id=item.id, error=item_error(result)))
+        else:
+            items.append(dict(id=item.id, translated=result))
+    return ORJSONResponse(dict(items=items,
+                               source_language=key.source,
+                               target_language=key.target))
+
+
+@app.post('/api/translate/stream', dependencies=[Depends(rate_limit)])
+async def translate_stream(item: TranslationRequest):
+    """Translate sentences, streaming each translation as it is ready.
+
+    The response is newline-delimited JSON: one record per sentence
+    (`index`, `source`, `translated`) followed by a summary record
+    with `done` set to true. If translation fails part way, the stream
+    ends with a record of the `error` instead.
+    """
+    check_text_size(item.text)
+    key = model_key(item.model, item.source_language, item.target_language)
+    # Load the model, split the text and check for capacity before the
+    # response starts, so that errors are reported with the appropriate
+    # status code.
+    sentences = (await registry.get(key)).split_sentences(item.text,
+                                                          key.source)
+    if admission.full:
+        raise Overloaded('Too many requests waiting to be translated')
+
+    async def ndjson():
+        try:
+            async with admission.admit(), registry.use(key) as marian_server:
+                records = marian_server.translate_stream(
+                    item.text,
+                    key.source,
+                    key.target,
+                    window=settings.api_stream_window,
+                    sentences=sentences)
+                async for record in records:
+                    yield ndjson_line(record)
+        except Exception as err:
+            # The response has started, so the status can no longer
+            # tell the client.
+            log.warning('Failed to stream translation: %r', err)
+            yield ndjson_line(dict(error=item_error(err)))
+
+    return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+
+
+@app.post('/api/jobs',
+          status_code=202,
+          response_model=Job,
+          dependencies=[Depends(require_jobs), Depends(rate_limit)])
+async def submit_job(file: UploadFile = File(...),
+                     source_language: Optional[str] = Form(default=None),
+                     target_language: Optional[str] = Form(default=None),
+                     model: Optional[str] = Form(default=None)):
+    """Submit a document to be translated in the background.
+
+    Plain text (`.txt`) is translated line by line; for TMX, CSV and
+    TSV files, the source language side of each pair is translated.
+    Poll the job returned, or follow `/api/jobs/{job_id}/progress`,
+    then download the translation from `/api/jobs/{job_id}/result`.
+    """
+    key = model_key(model, source_language, target_language)
+    if not registry.is_available(key):
+        raise UnknownModel(f'No model {key.name} for '
+                           f'{key.source}-{key.target}')
+    job = await run_in_threadpool(jobs.create,
+                                  file.filename or '',
+                                  key.name,
+                                  key.source,
+                                  key.target)
+    max_bytes = settings.jobs_max_file_mb * pow(1024, 2)
+    n_bytes = 0
+    try:
+        fp = await run_in_threadpool(open, jobs.document_path(job), 'wb')
+        try:
+            while True:
+                chunk = await file.read(pow(1024, 2))
+                if not chunk:
+                    break
+                n_bytes += len(chunk)
+                if n_bytes > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f'At most {settings.jobs_max_file_mb}MB '
+                               f'allowed')
+                await run_in_threadpool(fp.write, chunk)
+        finally:
+            await run_in_threadpool(fp.close)
+        await jobs.submit(job)
+    except BaseException:
+        # Too large, the client went away or the disk is full: the job
+        # would otherwise be left uploading.
+        await run_in_threadpool(jobs.delete, job['id'])
+        raise
+    return job_status(await run_in_threadpool(jobs.get, job['id']))
+
+
+@app.get('/api/jobs/{job_id}',
+         response_model=Job,
+         dependencies=[Depends(require_jobs)])
+def get_job(job_id: str):
+    """The status and progress of a document translation job."""
+    return job_status(jobs.get(job_id))
+
+
+@app.get('/api/jobs/{job_id}/progress', dependencies=[Depends(require_jobs)])
+async def job_progress(job_id: str, interval: float = 1.0):
+    """Stream the status of a job until it has finished.
+
+    The response is newline-delimited JSON, with a record each time the
+    job's status or progress changes.
+    """
+    await run_in_threadpool(jobs.get, job_id)
+    interval = max(interval, 0.1)
+
+    async def ndjson():
+        last = None
+        while True:
+            current = await jobs.poll(job_id)
+            if current is None:
+                return
+            record = job_status(current)
+            if record != last:
+                yield ndjson_line(record)
+                last = record
+            if current['status'] in FINISHED:
+                return
+            await asyncio.sleep(interval)
+
+    return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+
+
+@app.get('/api/jobs/{job_id}/result', dependencies=[Depends(require_jobs)])
+def job_result(job_id: str):
+    """Download the translated document of a finished job.
+
+    Plain text documents are returned as plain text, line for line;
+    others as TSV with the source, reference and translated text of
+    each segment.
+    """
+    job = jobs.get(job_id)
+    if job['status'] != 'done':
+        raise HTTPException(status_code=409,
+                            detail=f'Job is {job["status"]}, not done')
+    filename = jobs.result_filename(job)
+    media_type = ('text/tab-separated-values'
+                  if filename.endswith('.tsv') else 'text/plain')
+    return StreamingResponse(
+        jobs.iter_result(job),
+        media_type=f'{media_type}; charset=utf-8',
+        headers={'Content-Disposition': content_disposition(filename)})
+
+
+@app.delete('/api/jobs/{job_id}',
+            status_code=204,
+            dependencies=[Depends(require_jobs)])
+def delete_job(job_id: str):
+    """Cancel a job, or delete a finished one and its documents."""
+    jobs.delete(job_id)
+    return Response(status_code=204)
@@ -0,0 +1,256 @@
+"""Management of marian-server worker processes."""
+from pathlib import Path
+from typing import List, Optional, Sequence
+import asyncio
+import logging
+import os
+import shlex
+import subprocess
+
+from .connections import ConnectionPool, connection_errors
+
+
+log = logging.getLogger(__name__)
+
+
+class NoWorkerAvailable(Exception):
+    """Raised when no marian-server worker process is running."""
+
+
+class MarianWorker:
+    """A marian-server process and a pool of connections to it."""
+
+    marian_server_cmd = ('marian-server '
+                         '--allow-unk '
+                         '-c {config_path} '
+                         '--port {ws_port}')
+
+    def __init__(self,
+                 config_path: Path,
+                 ws_port: int,
+                 cpu_threads: int = 0,
+                 cpus: Optional[Sequence[int]] = None,
+                 pool_size: int = 4,
+                 pool_wait_timeout: float = 30.0):
+        self.config_path = config_path
+        self.ws_port = ws_port
+        self.cpu_threads = cpu_threads
+        self.cpus = cpus
+        self.ws_addr = f'ws://127.0.0.1:{ws_port}/translate'
+        self.pool = ConnectionPool(self.ws_addr,
+                                   size=pool_size,
+                                   wait_timeout=pool_wait_timeout)
+        self.in_flight = 0
+        self.ready = False
+        self.proc = None
+
+    def __repr__(self):
+        return f'<MarianWorker port={self.ws_port}>'
+
+    @property
+    def cmd(self) -> List[str]:
+        cmd = self.marian_server_cmd.format(config_path=self.config_path,
+                                            ws_port=self.ws_port)
+        if self.cpu_threads:
+            cmd += f' --cpu-threads {self.cpu_threads}'
+        return shlex.split(cmd)
+
+    def _pin_cpus(self):
+        os.sched_setaffinity(0, self.cpus)
+
+    def is_alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        self.ready = False
+        preexec_fn = self._pin_cpus if self.cpus else None
+        self.proc = subprocess.Popen(self.cmd, preexec_fn=preexec_fn)
+
+    async def stop(self, timeout: float = 10.0):
+        """Stop marian-server, killing it if it has not exited within
+        `timeout` seconds."""
+        self.ready = False
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.pool.close)
+        if self.proc is None:
+            return
+        self.proc.terminate()
+        try:
+            await loop.run_in_executor(None, self.proc.wait, timeout)
+        except subprocess.TimeoutExpired:
+            log.warning('%r did not exit after %ss, killing it',
+                        self, timeout)
+            self.proc.kill()
+            await loop.run_in_executor(None, self.proc.wait)
+
+    async def wait_until_ready(self,
+                               probe: str,
+                               warmup: Sequence[str] = (),
+                               timeout: float = 300.0,
+                               interval: float = 0.5) -> bool:
+        """Wait until marian-server has loaded its model.
+
+        `probe` is sent until marian-server replies, then each of the
+        `warmup` messages is translated once before the worker is
+        marked as ready.
+
+        Returns false if the process exits in the meantime.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            if not self.is_alive():
+                return False
+            try:
+                await self.pool.asend_recv(probe)
+                break
+            except connection_errors:
+                if loop.time() > deadline:
+                    raise TimeoutError(f'{self!r} not ready after {timeout}s')
+                await asyncio.sleep(interval)
+        for message in warmup:
+            await self.pool.asend_recv(message)
+        self.ready = True
+        log.info('%r is ready', self)
+        return True
+
+    async def send_recv(self, message: str) -> str:
+        self.in_flight += 1
+        try:
+            return await self.pool.asend_recv(message)
+        finally:
+            self.in_flight -= 1
+
+
+class WorkerGroup:
+    """`n_workers` marian-server processes on consecutive ports.
+
+    Each message is routed to the ready worker with the fewest
+    messages in flight. Workers that exit unexpectedly are restarted
+    by `supervise`.
+
+    With `cpu_threads` set, each worker decodes on that many CPU
+    threads; `pin_cpus` additionally restricts worker `i` to cores
+    `i * cpu_threads` to `(i + 1) * cpu_threads - 1`.
+
+    On `shutdown`, workers that have not exited `stop_timeout` seconds
+    after being terminated are killed.
+    """
+
+    def __init__(self,
+                 config_path: Path,
+                 base_port: int,
+                 n_workers: int = 1,
+                 cpu_threads: int = 0,
+                 pin_cpus: bool = False,
+                 pool_size: int = 4,
+                 pool_wait_timeout: float = 30.0,
+                 startup_timeout: float = 300.0,
+                 stop_timeout: float = 10.0):
+        self.startup_timeout = startup_timeout
+        self.stop_timeout = stop_timeout
+        self.probe = ''
+        self.warmup = ()
+        self.workers = []
+        for i in range(n_workers):
+            cpus = None
+            if pin_cpus and cpu_threads:
+                cpus = range(i * cpu_threads, (i + 1) * cpu_threads)
+            worker = MarianWorker(config_path,
+                                  int(base_port) + i,
+                                  cpu_threads=cpu_threads,
+                                  cpus=cpus,
+                                  pool_size=pool_size,
+                                  pool_wait_timeout=pool_wait_timeout)
+            self.workers.append(worker)
+        self._supervisor = None
+        self._readiness = set()
+
+    @property
+    def live(self) -> bool:
+        return any(worker.is_alive() for worker in self.workers)
+
+    @property
+    def ready(self) -> bool:
+        return any(worker.ready and worker.is_alive()
+                   for worker in self.workers)
+
+    def status(self):
+        return [dict(port=worker.ws_port,
+                     alive=worker.is_alive(),
+                     ready=worker.ready,
+                     in_flight=worker.in_flight)
+                for worker in self.workers]
+
+    def least_loaded(self) -> MarianWorker:
+        ready = [worker
+                 for worker in self.workers
+                 if worker.ready and worker.is_alive()]
+        if not ready:
+            raise NoWorkerAvailable('No marian-server worker is ready')
+        return min(ready, key=lambda worker: worker.in_flight)
+
+    @staticmethod
+    def _log_readiness_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error('marian-server failed to start: %r', task.exception())
+
+    def _start_worker(self, worker: MarianWorker):
+        worker.start()
+        task = asyncio.ensure_future(
+            worker.wait_until_ready(self.probe,
+                                    self.warmup,
+                                    timeout=self.startup_timeout))
+        self._readiness.add(task)
+        task.add_done_callback(self._readiness.discard)
+        task.add_done_callback(self._log_readiness_failure)
+
+    async def send_recv(self, message: str) -> str:
+        return await self.least_loaded().send_recv(message)
+
+    async def supervise(self, interval: float = 5.0):
+        """Restart any worker whose process has exited."""
+        while True:
+            await asyncio.sleep(interval)
+            for worker in self.workers:
+                if worker.proc is not None and not worker.is_alive():
+                    log.warning('%r exited with status %s, restarting',
+                                worker,
+                                worker.proc.returncode)
+                    worker.ready = False
+                    try:
+                        self._start_worker(worker)
+                    except Exception:
+                        # e.g. marian-server is missing, or its CPUs
+                        # are not available: try again next time.
+                        log.exception('Failed to restart %r', worker)
+
+    async def start(self, probe: str = '', warmup: Sequence[str] = ()):
+        """Start all workers.
+
+        Returns immediately; each worker becomes ready once it has
+        answered `probe` and translated the `warmup` messages.
+        """
+        self.probe = probe
+        self.warmup = tuple(warmup)
+        for worker in self.workers:
+            self._start_worker(worker)
+        self._supervisor = asyncio.ensure_future(self.supervise())
+
+    async def wait_until_ready(self, timeout: Optional[float] = None):
+        """Wait for any worker to become ready."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.startup_timeout)
+        while not self.ready:
+            if loop.time() > deadline:
+                raise NoWorkerAvailable('No marian-server worker is ready')
+            await asyncio.sleep(0.1)
+
+    async def shutdown(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+        for task in list(self._readiness):
+            task.cancel()
+        await asyncio.gather(*(worker.stop(self.stop_timeout)
+                               for worker in self.workers))